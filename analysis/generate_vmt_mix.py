@@ -4,50 +4,101 @@ Run all the steps for VMT-Mix generation.
 import warnings
 warnings.simplefilter(action='ignore', category=Warning)
 
-from vmtmix_fy23.utils import timing
+import datetime
+from pathlib import Path
+from vmtmix_fy23.utils import (
+    timing, reset_metrics, set_validation_level, write_metrics_report, path_output
+)
+from vmtmix_fy23.profiling import StageProfiler, profile_stage, profiling_enabled
 from vmtmix_fy23 import (
-    i_raw_dt_prc, ii_dow_by_cls_fact_calc, iii_adt_to_aadt_fac, iv_mvc_hpms_counts,
-    v_SU_CT_sh_lh_dist, vi_sut_nd_fuel_mix, vii_vmt_mix_disagg
+    i_raw_dt_prc, perm_fac_engine, iv_mvc_hpms_counts, v_SU_CT_sh_lh_dist,
+    vi_sut_nd_fuel_mix, vii_vmt_mix_disagg
 )
 
 
 @timing
-def main(min_yr, max_yr):
+def main(
+    min_yr,
+    max_yr,
+    profile=None,
+    early_tod=False,
+    excl_holidays=False,
+    validation=None,
+):
+    """
+    Run all the steps for VMT-Mix generation for the years [min_yr, max_yr].
+    Set `profile` to True (or the VMTMIX_PROFILE environment variable to 1) to write a
+    flamegraph and a top-N hot-function table per stage to the run's profile folder.
+    Set `early_tod` to True to sum the hourly MVC counts to the TOD periods in stage iv
+    instead of stage vii; the VMT-Mix is the same and the stage vii frames are smaller.
+    Set `excl_holidays` to True to exclude the federal holidays from the permanent
+    counter factors. `validation` ("off", "fast", or "full") sets the level of the data
+    checks; None uses the VMTMIX_VALIDATION environment variable (default "full").
+    """
     suf1 = min_yr - 2000
     suf2 = max_yr - 2000
+    now_mntyr = datetime.datetime.now().strftime("%m%Y")
+    # Record wall time, CPU time, peak RSS, and row counts for each stage and sub-step.
+    reset_metrics()
+    set_validation_level(validation)
+    profiler = None
+    if profiling_enabled(profile):
+        profiler = StageProfiler(
+            path_run_dir=Path.joinpath(
+                path_output, f"profile_{suf1}_{suf2}_{now_mntyr}"
+            )
+        )
     # Process the raw MVC and permanent counter data to fix date time format, station id,
-    # map road types to MOVES, and save data to parquet for faster loading.
-    i_raw_dt_prc.raw_dt_prc(
-        MVC_file="MVC_2013_21_received_on_030922",
-        PERM_file="PERM_CLASS_BY_HR_2013_2021"
-    )
+    # map road types to MOVES, and save data to parquet for faster loading. Also save the
+    # ATR hourly data as a year-partitioned parquet dataset.
+    with profile_stage(profiler, "i_raw_dt_prc"):
+        i_raw_dt_prc.raw_dt_prc(
+            MVC_file="MVC_2013_21_received_on_030922",
+            PERM_file="PERM_CLASS_BY_HR_2013_2021",
+            ATR_file="TxDOT_PERM_HOURLY_DATA_2013_092021"
+        )
     # Create DOW by veh class factors that will be applied to the AADT from ATR data
-    # by vehicle class.
-    ii_dow_by_cls_fact_calc.dow_by_cls_fac(
-        out_fi="conv_aadt2dow_by_vehcat.tab", min_yr=min_yr, max_yr=max_yr
-    )
-    # Create DOW + Month Factors to convert the ADT data in the MVC to AADT data. These
-    # are not by vehicle class and computed from the expanded ATR data without vehicle
-    # class information.
-    iii_adt_to_aadt_fac.mth_dow_fac(
-        out_fi="conv_aadt2mnth_dow.tab", min_yr=min_yr, max_yr=max_yr
-    )
+    # by vehicle class, and DOW + Month Factors to convert the ADT data in the MVC to
+    # AADT data. The latter are not by vehicle class and computed from the expanded ATR
+    # data without vehicle class information. Each counter source is read once.
+    with profile_stage(profiler, "perm_fac_engine"):
+        perm_fac_engine.perm_cntr_facs(
+            out_fis={
+                "dow_agg_by_cls": "conv_aadt2dow_by_vehcat.tab",
+                "mnth_by_cls": "conv_aadt2mnth_by_vehcat.tab",
+                "mnth_dow": "conv_aadt2mnth_dow.tab",
+            },
+            min_yr=min_yr,
+            max_yr=max_yr,
+            excl_holidays=excl_holidays,
+        )
     # Compute the HPMS category counts from the MVC data and apply the above conversion
     # factors.
-    iv_mvc_hpms_counts.mvc_hpms_cnt(
-        out_fi=f"mvc_vmtmix_{suf1}_{suf2}", min_yr=min_yr, max_yr=max_yr
-    )
+    with profile_stage(profiler, "iv_mvc_hpms_counts"):
+        iv_mvc_hpms_counts.mvc_hpms_cnt(
+            out_fi=f"mvc_vmtmix_{suf1}_{suf2}",
+            min_yr=min_yr,
+            max_yr=max_yr,
+            early_tod=early_tod,
+        )
     # Get the SU and CT, Sh and Lh splits from FAF4 assignment and metadata using
     # ERG methodology and VIUS 2002 factor.
-    v_SU_CT_sh_lh_dist.faf4_su_ct_lh_sh_pct(out_fi="faf4_su_ct_lh_sh_pct.tab")
+    with profile_stage(profiler, "v_SU_CT_sh_lh_dist"):
+        v_SU_CT_sh_lh_dist.faf4_su_ct_lh_sh_pct(out_fi="faf4_su_ct_lh_sh_pct.tab")
     # Get the SUT dist within HPMS and the fuel dist from MOVES default database.
-    vi_sut_nd_fuel_mix.mvs_sut_nd_fuel_mx(
-        fueldist_outfi="mvs303fueldist.csv",
-        sut_hpms_dist_outfi="mvs303defaultsutdist.csv"
-    )
+    with profile_stage(profiler, "vi_sut_nd_fuel_mix"):
+        vi_sut_nd_fuel_mix.mvs_sut_nd_fuel_mx(
+            fueldist_outfi="mvs303fueldist.csv",
+            sut_hpms_dist_outfi="mvs303defaultsutdist.csv"
+        )
     # Appy the FAF4, and MOVES dist to the HPMS counts, filter data to different TODs,
     # and normalize the final counts to get the SUT-FT dist.
-    vii_vmt_mix_disagg.fin_vmt_mix(out_file_nm=f"fy23_fin_vmtmix_{suf1}_{suf2}")
+    with profile_stage(profiler, "vii_vmt_mix_disagg"):
+        vii_vmt_mix_disagg.fin_vmt_mix(out_file_nm=f"fy23_fin_vmtmix_{suf1}_{suf2}")
+    # Write the per-stage metrics report to track regressions across data deliveries.
+    write_metrics_report(
+        path_out_dir=path_output, out_fi=f"metrics_{suf1}_{suf2}_{now_mntyr}"
+    )
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ Created by: Apoorb
 Created on: 02/22/2023
 """
 import pandas as pd
+from vmtmix_fy23.compare_vmtmix import compare_vmtmix, fmt_summary, read_vmtmix
 
 
 def test_code_produce_same_vmt_mix_as_fy22():
@@ -17,9 +18,451 @@ def test_code_produce_same_vmt_mix_as_fy22():
         r"\TxDOT_TPP_Projects - Task 5.3 Activity Forecasting Factors\Data"
         r"\output\fy23_fin_vmtmix_13_19_022023.csv"
     )
-    apr22_vmt_mix = pd.read_csv(p_apr22_vmt_mix)
-    feb23_vmt_mix = pd.read_csv(p_feb23_vmt_mix)
+    # Same columns; rows aligned on the keys with the default assert_frame_equal
+    # tolerances for vmt_mix and exact labels. The report shows the district, year, and
+    # TOD groups that changed.
+    assert pd.read_csv(p_apr22_vmt_mix, nrows=0).columns.equals(
+        pd.read_csv(p_feb23_vmt_mix, nrows=0).columns
+    )
+    apr22_vmt_mix = read_vmtmix(p_apr22_vmt_mix)
+    feb23_vmt_mix = read_vmtmix(p_feb23_vmt_mix)
     feb23_vmt_mix = feb23_vmt_mix.loc[lambda df: df.yearID >= 2010].reset_index(
         drop=True
     )
-    pd.testing.assert_frame_equal(apr22_vmt_mix, feb23_vmt_mix)
+    report, summary = compare_vmtmix(
+        base_=apr22_vmt_mix, new_=feb23_vmt_mix, atol=1e-8, rtol=1e-5
+    )
+    assert summary["passed"], fmt_summary(report, summary)
+
+
+def test_mvc_duckdb_backend_same_as_pandas():
+    from vmtmix_fy23.iv_mvc_hpms_counts import MVCVmtMix, MVCVmtMixDuckDB
+
+    mvcvmtmix_pd = MVCVmtMix(min_yr_=2013, max_yr_=2019)
+    mvcvmtmix_db = MVCVmtMixDuckDB(min_yr_=2013, max_yr_=2019)
+    for spatial_level in ["county", "district", "dgcode", "state"]:
+        keys = [spatial_level, "mvs_rdtype_nm", "mvs_rdtype", "hour"]
+        for method in ["agg_mvc_counts", "get_mvc_sample_size"]:
+            out_pd = getattr(mvcvmtmix_pd, method)(spatial_level=spatial_level)
+            out_db = getattr(mvcvmtmix_db, method)(spatial_level=spatial_level)
+            out_pd, out_db = (
+                df.assign(mvs_rdtype=lambda df: df.mvs_rdtype.astype(str))
+                .sort_values(keys)
+                .reset_index(drop=True)
+                for df in (out_pd, out_db)
+            )
+            pd.testing.assert_frame_equal(out_pd, out_db, check_dtype=False)
+
+
+def test_moves_export_to_sqlite(tmp_path):
+    from sqlalchemy import create_engine
+    from vmtmix_fy23.moves_export import export_vmt_mix_to_moves
+
+    vmt_mix = pd.DataFrame(
+        [
+            (district, 2020, "Wkd", tod, rd, rd_nm, 21, 1, 0.5)
+            for district in ["Austin", "Waco"]
+            for tod in ["AM", "PM"]
+            for rd, rd_nm in [("2", "Rural Restricted"), ("ALL", "ALL")]
+        ],
+        columns=[
+            "district",
+            "yearID",
+            "dowagg",
+            "tod",
+            "mvs_rdtype",
+            "mvs_rdtype_nm",
+            "sourceTypeID",
+            "fuelTypeID",
+            "vmt_mix",
+        ],
+    ).assign(vmt_mix=lambda df: df.vmt_mix + (df.district == "Waco") * 0.25)
+    county_dist = pd.DataFrame(
+        {
+            "fips_st_cn": [48453, 48491, 48309],
+            "cnty_nm": ["Travis", "Williamson", "McLennan"],
+            "district": ["Austin", "Austin", "Waco"],
+        }
+    )
+
+    def engine_factory(db_nm):
+        return create_engine(f"sqlite:///{tmp_path / db_nm}.db")
+
+    for _ in range(2):  # Loading again replaces the rows.
+        db_nms = export_vmt_mix_to_moves(
+            vmt_mix_=vmt_mix, engine_factory=engine_factory, county_dist_=county_dist
+        )
+    assert db_nms == ["c48453y2020_in", "c48491y2020_in", "c48309y2020_in"]
+    for db_nm, exp_vmt_mix in zip(db_nms, [0.5, 0.5, 0.75]):
+        out = pd.read_sql_table("vmtmix", engine_factory(db_nm))
+        assert len(out) == 2
+        assert (out.roadTypeID == 2).all() and (out.vmtMixFraction == exp_vmt_mix).all()
+
+
+def test_moves_export_load_data_infile_file():
+    import re
+    from vmtmix_fy23.moves_export import load_data_infile, moves_metadata
+
+    tbl = moves_metadata.tables["vmtmix"]
+    data = pd.DataFrame({col.name: [1, 2] for col in tbl.columns}).astype(
+        {"vmtMixFraction": float}
+    )
+    data.loc[1, "vmtMixFraction"] = float("nan")
+    loaded = {}
+
+    class Conn:
+        def execute(self, stmt):
+            # Read the temporary file before load_data_infile removes it.
+            path_tmp = re.search(r"INFILE '([^']+)'", str(stmt)).group(1)
+            with open(path_tmp, "rb") as fi:
+                loaded["lines"] = fi.read().split(b"\n")
+            loaded["sql"] = str(stmt)
+
+    load_data_infile(Conn(), tbl, data)
+    assert "LINES TERMINATED BY '\\n'" in loaded["sql"]
+    assert loaded["lines"][-1] == b"" and len(loaded["lines"]) == 3
+    assert not any(b"\r" in line for line in loaded["lines"])
+    assert loaded["lines"][0].split(b"\t")[-1] == b"1.0"
+    assert loaded["lines"][1].split(b"\t")[-1] == b"\\N"
+
+
+def test_interp_yearIDs_keeps_moves_years_and_sums_to_one():
+    from vmtmix_fy23.vi_sut_nd_fuel_mix import interp_yearIDs
+
+    fueldist = pd.DataFrame(
+        {
+            "sourceTypeID": [21, 21, 21, 21],
+            "yearID": [2020, 2020, 2025, 2025],
+            "fuelTypeID": [1, 2, 1, 2],
+            "weighted_stmyFraction_1": [0.9, 0.1, 0.7, 0.3],
+        }
+    )
+    out = interp_yearIDs(
+        fueldist, frac_col_="weighted_stmyFraction_1", sum_grp_cols_=["sourceTypeID"]
+    )
+    assert list(out.columns) == list(fueldist.columns)
+    assert sorted(out.yearID.unique()) == list(range(2020, 2026))
+    assert (out.groupby("yearID").weighted_stmyFraction_1.sum() - 1).abs().max() < 1e-12
+    out = out.set_index(["yearID", "fuelTypeID"]).weighted_stmyFraction_1
+    assert out[(2020, 1)] == 0.9 and out[(2025, 2)] == 0.3
+    assert abs(out[(2022, 1)] - 0.82) < 1e-12
+
+
+def test_age_weighted_fueldist_same_as_merge():
+    from vmtmix_fy23.vi_sut_nd_fuel_mix import get_age_weighted_fueldist
+
+    samvehpop = pd.DataFrame(
+        [
+            (st, my, ftype, frac)
+            for st in [21, 62]
+            for my in range(2015, 2021)
+            for ftype, frac in ([(1, 0.8), (2, 0.2)] if st == 21 else [(2, 1.0)])
+        ],
+        columns=["sourceTypeID", "modelYearID", "fuelTypeID", "stmyFraction"],
+    ).assign(stmyFraction=lambda df: df.stmyFraction - 0.01 * (df.modelYearID - 2015))
+    souagedis = pd.DataFrame(
+        [
+            (st, yr, age, frac)
+            for st in [21, 62]
+            for yr in [2019, 2020]
+            for age, frac in [(0, 0.5), (1, 0.3), (2, 0.2)]
+        ],
+        columns=["sourceTypeID", "yearID", "ageID", "ageFraction"],
+    )
+    merged = souagedis.assign(modelYearID=lambda df: df.yearID - df.ageID).merge(
+        samvehpop, on=["sourceTypeID", "modelYearID"], how="left"
+    )
+    exp = (
+        merged.assign(weighted_stmyFraction=merged.ageFraction * merged.stmyFraction)
+        .groupby(["sourceTypeID", "fuelTypeID", "yearID"], as_index=False)
+        .weighted_stmyFraction.sum()
+    )
+    pd.testing.assert_frame_equal(
+        get_age_weighted_fueldist(souagedis, samvehpop), exp, check_dtype=False
+    )
+
+
+def test_roadtype_id_and_rdtype_labs():
+    from vmtmix_fy23.utils import ALL_RDTYPE_ID, get_roadtype_id
+    from vmtmix_fy23.vii_vmt_mix_disagg import get_rdtype_labs
+
+    assert list(get_roadtype_id(["2", "5.0", 3, "ALL"])) == [2, 5, 3, ALL_RDTYPE_ID]
+    mvc_vmtmix = pd.DataFrame(
+        {
+            "mvs_rdtype": ["ALL", "2", "2", "4"],
+            "mvs_rdtype_nm": ["All", "r_ra", "r_ra", "u_ra"],
+        }
+    )
+    rdtype_labs = get_rdtype_labs(mvc_vmtmix)
+    assert list(rdtype_labs.columns) == ["roadTypeID", "mvs_rdtype", "mvs_rdtype_nm"]
+    assert list(rdtype_labs.roadTypeID) == [ALL_RDTYPE_ID, 2, 4]
+
+
+def test_vmt_mix_store_round_trip(tmp_path):
+    from itertools import product
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    from vmtmix_fy23.vmt_mix_store import (
+        get_vmt_mix,
+        vmt_mix_partitioning,
+        write_vmt_mix_dataset,
+    )
+
+    vmt_mix = pd.DataFrame(
+        product(
+            ["Fort Worth", "Austin", "A/B"],
+            [2021, 2020],
+            ["Wkd", "Sat"],
+            ["AM", "PM"],
+            ["u_ra", "r_ra"],
+            [31, 21],
+            [2, 1],
+        ),
+        columns=[
+            "district",
+            "yearID",
+            "dowagg",
+            "tod",
+            "mvs_rdtype_nm",
+            "sourceTypeID",
+            "fuelTypeID",
+        ],
+    )
+    vmt_mix.insert(0, "dgcode", vmt_mix.district.str[:2])
+    vmt_mix["vmt_mix"] = [i / len(vmt_mix) for i in range(len(vmt_mix))]
+    path_dataset = tmp_path / "fin_vmtmix"
+    write_vmt_mix_dataset(vmt_mix, path_dataset)
+    assert (path_dataset / "district=A%2FB" / "yearID=2020").is_dir()
+    assert (path_dataset / "district=Fort%20Worth" / "yearID=2021").is_dir()
+    # Partition and row group pruning
+    dataset = ds.dataset(
+        path_dataset, format="parquet", partitioning=vmt_mix_partitioning
+    )
+    filt = (
+        (pc.field("district") == "A/B")
+        & (pc.field("yearID") == 2020)
+        & (pc.field("tod") == "AM")
+    )
+    frags = list(dataset.get_fragments(filter=filt))
+    assert len(frags) == 1
+    assert frags[0].metadata.num_row_groups == 4
+    assert len(frags[0].split_by_row_group(filt, schema=dataset.schema)) == 2
+    # Slices equal a pandas filter, in the column order and dtypes of the VMT-Mix
+    sort_cols = vmt_mix.columns[1:-1].to_list()
+    for kwargs, mask in [
+        ({}, vmt_mix.yearID > 0),
+        (
+            {"district": "A/B", "year": 2020, "dowagg": "Sat", "tod": "AM"},
+            (vmt_mix.district == "A/B")
+            & (vmt_mix.yearID == 2020)
+            & (vmt_mix.dowagg == "Sat")
+            & (vmt_mix.tod == "AM"),
+        ),
+        (
+            {"district": ["Fort Worth", "A/B"], "year": [2021], "tod": ["PM"]},
+            vmt_mix.district.isin(["Fort Worth", "A/B"])
+            & (vmt_mix.yearID == 2021)
+            & (vmt_mix.tod == "PM"),
+        ),
+    ]:
+        out = get_vmt_mix(path_dataset=path_dataset, **kwargs)
+        exp = vmt_mix.loc[mask].sort_values(sort_cols).reset_index(drop=True)
+        pd.testing.assert_frame_equal(out, exp)
+    out = get_vmt_mix(
+        district="Austin", columns=["vmt_mix", "tod"], path_dataset=path_dataset
+    )
+    assert list(out.columns) == ["vmt_mix", "tod"] and len(out) == len(vmt_mix) // 3
+
+
+def test_vmt_mix_service_same_as_pandas_filter(tmp_path):
+    from itertools import product
+    import time
+    from vmtmix_fy23.vmt_mix_service import (
+        VmtMixService,
+        prune_runs,
+        publish_vmt_mix,
+        vmt_mix_key_cols,
+    )
+
+    vmt_mix = pd.DataFrame(
+        product(
+            ["Waco", "Austin", "Tyler", "Bryan", "Lufkin", "Paris"],
+            [2021, 2020],
+            ["Wkd", "Sat"],
+            ["PM", "AM", "day"],
+            ["u_ra", "r_ra"],
+            [31, 21],
+        ),
+        columns=vmt_mix_key_cols + ["sourceTypeID"],
+    )
+    vmt_mix["vmt_mix"] = [(i % 7) / 7 for i in range(len(vmt_mix))]
+
+    def to_pandas(tbl):
+        out = tbl.to_pandas()
+        cat_cols = out.select_dtypes("category").columns
+        return out.astype({col: vmt_mix[col].dtype for col in cat_cols})
+
+    publish_vmt_mix(vmt_mix, run_nm="run_1", path_service_dir=tmp_path)
+    service = VmtMixService(path_service_dir=tmp_path)
+    index = service.get_index()
+    assert index.run_info["run_nm"] == "run_1"
+    exp_all = vmt_mix.sort_values(vmt_mix_key_cols, kind="stable")
+    for params, mask in [
+        ({}, exp_all.yearID > 0),
+        (
+            {"district": "Tyler", "year": "2020"},
+            (exp_all.district == "Tyler") & (exp_all.yearID == 2020),
+        ),
+        (
+            {"year": 2021, "tod": "AM"},
+            (exp_all.yearID == 2021) & (exp_all.tod == "AM"),
+        ),
+        ({"mvs_rdtype_nm": "r_ra"}, exp_all.mvs_rdtype_nm == "r_ra"),
+        ({"district": "Dallas"}, exp_all.district == "Dallas"),
+    ]:
+        pd.testing.assert_frame_equal(
+            to_pandas(index.get_slice(**params)),
+            exp_all.loc[mask].reset_index(drop=True),
+        )
+    agg = to_pandas(
+        index.get_agg(by=["sourceTypeID", "tod"], fn="mean", year=2020, dowagg="Sat")
+    )
+    exp_agg = (
+        vmt_mix.loc[lambda df: (df.yearID == 2020) & (df.dowagg == "Sat")]
+        .groupby(["sourceTypeID", "tod"], as_index=False)
+        .vmt_mix.mean()
+        .rename(columns={"vmt_mix": "vmt_mix_mean"})
+    )
+    pd.testing.assert_frame_equal(agg, exp_agg)
+    # Hot reload of a new run, and pruning of the old runs
+    for run_nm in ["run_2", "run_3"]:
+        time.sleep(0.02)
+        publish_vmt_mix(
+            vmt_mix.assign(vmt_mix=vmt_mix.vmt_mix * 2),
+            run_nm=run_nm,
+            path_service_dir=tmp_path,
+            n_keep=2,
+        )
+    index_new, tbl = service.query({"district": "Waco", "by": "tod"})
+    assert index_new is not index and index_new.run_info["run_nm"] == "run_3"
+    exp_waco = exp_all.loc[lambda df: df.district == "Waco"].vmt_mix.sum() * 2
+    assert abs(sum(tbl.column("vmt_mix_sum").to_pylist()) - exp_waco) < 1e-9
+    assert sorted(path.name[:5] for path in tmp_path.glob("*.arrow")) == [
+        "run_2",
+        "run_3",
+    ]
+    prune_runs(tmp_path, n_keep=1)
+    assert [path.name[:5] for path in tmp_path.glob("*.arrow")] == ["run_3"]
+
+
+def test_sta_dedup_same_as_merge():
+    import numpy as np
+    from vmtmix_fy23.i_raw_dt_prc import get_sta_pre_id_suf_cmb
+
+    # (station id, year, class2 of the two hours); the ALL volume of L1 and L3 in
+    # 2021 exceeds the directional volume, and L2 in 2021 has less.
+    stas = [
+        ("L1", 2020, [5, 6]),
+        ("L1", 2021, [60, 40]),
+        ("L1_EB", 2021, [15, 15]),
+        ("L1_WB", 2021, [20, 20]),
+        ("L2_EB", 2020, [7, np.nan]),
+        ("L2_WB", 2020, [8, 9]),
+        ("L2", 2021, [20, 30]),
+        ("L2_EB", 2021, [15, 15]),
+        ("L2_WB", 2021, [20, 20]),
+        ("L3", 2020, [np.nan, 1]),
+        ("L3", 2021, [50, 30]),
+        ("L3_NB", 2021, [5, 5]),
+        ("L4_SB", 2021, [3, 4]),
+    ]
+    data = pd.DataFrame(
+        [
+            (sta_id, pd.Timestamp(year, 3, 1, hour), class2)
+            for sta_id, year, class2s in stas
+            for hour, class2 in enumerate(class2s)
+        ],
+        columns=["station_id", "start_datetime", "class2"],
+    ).sample(frac=1, random_state=0, ignore_index=True)
+    # Merge-based de-duplication of the original implementation
+    exp = data.copy()
+    exp[["loc_id", "dir"]] = exp.station_id.str.split("_", expand=True)
+    exp["dir"] = exp["dir"].fillna("ALL")
+    exp["year_"] = exp.start_datetime.dt.year
+    unq_sta = (
+        exp.assign(has_dir=exp.dir != "ALL")
+        .groupby(["year_", "loc_id"], as_index=False)
+        .has_dir.any()
+        .assign(use_ALL=lambda df: ~df.has_dir)
+        .drop(columns="has_dir")
+    )
+    exp["sta_pre_id_suf_fr"] = exp["loc_id"]
+    exp["is_ALL"] = exp["dir"] == "ALL"
+    exp = exp.merge(unq_sta, on=["year_", "loc_id"])
+    exp["keep_rows"] = exp.is_ALL == exp.use_ALL
+    exp = exp.loc[exp.keep_rows].reset_index(drop=True)
+    for n_jobs in [1, 2]:
+        out = get_sta_pre_id_suf_cmb(data.copy(), "station_id", n_jobs=n_jobs)
+        pd.testing.assert_frame_equal(out, exp)
+    assert set(out.station_id) == {
+        "L1",
+        "L1_EB",
+        "L1_WB",
+        "L2_EB",
+        "L2_WB",
+        "L3",
+        "L3_NB",
+        "L4_SB",
+    }
+
+
+def test_partition_map_reduce_same_as_serial():
+    import numpy as np
+    from vmtmix_fy23.iv_mvc_hpms_counts import grp_mean, grp_suff_stats
+    from vmtmix_fy23.utils import partition_map_reduce
+
+    rng = np.random.default_rng(0)
+    n_row = 2000
+    sta_code = rng.integers(0, 40, n_row)
+    district = np.array(["Waco", "Austin", "Tyler", "Bryan", "Paris"])[sta_code % 5]
+    county = pd.Series(district + "_" + (sta_code % 3).astype(str), dtype=object)
+    # Stations with a missing county
+    county[sta_code % 7 == 0] = np.nan
+    data = pd.DataFrame(
+        {
+            "sta_code": sta_code,
+            "district": district,
+            "county": county,
+            "mvs_rdtype_nm": np.where(sta_code % 2 == 0, "r_ra", "u_ra"),
+            "year": rng.integers(2018, 2020, n_row),
+            "hour": rng.integers(0, 24, n_row),
+            "pc": rng.random(n_row) * 1000,
+            "su": rng.random(n_row) * 100,
+        }
+    )
+    data.loc[rng.random(n_row) < 0.1, "pc"] = np.nan
+    data.loc[rng.random(n_row) < 0.1, "su"] = np.nan
+    for partition_col, map_fn, keys in [
+        ("sta_code", grp_mean, ["sta_code", "year", "hour"]),
+        ("district", grp_suff_stats, ["district", "county", "mvs_rdtype_nm", "hour"]),
+    ]:
+        serial = partition_map_reduce(
+            data,
+            partition_col=partition_col,
+            map_fn=map_fn,
+            n_jobs=1,
+            keys_=keys,
+            cols_=["pc", "su"],
+        )
+        parallel = partition_map_reduce(
+            data,
+            partition_col=partition_col,
+            map_fn=map_fn,
+            n_jobs=2,
+            n_parts=4,
+            keys_=keys,
+            cols_=["pc", "su"],
+        )
+        pd.testing.assert_frame_equal(parallel, serial, check_exact=True)
+    # The missing counties are kept as groups in the sufficient statistics.
+    assert serial.county.isna().any()
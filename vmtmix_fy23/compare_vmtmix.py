@@ -0,0 +1,377 @@
+"""
+Compare two VMT-Mix outputs (fin_vmtmix csv or parquet files) and report where they
+differ. The outputs are read with fixed arrow dtypes, aligned on the key columns with
+a sort-merge on integer-coded keys, and the max absolute and relative deltas of the
+value columns are reported by group (district, yearID, tod by default). Used to gate a
+new data delivery against the previous VMT-Mix.
+    python -m vmtmix_fy23.compare_vmtmix base.csv new.parquet --rtol 1e-5
+Created by: Apoorb
+Created on: 03/14/2023
+"""
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+_str_type = pa.dictionary(pa.int32(), pa.string())
+vmtmix_schema = pa.schema(
+    [
+        ("dgcode", _str_type),
+        ("txdot_dist", pa.int16()),
+        ("district", _str_type),
+        ("county", _str_type),
+        ("mvs_rdtype_nm", _str_type),
+        ("mvs_rdtype", _str_type),
+        ("dowagg", _str_type),
+        ("yearID", pa.int16()),
+        ("tod", _str_type),
+        ("sourceTypeName", _str_type),
+        ("sourceTypeID", pa.int16()),
+        ("fuelTypeID", pa.int16()),
+        ("fuelTypeDesc", _str_type),
+        ("vmt_mix", pa.float64()),
+    ]
+)
+vmtmix_key_cols = [
+    "district",
+    "yearID",
+    "dowagg",
+    "tod",
+    "mvs_rdtype_nm",
+    "sourceTypeID",
+    "fuelTypeID",
+]
+vmtmix_value_cols = ["vmt_mix"]
+vmtmix_grp_cols = ["district", "yearID", "tod"]
+
+
+def get_key_cols(base_, new_):
+    """
+    Default key columns, `vmtmix_key_cols`, with county after district when both
+    outputs have it (county VMT-Mix, fin_vmtmix_county_*.csv).
+    """
+    if ("county" in base_.columns) and ("county" in new_.columns):
+        idx = vmtmix_key_cols.index("district") + 1
+        return vmtmix_key_cols[:idx] + ["county"] + vmtmix_key_cols[idx:]
+    return list(vmtmix_key_cols)
+
+
+def read_vmtmix(path_vmtmix, columns=None):
+    """
+    Read a VMT-Mix output (.csv or .parquet) with the dtypes in `vmtmix_schema`. String
+    columns are read as categoricals. Columns not in `vmtmix_schema` are dropped.
+
+    Parameters
+    ----------
+    path_vmtmix: str or Path
+    columns: list, optional
+        Columns to read. Defaults to all the `vmtmix_schema` columns in the file.
+    Returns
+    -------
+    pd.DataFrame
+    """
+    path_vmtmix = Path(path_vmtmix)
+    if path_vmtmix.suffix.lower() == ".parquet":
+        file_cols = pq.read_schema(path_vmtmix).names
+    else:
+        file_cols = pd.read_csv(path_vmtmix, nrows=0).columns.to_list()
+    if columns is None:
+        columns = vmtmix_schema.names
+    read_cols = [col for col in columns if col in file_cols]
+    read_schema = pa.schema([vmtmix_schema.field(col) for col in read_cols])
+    if path_vmtmix.suffix.lower() == ".parquet":
+        tbl = pq.read_table(path_vmtmix, columns=read_cols)
+        tbl = tbl.cast(read_schema)
+    else:
+        tbl = pa_csv.read_csv(
+            path_vmtmix,
+            convert_options=pa_csv.ConvertOptions(
+                column_types=read_schema, include_columns=read_cols
+            ),
+        )
+    return tbl.to_pandas()
+
+
+def encode_cols(col_a, col_b):
+    """
+    Code the values of two columns with a shared, sorted set of uniques. Categorical
+    columns are coded from their categories, so only the categories are sorted.
+
+    Returns
+    -------
+    tuple
+        codes of `col_a`, codes of `col_b` (int64 arrays), and the sorted uniques.
+    """
+    if isinstance(col_a.dtype, pd.CategoricalDtype):
+        vals_a, codes_a = col_a.cat.categories.to_numpy(), col_a.cat.codes.to_numpy()
+    else:
+        codes_a, vals_a = pd.factorize(col_a, sort=False)
+        vals_a = np.asarray(vals_a)
+    if isinstance(col_b.dtype, pd.CategoricalDtype):
+        vals_b, codes_b = col_b.cat.categories.to_numpy(), col_b.cat.codes.to_numpy()
+    else:
+        codes_b, vals_b = pd.factorize(col_b, sort=False)
+        vals_b = np.asarray(vals_b)
+    if (codes_a < 0).any() or (codes_b < 0).any():
+        raise ValueError(f"Key column {col_a.name} has missing values.")
+    uniques = np.union1d(vals_a, vals_b)
+    map_a = np.searchsorted(uniques, vals_a).astype(np.int64)
+    map_b = np.searchsorted(uniques, vals_b).astype(np.int64)
+    return map_a[codes_a], map_b[codes_b], uniques
+
+
+def get_sorted_keys(key_, side):
+    """Sort the integer keys of one output and check they are unique."""
+    order = np.argsort(key_, kind="stable")
+    key_sorted = key_[order]
+    dup = key_sorted[1:] == key_sorted[:-1]
+    if dup.any():
+        raise ValueError(
+            f"{side} output has {int(dup.sum())} duplicate rows on the key columns."
+        )
+    return order, key_sorted
+
+
+def get_deltas(val_base_, val_new_, atol, rtol):
+    """
+    Absolute and relative deltas of the new values from the base values, and a mask of
+    the values outside the tolerance, |new - base| > atol + rtol * |base| (same as
+    np.isclose). Both NaN counts as equal; one NaN is an infinite delta.
+    """
+    both_nan = np.isnan(val_base_) & np.isnan(val_new_)
+    abs_delta = np.abs(val_new_ - val_base_)
+    abs_delta = np.where(both_nan, 0.0, abs_delta)
+    abs_delta = np.where(np.isnan(abs_delta), np.inf, abs_delta)
+    abs_base = np.abs(val_base_)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_delta = np.where(abs_delta == 0, 0.0, abs_delta / abs_base)
+    fail = abs_delta > atol + rtol * np.nan_to_num(abs_base)
+    return abs_delta, rel_delta, fail
+
+
+def compare_vmtmix(
+    base_,
+    new_,
+    key_cols=None,
+    value_cols=None,
+    grp_cols=None,
+    atol=1e-8,
+    rtol=1e-5,
+    year_ids=None,
+):
+    """
+    Compare two VMT-Mix outputs. Rows are matched on `key_cols`; the value columns are
+    compared with the `atol` and `rtol` tolerances, and the other columns in both
+    outputs (labels like dgcode and sourceTypeName) must be equal.
+
+    Parameters
+    ----------
+    base_: pd.DataFrame or str or Path
+        Reference output (e.g., the previous year's VMT-Mix).
+    new_: pd.DataFrame or str or Path
+        Output to check.
+    key_cols: list, optional
+        Columns that identify a row. Defaults to `vmtmix_key_cols`, plus county when
+        both outputs have it.
+    value_cols: list, optional
+        Columns compared with tolerances. Defaults to `vmtmix_value_cols`.
+    grp_cols: list, optional
+        Subset of `key_cols` to report the deltas by. Defaults to `vmtmix_grp_cols`.
+    atol, rtol: float
+        Absolute and relative tolerance.
+    year_ids: list, optional
+        Only compare these analysis years.
+    Returns
+    -------
+    tuple
+        Report by group (pd.DataFrame) and summary (dict). The report has the matched
+        row count, the rows missing from either output, the max absolute and relative
+        delta and the rows outside the tolerance for each value column, the rows with
+        different labels, and if the group passed.
+    """
+    value_cols = vmtmix_value_cols if value_cols is None else list(value_cols)
+    grp_cols = vmtmix_grp_cols if grp_cols is None else list(grp_cols)
+    if not isinstance(base_, pd.DataFrame):
+        base_ = read_vmtmix(base_)
+    if not isinstance(new_, pd.DataFrame):
+        new_ = read_vmtmix(new_)
+    key_cols = get_key_cols(base_, new_) if key_cols is None else list(key_cols)
+    assert set(grp_cols) <= set(key_cols), "grp_cols should be a subset of key_cols"
+    if year_ids is not None:
+        base_ = base_.loc[lambda df: df.yearID.isin(year_ids)]
+        new_ = new_.loc[lambda df: df.yearID.isin(year_ids)]
+    for side, data in [("base", base_), ("new", new_)]:
+        miss_cols = set(key_cols + value_cols) - set(data.columns)
+        if miss_cols:
+            raise ValueError(f"{side} output is missing columns {sorted(miss_cols)}.")
+    attr_cols = [
+        col
+        for col in base_.columns
+        if (col in new_.columns) and (col not in key_cols + value_cols)
+    ]
+    # Integer-coded keys
+    # ------------------
+    codes_base, codes_new, uniques = {}, {}, {}
+    for col in key_cols:
+        codes_base[col], codes_new[col], uniques[col] = encode_cols(
+            base_[col], new_[col]
+        )
+    dims = [max(len(uniques[col]), 1) for col in key_cols]
+    key_base = np.ravel_multi_index([codes_base[col] for col in key_cols], dims)
+    key_new = np.ravel_multi_index([codes_new[col] for col in key_cols], dims)
+    grp_dims = [max(len(uniques[col]), 1) for col in grp_cols]
+    grp_base = np.ravel_multi_index([codes_base[col] for col in grp_cols], grp_dims)
+    grp_new = np.ravel_multi_index([codes_new[col] for col in grp_cols], grp_dims)
+    # Sort-merge
+    # ----------
+    order_base, key_base_sorted = get_sorted_keys(key_base, side="base")
+    order_new, key_new_sorted = get_sorted_keys(key_new, side="new")
+    pos = np.searchsorted(key_new_sorted, key_base_sorted)
+    pos_clip = np.minimum(pos, max(len(key_new_sorted) - 1, 0))
+    if len(key_new_sorted):
+        in_new = key_new_sorted[pos_clip] == key_base_sorted
+    else:
+        in_new = np.zeros(len(key_base_sorted), dtype=bool)
+    idx_base = order_base[in_new]
+    idx_new = order_new[pos_clip[in_new]]
+    in_base = np.zeros(len(key_new), dtype=bool)
+    in_base[idx_new] = True
+    # Deltas
+    # ------
+    grp_match = grp_base[idx_base]
+    report = pd.DataFrame({"grp": grp_match})
+    fail_any = np.zeros(len(idx_base), dtype=bool)
+    for col in value_cols:
+        abs_delta, rel_delta, fail = get_deltas(
+            base_[col].to_numpy(dtype=np.float64)[idx_base],
+            new_[col].to_numpy(dtype=np.float64)[idx_new],
+            atol=atol,
+            rtol=rtol,
+        )
+        report[f"max_abs_delta_{col}"] = abs_delta
+        report[f"max_rel_delta_{col}"] = rel_delta
+        report[f"n_fail_{col}"] = fail
+        fail_any |= fail
+    attr_diff = np.zeros(len(idx_base), dtype=bool)
+    for col in attr_cols:
+        val_base = base_[col].to_numpy(dtype=object)[idx_base]
+        val_new = new_[col].to_numpy(dtype=object)[idx_new]
+        attr_diff |= ~(pd.isna(val_base) & pd.isna(val_new)) & (val_base != val_new)
+    report["n_attr_diff"] = attr_diff
+    report = report.groupby("grp").agg(
+        **{
+            "n_rows": ("n_attr_diff", "size"),
+            **{
+                f"{stat}_{col}": (f"{stat}_{col}", "max" if "max" in stat else "sum")
+                for col in value_cols
+                for stat in ["max_abs_delta", "max_rel_delta", "n_fail"]
+            },
+            "n_attr_diff": ("n_attr_diff", "sum"),
+        }
+    )
+    n_grp = int(np.prod(grp_dims))
+    grp_ids = np.flatnonzero(
+        np.bincount(grp_base, minlength=n_grp) + np.bincount(grp_new, minlength=n_grp)
+    )
+    report = report.reindex(grp_ids)
+    report.insert(
+        1,
+        "n_missing_new",
+        np.bincount(grp_base[order_base[~in_new]], minlength=n_grp)[grp_ids],
+    )
+    report.insert(
+        2,
+        "n_missing_base",
+        np.bincount(grp_new[~in_base], minlength=n_grp)[grp_ids],
+    )
+    count_cols = ["n_rows", "n_attr_diff"] + [f"n_fail_{col}" for col in value_cols]
+    report[count_cols] = report[count_cols].fillna(0).astype(np.int64)
+    report["passed"] = (
+        report[["n_missing_new", "n_missing_base"] + count_cols[1:]].sum(axis=1) == 0
+    )
+    grp_codes = np.unravel_index(grp_ids, grp_dims)
+    grp_lbls = pd.DataFrame(
+        {col: uniques[col][codes] for col, codes in zip(grp_cols, grp_codes)}
+    )
+    report = pd.concat([grp_lbls, report.reset_index(drop=True)], axis=1)
+    summary = {
+        "n_base": len(key_base),
+        "n_new": len(key_new),
+        "n_matched": len(idx_base),
+        "n_missing_new": int((~in_new).sum()),
+        "n_missing_base": int((~in_base).sum()),
+        "n_fail": int(fail_any.sum()),
+        "n_attr_diff": int(attr_diff.sum()),
+        **{
+            f"max_abs_delta_{col}": report[f"max_abs_delta_{col}"].max()
+            for col in value_cols
+        },
+        **{
+            f"max_rel_delta_{col}": report[f"max_rel_delta_{col}"].max()
+            for col in value_cols
+        },
+        "n_grp_failed": int((~report.passed).sum()),
+        "passed": bool(report.passed.all()),
+    }
+    return report, summary
+
+
+def fmt_summary(report_, summary_, max_grps=20):
+    """Summary and the failing groups with the largest deltas as text."""
+    lines = [f"{key}: {val}" for key, val in summary_.items()]
+    failed = report_.loc[lambda df: ~df.passed]
+    if len(failed):
+        sort_col = [col for col in failed.columns if col.startswith("max_abs_delta")]
+        failed = failed.sort_values(sort_col[0], ascending=False)
+        lines += ["", f"Failed groups (top {max_grps}):"]
+        lines += [failed.head(max_grps).to_string(index=False)]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare two VMT-Mix outputs (.csv or .parquet)."
+    )
+    parser.add_argument("base", help="Reference VMT-Mix output.")
+    parser.add_argument("new", help="VMT-Mix output to check.")
+    parser.add_argument("--atol", type=float, default=1e-8)
+    parser.add_argument("--rtol", type=float, default=1e-5)
+    parser.add_argument(
+        "--key-cols",
+        nargs="+",
+        default=None,
+        help="Defaults to vmtmix_key_cols, plus county if both outputs have it.",
+    )
+    parser.add_argument("--value-cols", nargs="+", default=vmtmix_value_cols)
+    parser.add_argument("--grp-cols", nargs="+", default=vmtmix_grp_cols)
+    parser.add_argument("--years", nargs="+", type=int, default=None)
+    parser.add_argument("--out", default=None, help="Write the report to this csv.")
+    args = parser.parse_args(argv)
+    report, summary = compare_vmtmix(
+        base_=args.base,
+        new_=args.new,
+        key_cols=args.key_cols,
+        value_cols=args.value_cols,
+        grp_cols=args.grp_cols,
+        atol=args.atol,
+        rtol=args.rtol,
+        year_ids=args.years,
+    )
+    print(fmt_summary(report, summary))
+    if args.out is not None:
+        report.to_csv(args.out, index=False)
+    return summary["passed"]
+
+
+if __name__ == "__main__":
+    passed = main()
+    print(
+        "----------------------------------------------------------------------------\n"
+        "Finished Processing compare_vmtmix.py\n"
+        "----------------------------------------------------------------------------\n"
+    )
+    sys.exit(0 if passed else 1)
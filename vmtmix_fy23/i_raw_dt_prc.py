@@ -8,7 +8,6 @@ Created/ Modified on: 02/14/2023
 import pandas as pd
 import numpy as np
 from pathlib import Path
-import geopandas as gpd
 import pyarrow.parquet as pq
 import pyarrow as pa
 import matplotlib.pyplot as plt
@@ -19,15 +18,19 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
 from vmtmix_fy23.utils import (
     ChainedAssignent,
+    add_calendar_cols,
+    add_sta_code,
     path_txdot_fy22,
-    path_county_shp,
     get_snake_case_dict,
+    partition_map_reduce,
     timing
 )
+from vmtmix_fy23.lookup_tbls import get_county
 
 switchoff_chainedass_warn = ChainedAssignent()
 
 
+@timing
 def clean_perm_countr() -> pd.DataFrame:
     """
     Clean and preprocess the PERM_CLASS_BY_HR_2013_2021 dataset, which contains hourly
@@ -85,7 +88,8 @@ def clean_perm_countr() -> pd.DataFrame:
     return perm_countr_1
 
 
-def clean_mvc_countr(mvc_file):
+@timing
+def clean_mvc_countr(mvc_file, n_jobs=1):
     """
     The function clean_mvc_countr takes a file path mvc_file as input and returns a
     pandas dataframe after cleaning and processing. `mvc_file` contains the Manual
@@ -103,6 +107,8 @@ def clean_mvc_countr(mvc_file):
     ----------
     mvc_file: str
         The name of the file to read and clean.
+    n_jobs: int
+        Number of processes used to de-duplicate the stations by year.
     Returns
     -------
     mvc_countr_fil: pd.DataFrame
@@ -131,10 +137,39 @@ def clean_mvc_countr(mvc_file):
             format="%m/%d/%Y %I:%M:%S %p",
         )
     mvc_countr_fil = mvc_countr_fil.drop(columns=["start_date", "start_time"])
-    mvc_countr_fil = get_sta_pre_id_suf_cmb(data_=mvc_countr_fil, sub_col="location_id")
+    mvc_countr_fil = get_sta_pre_id_suf_cmb(
+        data_=mvc_countr_fil, sub_col="location_id", n_jobs=n_jobs
+    )
     return mvc_countr_fil
 
 
+@timing
+def clean_atr_hourly(atr_file) -> pd.DataFrame:
+    """
+    Read the TxDOT ATR (permanent counter) hourly volume file `atr_file` with typed
+    columns: ST_DATE as datetime, the hourly volumes (H01--H24) and TOTAL as float, and
+    add the Year column used to partition the parquet dataset.
+    """
+    atr_count_columns = [f"H{hr:02d}" for hr in range(1, 25)] + ["TOTAL"]
+    path_atr_csv = Path.joinpath(path_txdot_fy22, atr_file)
+    atr_hourly = pd.read_csv(path_atr_csv, low_memory=False, dtype={"Date": str})
+    atr_hourly["ST_DATE"] = pd.to_datetime(atr_hourly.ST_DATE)
+    atr_hourly[atr_count_columns] = atr_hourly[atr_count_columns].astype(float)
+    atr_hourly["LOCAL_ID"] = atr_hourly["LOCAL_ID"].astype(str)
+    atr_hourly["Year"] = atr_hourly.ST_DATE.dt.year
+    return atr_hourly
+
+
+def save_atr_hourly_as_parquet(atr_hourly_, atr_out_dir):
+    """Save the ATR hourly data as a parquet dataset partitioned by year, so that the
+    readers can prune the years and columns they do not need."""
+    table_atr_hourly = pa.Table.from_pandas(atr_hourly_, preserve_index=False)
+    path_atr_hourly_pq = Path.joinpath(path_txdot_fy22, atr_out_dir)
+    pq.write_to_dataset(
+        table_atr_hourly, root_path=path_atr_hourly_pq, partition_cols=["Year"]
+    )
+
+
 def add_mvs_rdtype_to_mvc_new(mvc_countr_new_):
     """Add MOVES road type to the MVC data."""
     mvc_countr_new_ = mvc_countr_new_.assign(
@@ -192,83 +227,124 @@ def save_raw_data_as_parquet(
         pq.write_table(table_perm_countr, path_perm_countr_pq)
 
 
-def get_sta_pre_id_suf_cmb(data_, sub_col):
-    """Return concatenated station identifiers."""
-    # FixMe: Only keep unique stations. If the data has "ALL", "EB", and "WB". 
-    # Just keep "EB" and "WB".
-    ################
-    data_[["loc_id", "dir"]] = data_[sub_col].str.split("_", expand=True)
-    data_["dir"] = data_["dir"].fillna("ALL")
+def save_sta_dict(sta_dict_, sta_dict_out_fi):
+    """Save the station dictionary (integer station code to the station id string) next
+    to the counter data."""
+    table_sta_dict = pa.Table.from_pandas(sta_dict_, preserve_index=False)
+    pq.write_table(table_sta_dict, Path.joinpath(path_txdot_fy22, sta_dict_out_fi))
+
+
+def sta_dedup_mask(sta_keys_, n_loc_):
+    """
+    Decide which rows of the integer-coded station keys `sta_keys_` (columns pos,
+    year_, loc_code, is_ALL, class2) to keep. A location + year with directional
+    counts keeps its directional rows and drops its "ALL" rows; a location + year with
+    only "ALL" counts keeps the "ALL" rows. Also counts the location + years with both
+    "ALL" and directional counts where the "ALL" PC volume exceeds the sum of the
+    directional PC volumes.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, int]
+        Row positions with the use_ALL flag of their location + year, and the number of
+        location + years with the "ALL" PC volume exceeding the directional volume.
+    """
+    key = sta_keys_.year_.to_numpy(np.int64) * n_loc_ + sta_keys_.loc_code.to_numpy()
+    grp, grp_keys = pd.factorize(key)
+    n_grp = len(grp_keys)
+    is_all = sta_keys_.is_ALL.to_numpy()
+    class2 = np.nan_to_num(sta_keys_.class2.to_numpy(np.float64))
+    has_all = np.bincount(grp[is_all], minlength=n_grp) > 0
+    has_dir = np.bincount(grp[~is_all], minlength=n_grp) > 0
+    assert all(has_all | has_dir), "Either directional or total counts should be present."
+    pc_all = np.bincount(grp, weights=np.where(is_all, class2, 0), minlength=n_grp)
+    pc_dir = np.bincount(grp, weights=np.where(is_all, 0, class2), minlength=n_grp)
+    n_all_gt_dir = int(np.sum(has_all & has_dir & (pc_all - pc_dir > 0)))
+    use_all = ~has_dir
+    sta_use_all_ = pd.DataFrame(
+        {"pos": sta_keys_.pos.to_numpy(), "use_ALL": use_all[grp]}
+    )
+    return sta_use_all_, n_all_gt_dir
+
+
+def concat_sta_dedup_mask(results):
+    """Reduce step for `sta_dedup_mask` run on year partitions."""
+    sta_use_all_ = pd.concat([res[0] for res in results], ignore_index=True)
+    n_all_gt_dir = sum(res[1] for res in results)
+    return sta_use_all_, n_all_gt_dir
+
+
+@timing
+def get_sta_pre_id_suf_cmb(data_, sub_col, n_jobs=1):
+    """
+    Return concatenated station identifiers. Only keep unique stations: if a location
+    has "ALL", "EB", and "WB" data in a year, just keep "EB" and "WB".
+
+    The station id in `sub_col` is split into location id and direction once per
+    unique id, and the rows are keyed by integer-coded (year, location id, direction).
+    The year partitions are independent and are processed in `n_jobs` processes.
+    """
+    sta_codes, sta_ids = pd.factorize(data_[sub_col], use_na_sentinel=False)
+    sta_ids_split = pd.Series(sta_ids, dtype=object).str.split("_", n=1, expand=True)
+    if 1 not in sta_ids_split.columns:
+        sta_ids_split[1] = None
+    loc_codes, loc_ids = pd.factorize(sta_ids_split[0], use_na_sentinel=False)
+    dirs = sta_ids_split[1].fillna("ALL").to_numpy(dtype=object)
+    data_["loc_id"] = np.asarray(loc_ids, dtype=object)[loc_codes[sta_codes]]
+    data_["dir"] = dirs[sta_codes]
     data_["year_"] = data_.start_datetime.dt.year
-    stations = data_[["year_", "loc_id", "dir"]].drop_duplicates()
-    stations.sort_values(["loc_id", "dir", "year_"], ignore_index=True, inplace=True)
-    stations["has_ALL"] = stations.dir == 'ALL'
-    stations["has_dir"] = stations.dir != 'ALL'
-    stations_cnt = stations.groupby(
-        ["year_", "loc_id"], as_index=False).agg(
-            cnt_ALL=("has_ALL", "sum"), cnt_dir=("has_dir", "sum")
-            ).sort_values(["loc_id", "year_"], ignore_index=True, inplace=False)
-    
-    len(stations_cnt)
-            
-            
-    stations_cnt_1 = stations_cnt.loc[stations_cnt.cnt_ALL == 0]
-    stations_cnt_2 = stations_cnt.loc[stations_cnt.cnt_dir == 0]
-    stations_cnt_3 = stations_cnt.loc[
-        (stations_cnt.cnt_ALL != 0) & (stations_cnt.cnt_dir != 0)]
-    assert (
-        len(stations_cnt) == len(stations_cnt_1) + len(stations_cnt_2) + len(stations_cnt_3)
-        ), "The three sub-dataframes are not exclusive and exhaustive."
-    assert (
-        len(stations_cnt.loc[(stations_cnt.cnt_ALL == 0) & (stations_cnt.cnt_dir == 0)]) ==0
-        ), "Either directional or total counts should be present."
-
-    # The location ids + years in stations_cnt_1 and stations_cnt_2 are good as it has
-    # either directional or total data, respectively.
-    # The location ids + years in stations_cnt_3 need to handled, as 
-    # Do some debuggin on PC counts for stations_cnt_3 location_id and year
-
-    station_pivot = pd.pivot_table(
-        data_, index=["year_", "loc_id"],
-        values="class2", columns="dir",
-        aggfunc=np.sum, fill_value=0
-    ).reset_index()
-    dir_cols = [col for col in station_pivot.columns if col not in["ALL", "year_"]]
-    station_pivot["ALL_from_dir"] = station_pivot[dir_cols].sum(axis=1)
-    station_pivot["Diff_Cnts"] = station_pivot.ALL - station_pivot.ALL_from_dir
-    non_zero_loc_ids = stations_cnt_3.loc_id.unique()
-    station_pivot_check = station_pivot.merge(stations_cnt_3, on=["loc_id", "year_"])
-    assert len(station_pivot_check.loc[lambda df: df.Diff_Cnts > 0]) == 2, (
+    loc_code_rows = loc_codes[sta_codes].astype(np.int32)
+    is_all_rows = (dirs == "ALL")[sta_codes]
+    sta_keys = pd.DataFrame(
+        {
+            "pos": np.arange(len(data_)),
+            "year_": data_["year_"].to_numpy(),
+            "loc_code": loc_code_rows,
+            "is_ALL": is_all_rows,
+            "class2": data_["class2"].to_numpy(),
+        }
+    ).loc[lambda df: df.year_.notna()]
+    sta_use_all, n_all_gt_dir = partition_map_reduce(
+        sta_keys,
+        partition_col="year_",
+        map_fn=sta_dedup_mask,
+        reduce_fn=concat_sta_dedup_mask,
+        n_jobs=n_jobs,
+        n_loc_=len(loc_ids),
+    )
+    assert n_all_gt_dir == 2, (
         "based on 2021 TxDOT data, only two instances should be there of Total PC (ALL)"
         " volume exceeding directional volume")
-    # Handle duplicate stations.
-    unq_sta_df = pd.concat([
-        stations_cnt_1.filter(items=["year_", "loc_id"]).assign(use_ALL=False),
-        stations_cnt_2.filter(items=["year_", "loc_id"]).assign(use_ALL=True),
-        stations_cnt_3.filter(items=["year_", "loc_id"]).assign(use_ALL=False)
-        ])
-
+    # Rows without a year are dropped: use_ALL = ~is_ALL makes keep_rows False.
+    use_all = ~is_all_rows
+    use_all[sta_use_all.pos.to_numpy()] = sta_use_all.use_ALL.to_numpy()
     data_["sta_pre_id_suf_fr"] = data_["loc_id"]
-    data_["is_ALL"] = data_["dir"] == "ALL"
-    data_1_ = data_.merge(unq_sta_df, on=["year_", "loc_id"])
+    data_["is_ALL"] = is_all_rows
+    data_["use_ALL"] = use_all
     # keep_rows is XNOR gate.
-    data_1_["keep_rows"] = data_1_.is_ALL == data_1_.use_ALL
-    data_2_ = data_1_.loc[data_1_.keep_rows]
-    
-    assert (
-        set(data_2_.loc_id.unique()).symmetric_difference(set(unq_sta_df.loc_id)) == set()
-        ), "After above filtering some data was lost."
+    keep_rows = is_all_rows == use_all
+    data_["keep_rows"] = keep_rows
+    data_2_ = data_.loc[keep_rows].reset_index(drop=True)
+    assert all(
+        np.bincount(loc_code_rows[keep_rows], minlength=len(loc_ids)) > 0
+    ), "After above filtering some data was lost."
     return data_2_
 
 
 @timing
 def raw_dt_prc(
         MVC_file="MVC_2013_21_received_on_030922",
-        PERM_file="PERM_CLASS_BY_HR_2013_2021"
+        PERM_file="PERM_CLASS_BY_HR_2013_2021",
+        ATR_file="TxDOT_PERM_HOURLY_DATA_2013_092021",
+        n_jobs=1
 ):
     """
     Process the raw MVC and permanent counter data to fix date time format, station id,
-    map road types to MOVES, and save data to parquet for faster loading.
+    map road types to MOVES, and save data to parquet for faster loading. The MVC data
+    gets an integer station code (sta_code); the station ids are saved in the
+    `<MVC_file>_sta_dict.parquet` side table. The MVC and permanent counter data get the
+    small-int calendar columns (year, month, dow, hour, date_id) and the federal holiday
+    flag (is_holiday). Save the ATR hourly data as a year-partitioned parquet dataset.
     """
     # Set Paths
     # ----------------------------------------------------------------------------------
@@ -278,12 +354,12 @@ def raw_dt_prc(
     path_mvc_countr_pq = Path.joinpath(
         path_txdot_fy22, MVC_file + ".parquet"
     )
+    path_atr_hourly_pq = Path.joinpath(path_txdot_fy22, ATR_file)
     # Read Data
     # ----------------------------------------------------------------------------------
     # Read and Process County Data
     # -----------------------------
-    gdf_county = gpd.read_file(path_county_shp)
-    gdf_county = gdf_county.rename(columns=get_snake_case_dict(gdf_county))
+    gdf_county = get_county()
     gdf_county_1 = gdf_county.filter(items=["txdot_dist", "cnty_nm"]).rename(
         columns={"cnty_nm": "county"}
     )
@@ -291,10 +367,18 @@ def raw_dt_prc(
     # --------------------------
     if not Path.exists(path_mvc_countr_pq):
         mvc_countr_fil = clean_mvc_countr(
-            mvc_file=MVC_file + ".csv"
+            mvc_file=MVC_file + ".csv", n_jobs=n_jobs
         )
         mvc_countr_fil = mvc_countr_fil.merge(gdf_county_1, on="county", how="left")
         mvc_countr_fil = add_mvs_rdtype_to_mvc_new(mvc_countr_fil)
+        # Dense int32 station codes for the stage iv group-bys and distinct counts.
+        mvc_countr_fil, mvc_sta_dict = add_sta_code(mvc_countr_fil)
+        save_sta_dict(
+            sta_dict_=mvc_sta_dict, sta_dict_out_fi=MVC_file + "_sta_dict.parquet"
+        )
+        # Small-int calendar columns and the holiday flag, so that the later stages
+        # don't recompute them from start_datetime.
+        mvc_countr_fil = add_calendar_cols(mvc_countr_fil)
         save_raw_data_as_parquet(
             mvc_countr_=mvc_countr_fil,
             perm_countr_=None,
@@ -305,11 +389,17 @@ def raw_dt_prc(
     # --------------------------
     if not Path.exists(path_perm_countr_pq):
         perm_countr = clean_perm_countr()
+        perm_countr = add_calendar_cols(perm_countr)
         save_raw_data_as_parquet(
             mvc_countr_=None,
             perm_countr_=perm_countr,
             mvc_out_fi=None,
             perm_out_fi=PERM_file+".parquet")
+    # Read and Process ATR Hourly Data
+    # ---------------------------------
+    if not Path.exists(path_atr_hourly_pq):
+        atr_hourly = clean_atr_hourly(atr_file=ATR_file + ".csv")
+        save_atr_hourly_as_parquet(atr_hourly_=atr_hourly, atr_out_dir=ATR_file)
 
 
 if __name__ == "__main__":
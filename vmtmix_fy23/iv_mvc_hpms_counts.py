@@ -7,51 +7,116 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import pyarrow.parquet as pq
-import geopandas as gpd
 import os
 import sys
 
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
 from vmtmix_fy23.utils import (
+    get_validation_level,
     path_inp,
     path_interm,
     path_output,
     path_txdot_fy22,
-    path_txdot_districts_shp,
     ChainedAssignent,
+    add_calendar_cols,
+    add_sta_code,
+    calendar_cols,
+    count_distinct_codes,
+    dow_nms,
+    get_dow_nm,
+    get_mnth_nm,
     get_snake_case_dict,
+    get_tod_lng_map,
+    get_veh_cls_cnt_block,
+    agg_veh_cls,
+    mnth_nms,
+    partition_map_reduce,
+    tod_map,
+    veh_cls_cols,
+    veh_cls_schemes,
     timing
 )
+from vmtmix_fy23.lookup_tbls import get_county, get_dgcodes, get_txdist
 
 switchoff_chainedass_warn = ChainedAssignent()
+# Spatial levels of the MVC aggregations from the finest to the coarsest. Each county is
+# in one district, each district in one district group (dgcode), and "state" is all of
+# Texas (STATE). Every level is rolled up from the county sufficient statistics
+# (`MVCVmtMix.get_suff_stats`); the district group and state levels from the partials of
+# the next finer level (`MVCVmtMix.rollup_suff_stats`).
+spatial_levels = ["county", "district", "dgcode", "state"]
+STATE = "TX"
+# Levels that a `spatial_level` + road type with a low sample size falls back to, in
+# order (`handle_low_ss`).
+spatial_fallbacks = {"county": ["district", "dgcode"], "district": ["dgcode"]}
+# Minimum average number of stations for a spatial level + road type (all hours).
+MIN_SS = 5
+
+
+def get_sta_county(sta_county_rows_):
+    """
+    One county per station: the most frequent non-missing county of the station's rows
+    (ties go to the first county name). `sta_county_rows_` has the number of rows
+    (n_row) of each sta_code + county. n_county is the number of counties of the
+    station; the county level needs one (`MVCVmtMix.check_sta_county`).
+    """
+    return (
+        sta_county_rows_.loc[lambda df: df.county.notna()]
+        .sort_values(["sta_code", "n_row", "county"], ascending=[True, False, True])
+        .assign(n_county=lambda df: df.groupby("sta_code").county.transform("size"))
+        .drop_duplicates("sta_code")
+        .filter(items=["sta_code", "county", "n_county"])
+        .reset_index(drop=True)
+    )
+
+
+def grp_mean(data_, keys_, cols_):
+    """Average `cols_` by `keys_`. Map step of the partition-parallel group-bys."""
+    return data_.groupby(keys_, as_index=False)[cols_].mean()
+
+
+def grp_suff_stats(data_, keys_, cols_, sta_col_="sta_code"):
+    """Sum and number of non-missing values of `cols_` (sum_<col>, n_<col>) and number
+    of unique stations (n_sta) by `keys_`; missing keys are kept as groups. Map step of
+    the partition-parallel sufficient statistics."""
+    grp = data_.groupby(keys_, sort=True, dropna=False)
+    suff_stats_ = pd.concat(
+        [grp[cols_].sum().add_prefix("sum_"), grp[cols_].count().add_prefix("n_")],
+        axis=1,
+    ).reset_index()
+    suff_stats_["n_sta"] = count_distinct_codes(
+        grp.ngroup().to_numpy(), data_[sta_col_].to_numpy(), n_grp=grp.ngroups
+    )
+    return suff_stats_
 
 
 class MVCVmtMix:
     map_ra = dict(
         [(2, "r_ra"), (3, "r_ura"), (4, "u_ra"), (5, "u_ura"), ("ALL", "ALL")]
     )
-    vehclscntcols = {
-        "class1": "MC",
-        "class2": "PC",
-        "class3": "PT_LCT",
-        "class4": "Bus",
-        "class5": "SU_MH_RT_HDV",
-        "class6": "SU_MH_RT_HDV",
-        "class7": "SU_MH_RT_HDV",
-        "class8": "CT_HDV",
-        "class9": "CT_HDV",
-        "class10": "CT_HDV",
-        "class11": "CT_HDV",
-        "class12": "CT_HDV",
-        "class13": "CT_HDV",
-        "class14": "Unk",
-        "class15": "Unk",
-    }
-    agg_vtype_cols = ["MC", "PC", "PT_LCT", "Bus", "SU_MH_RT_HDV", "CT_HDV"]
+    veh_cls_scheme = "mvc_hpms"
+    vehclscntcols = veh_cls_schemes[veh_cls_scheme]["vehclscntcols"]
+    agg_vtype_cols = veh_cls_schemes[veh_cls_scheme]["agg_vtype_cols"]
 
     def __init__(
-        self, path_inp=path_inp, path_interm=path_interm, min_yr_=2013, max_yr_=2019
+        self,
+        path_inp=path_inp,
+        path_interm=path_interm,
+        min_yr_=2013,
+        max_yr_=2019,
+        n_jobs=1,
     ):
+        """
+        n_jobs: Number of processes for the station and district group-bys. With
+        n_jobs > 1 the MVC data is partitioned by station (or `spatial_level`) and the
+        partitions are aggregated in a process pool; the result is identical to the
+        serial (n_jobs=1) result.
+        """
         # Set input paths
         self.path_mvc_pq = Path.joinpath(
             path_txdot_fy22, "MVC_2013_21_received_on_030922.parquet"
@@ -62,21 +127,25 @@ class MVCVmtMix:
         self.path_conv_aadt2dow_by_vehcat = Path.joinpath(
             path_interm, "conv_aadt2dow_by_vehcat.tab"
         )
-        self.path_dgcodes_marty = Path.joinpath(path_inp, "district_dgcode_map.xlsx")
         self.min_yr_ = min_yr_
         self.max_yr_ = max_yr_
+        self.n_jobs = n_jobs
         self._txdist = pd.DataFrame()
         self.mvc = pd.DataFrame()
         self.conv_aadt_adt_mnth = pd.DataFrame()
         self.conv_aadt2dow_by_vehcat = pd.DataFrame()
+        self.sta_county = pd.DataFrame()
+        self._suff_stats = None
+        self._suff_stats_rollups = {}
 
         # Read/ process relevant data
         self.set_mvc()
         self.set_txdist()
         self.set_conv_aadt_adt_mnth()
         self.set_conv_aadt2dow_by_vehcat()
-        self.dgcodes = pd.read_excel(self.path_dgcodes_marty)
+        self.dgcodes = get_dgcodes()
 
+    @timing
     def set_mvc(self):
         """
         Read the manual vehicle count parquet file into a pandas dataframe. Extract date
@@ -84,21 +153,43 @@ class MVCVmtMix:
         min_yr and max_yr years. For FY22 the min_yr was 2013 and max_yr was 2019. Drop
         the rows where the MVC doesn't have road type info. Create a copy of MVC data
         and assign road, area, and access type as "ALL". Map the data to MOVES road types.
-        Create new columns to represent counts by HPMS vehicle categories.
+        Create new columns to represent counts by HPMS vehicle categories. Returns the
+        processed MVC data.
         """
         df_mvc = pq.read_table(self.path_mvc_pq).to_pandas()
-        df_mvc["year"] = df_mvc.start_datetime.dt.year
-        df_mvc["hour"] = df_mvc.start_datetime.dt.hour
-        df_mvc["mnth_nm"] = df_mvc.start_datetime.dt.month_name().str[:3]
-        df_mvc["dow_nm"] = df_mvc.start_datetime.dt.day_name().str[:3]
-        df_mvc["date_"] = df_mvc.start_datetime.dt.date
+        if "sta_code" not in df_mvc.columns:
+            # MVC parquet files created before the station codes were added.
+            df_mvc, _ = add_sta_code(df_mvc)
+        if not set(calendar_cols).issubset(df_mvc.columns):
+            # MVC parquet files created before the calendar columns were added.
+            df_mvc = add_calendar_cols(df_mvc)
         df_mvc = df_mvc[(df_mvc.year <= self.max_yr_) & (df_mvc.year >= self.min_yr_)]
-        df_mvc_nona = df_mvc.loc[~df_mvc.mvs_rdtype.isna()]
+        df_mvc = df_mvc.assign(
+            mnth_nm=lambda df: get_mnth_nm(df.month),
+            dow_nm=lambda df: get_dow_nm(df.dow),
+            date_=lambda df: df.date_id,
+        )
+        # Rows without a station id (sta_code -1) are not used in the aggregations.
+        df_mvc_nona = df_mvc.loc[~df_mvc.mvs_rdtype.isna() & (df_mvc.sta_code >= 0)]
         with switchoff_chainedass_warn:
             df_mvc_nona["mvs_rdtype"] = df_mvc_nona["mvs_rdtype"].astype(int)
         nan_data_size = (len(df_mvc) - len(df_mvc_nona)) / len(df_mvc)
         # print(f"Removing {nan_data_size :%} of data with no road type.")
         df_mvc.loc[df_mvc.mvs_rdtype.isna(), "sta_pre_id_suf_fr"].unique()
+        # Sum the FHWA classes to the HPMS categories with one matrix multiply before
+        # the "ALL" copy. The class counts are kept as one int32 block.
+        # FixMe: Check for 0 or abnormal volumes
+        cnt_block = get_veh_cls_cnt_block(df_mvc_nona)
+        df_mvc_nona = pd.concat(
+            [
+                df_mvc_nona.drop(columns=veh_cls_cols),
+                pd.DataFrame(cnt_block, columns=veh_cls_cols, index=df_mvc_nona.index),
+                agg_veh_cls(
+                    cnt_block, scheme=self.veh_cls_scheme, index=df_mvc_nona.index
+                ),
+            ],
+            axis=1,
+        )
         mvc_ALL = df_mvc_nona.copy(deep=True)
         mvc_ALL["mvs_rdtype"] = "ALL"
         mvc_ALL["rural_urban"] = "ALL"
@@ -109,33 +200,20 @@ class MVCVmtMix:
         with switchoff_chainedass_warn:
             mvc_1["mvs_rdtype_nm"] = mvc_1.mvs_rdtype.map(self.map_ra)
         debug = mvc_1.loc[lambda df: df.mvs_rdtype.isna()]
-
-        mc_cols = [key for key, val in self.vehclscntcols.items() if val == "MC"]
-        pc_cols = [key for key, val in self.vehclscntcols.items() if val == "PC"]
-        pt_lct_cols = [
-            key for key, val in self.vehclscntcols.items() if val == "PT_LCT"
-        ]
-        bus_cols = [key for key, val in self.vehclscntcols.items() if val == "Bus"]
-        suhdv_cols = [
-            key for key, val in self.vehclscntcols.items() if val == "SU_MH_RT_HDV"
-        ]
-        cthdv_cols = [key for key, val in self.vehclscntcols.items() if val == "CT_HDV"]
-        # FixMe: Check for 0 or abnormal volumes
-        with switchoff_chainedass_warn:
-            mvc_1["MC"] = mvc_1[mc_cols].sum(axis=1)
-            mvc_1["PC"] = mvc_1[pc_cols].sum(axis=1)
-            mvc_1["PT_LCT"] = mvc_1[pt_lct_cols].sum(axis=1)
-            mvc_1["Bus"] = mvc_1[bus_cols].sum(axis=1)
-            mvc_1["SU_MH_RT_HDV"] = mvc_1[suhdv_cols].sum(axis=1)
-            mvc_1["CT_HDV"] = mvc_1[cthdv_cols].sum(axis=1)
+        # County of each station (from the MVC ingestion, `i_raw_dt_prc`).
+        self.sta_county = get_sta_county(
+            df_mvc_nona.groupby(["sta_code", "county"], as_index=False)
+            .size()
+            .rename(columns={"size": "n_row"})
+        )
         self.mvc = mvc_1
+        self._suff_stats = None
+        self._suff_stats_rollups = {}
+        return self.mvc
 
     def set_txdist(self):
-        """Read TxDOT district shapefile."""
-        txdist_tmp = gpd.read_file(path_txdot_districts_shp)
-        self.txdist = txdist_tmp[["DIST_NBR", "DIST_NM"]].rename(
-            columns={"DIST_NBR": "txdot_dist", "DIST_NM": "district"}
-        )
+        """Read the TxDOT district number to name lookup table."""
+        self.txdist = get_txdist()
 
     def set_conv_aadt_adt_mnth(self):
         """Read the AADT to ADT by month and day of the week conversion factor. We
@@ -164,173 +242,588 @@ class MVCVmtMix:
             self.txdist, on=["district"], how="outer"
         )
 
+    @timing
     def filt_mvc_counts(self):
         """Filter MVC counts to """
-        mvc_filt_ = self.mvc.groupby(
-            [
-                "sta_pre_id_suf_fr",
-                "txdot_dist",
+        sta_keys = [
+            "sta_code",
+            "txdot_dist",
+            "mvs_rdtype_nm",
+            "mvs_rdtype",
+            "mnth_nm",
+            "date_",
+            "year",
+            "dow_nm",
+            "hour",
+        ]
+        # Stations are independent, so the station-hour averages can be computed on
+        # station partitions in parallel. The integer station codes are used as keys.
+        mvc_filt_ = partition_map_reduce(
+            self.mvc,
+            partition_col="sta_code",
+            map_fn=grp_mean,
+            n_jobs=self.n_jobs,
+            n_parts=4 * self.n_jobs,
+            keys_=sta_keys,
+            cols_=self.agg_vtype_cols,
+        )
+        mvc_filt_adt_ = (
+            mvc_filt_.merge(
+                self.conv_aadt_adt_mnth,
+                on=["txdot_dist", "mnth_nm", "dow_nm"],
+                how="left",
+            )
+            .merge(self.dgcodes, on=["district"], how="left")
+            .merge(self.sta_county[["sta_code", "county"]], on="sta_code", how="left")
+        )
+        assert set(mvc_filt_adt_.dgcode) == set(
+            self.dgcodes.dgcode
+        ), "Need all DGCODES for aggregation."
+        return mvc_filt_adt_
+
+    @timing
+    def get_suff_stats(self):
+        """
+        Get the sufficient statistics of the AADT counts by district, county, road type,
+        hour, and year: the sum and the number of non-missing values of each count
+        (sum_<col>_adt, n_<col>_adt) and the number of unique stations (n_sta). Each
+        station is in one county and one district, so the station sets of the groups
+        are disjoint and the statistics of every spatial level are sums of the county
+        statistics (`rollup_suff_stats`). This is the only pass over the station-hour
+        counts; computed once and cached. Rows without a district (no ADT to AADT
+        factor) are not used; stations without a county are only used for the district
+        and coarser levels.
+        """
+        if self._suff_stats is not None:
+            return self._suff_stats
+        mvc_filt_adt = self.filt_mvc_counts().loc[lambda df: df.district.notna()]
+        if get_validation_level() != "off":
+            assert (
+                mvc_filt_adt[["sta_code", "district"]]
+                .drop_duplicates()
+                .sta_code.is_unique
+            ), "Some stations are in several districts."
+        agg_vtype_cols_adt = [f"{col}_adt" for col in self.agg_vtype_cols]
+        mvc_filt_adt = mvc_filt_adt.assign(
+            **{
+                col_adt: mvc_filt_adt[col] * mvc_filt_adt.inv_f_m_d
+                for col, col_adt in zip(self.agg_vtype_cols, agg_vtype_cols_adt)
+            }
+        )
+        # Stations are in one district, so the district partitions are independent.
+        self._suff_stats = partition_map_reduce(
+            mvc_filt_adt,
+            partition_col="district",
+            map_fn=grp_suff_stats,
+            n_jobs=self.n_jobs,
+            keys_=[
+                "district",
+                "county",
                 "mvs_rdtype_nm",
                 "mvs_rdtype",
-                "mnth_nm",
-                "date_",
-                "year",
-                "dow_nm",
                 "hour",
+                "year",
             ],
+            cols_=agg_vtype_cols_adt,
+        )
+        return self._suff_stats
+
+    def get_parent_map(self, spatial_level):
+        """Map of the `spatial_level` units (district or dgcode) to the units of the
+        next coarser level that they are in."""
+        if spatial_level == "district":
+            return self.dgcodes[["district", "dgcode"]].drop_duplicates()
+        if spatial_level == "dgcode":
+            return self.dgcodes[["dgcode"]].drop_duplicates().assign(state=STATE)
+        raise ValueError("spatial_level can be district or dgcode.")
+
+    def check_sta_county(self):
+        """Check that each station is in one county (`get_sta_county`); the county
+        level cannot use the stations whose rows are in several counties."""
+        multi_county = self.sta_county.loc[lambda df: df.n_county > 1]
+        if len(multi_county):
+            raise ValueError(
+                f"The stations (sta_code) {sorted(multi_county.sta_code)} are in "
+                "several counties; the county level needs one county per station."
+            )
+
+    def rollup_suff_stats(self, spatial_level):
+        """
+        Sum the sufficient statistics to `spatial_level`, road type, hour, and year. The
+        county and district statistics are sums of the county statistics
+        (`get_suff_stats`); the dgcode (state) statistics are sums of the district
+        (dgcode) statistics mapped to their dgcode (state) with `get_parent_map`. Each
+        level is computed once and cached.
+        """
+        if spatial_level not in spatial_levels:
+            raise ValueError(f"spatial_level can be one of {spatial_levels}.")
+        if spatial_level == "county":
+            self.check_sta_county()
+        if spatial_level in self._suff_stats_rollups:
+            return self._suff_stats_rollups[spatial_level]
+        if spatial_level in ("county", "district"):
+            partials = self.get_suff_stats()
+        else:
+            finer_level = spatial_levels[spatial_levels.index(spatial_level) - 1]
+            partials = self.rollup_suff_stats(finer_level).merge(
+                self.get_parent_map(finer_level), on=finer_level, how="left"
+            )
+        stat_cols = [
+            col for col in partials.columns if col.startswith(("sum_", "n_"))
+        ]
+        self._suff_stats_rollups[spatial_level] = partials.groupby(
+            [spatial_level, "mvs_rdtype_nm", "mvs_rdtype", "hour", "year"],
             as_index=False,
-        )[self.agg_vtype_cols].mean()
-        mvc_filt_adt_ = mvc_filt_.merge(
-            self.conv_aadt_adt_mnth, on=["txdot_dist", "mnth_nm", "dow_nm"], how="left"
-        ).merge(self.dgcodes, on=["district"], how="left")
-        assert set(mvc_filt_adt_.dgcode) == set(
-            self.dgcodes.dgcode
-        ), "Need all DGCODES for aggregation."
-        return mvc_filt_adt_
+            sort=True,
+        )[stat_cols].sum()
+        return self._suff_stats_rollups[spatial_level]
 
+    @timing
     def agg_mvc_counts(self, spatial_level="district"):
-    #     """
-    #     Aggregate (average) the counts to `spatial_level` (district or district group), road type, and hour.
-    #     Convert the count to AADT before aggregating.
-    #     """
-        mvc_filt_adt = self.filt_mvc_counts()
-    #     with switchoff_chainedass_warn:
-    #         mvc_filt_adt["MC_adt"] = mvc_filt_adt["MC"] * mvc_filt_adt.inv_f_m_d
-    #         mvc_filt_adt["PC_adt"] = mvc_filt_adt["PC"] * mvc_filt_adt.inv_f_m_d
-    #         mvc_filt_adt["PT_LCT_adt"] = mvc_filt_adt["PT_LCT"] * mvc_filt_adt.inv_f_m_d
-    #         mvc_filt_adt["Bus_adt"] = mvc_filt_adt["Bus"] * mvc_filt_adt.inv_f_m_d
-    #         mvc_filt_adt["SU_MH_RT_HDV_adt"] = (
-    #             mvc_filt_adt["SU_MH_RT_HDV"] * mvc_filt_adt.inv_f_m_d
-    #         )
-    #         mvc_filt_adt["CT_HDV_adt"] = mvc_filt_adt["CT_HDV"] * mvc_filt_adt.inv_f_m_d
+        """
+        Aggregate (average) the counts to `spatial_level` (county, district, district
+        group, or state), road type, and hour. Convert the count to AADT before
+        aggregating. The averages are the rolled-up sums over the rolled-up numbers of
+        values, which is the average of the station-hour counts of the group.
+        """
+        keys = [spatial_level, "mvs_rdtype_nm", "mvs_rdtype", "hour"]
         agg_vtype_cols_adt = [f"{col}_adt" for col in self.agg_vtype_cols]
-        mvc_filt_adt_agg = mvc_filt_adt.groupby(
-            [spatial_level, "mvs_rdtype_nm", "mvs_rdtype", "hour"], as_index=False
-        )[agg_vtype_cols_adt].mean()
+        suff_stats = self.rollup_suff_stats(spatial_level)
+        sum_cols = [f"sum_{col}" for col in agg_vtype_cols_adt]
+        n_cols = [f"n_{col}" for col in agg_vtype_cols_adt]
+        suff_stats = suff_stats.groupby(keys, as_index=False, sort=True)[
+            sum_cols + n_cols
+        ].sum()
+        mvc_filt_adt_agg = suff_stats[keys].assign(
+            **{
+                col: suff_stats[sum_col] / suff_stats[n_col].where(lambda x: x > 0)
+                for col, sum_col, n_col in zip(agg_vtype_cols_adt, sum_cols, n_cols)
+            }
+        )
         return mvc_filt_adt_agg
 
     # ToDo: Remove the Month-Day Conversion Factor---It's useless.
-    # ToDo: Aggregate by TOD here instead of doing it later in the processing.
     # ToDo: Be very specific about the order of averaging. Average of average is not the
     # same as ungrouped average.
 
+    @timing
     def get_mvc_sample_size(self, spatial_level):
         """Get the sample size (# of counters) per `spatial_level`, road type, and
-         hour."""
-        mvc_filt_adt = self.filt_mvc_counts()
-        mvc_filt_adt_sample_size = mvc_filt_adt.groupby(
-            [spatial_level, "mvs_rdtype_nm", "mvs_rdtype", "year", "hour"],
-            as_index=False,
-        ).sta_pre_id_suf_fr.nunique()
-        mvc_filt_adt_sample_size_agg_ = mvc_filt_adt_sample_size.groupby(
-            [spatial_level, "mvs_rdtype_nm", "mvs_rdtype", "hour"], as_index=False
-        ).sta_pre_id_suf_fr.mean()
+        hour: the number of unique stations by year, averaged over the years."""
+        keys = [spatial_level, "mvs_rdtype_nm", "mvs_rdtype", "hour"]
+        mvc_filt_adt_sample_size_agg_ = (
+            self.rollup_suff_stats(spatial_level)
+            .groupby(keys, as_index=False, sort=True)
+            .n_sta.mean()
+            .rename(columns={"n_sta": "sta_pre_id_suf_fr"})
+        )
         return mvc_filt_adt_sample_size_agg_
 
 
-def get_min_ss_per_loc(mvcvmtmix_, spatial_level_):
+class MVCVmtMixDuckDB(MVCVmtMix):
+    """
+    Out-of-core version of `MVCVmtMix`. `set_mvc` -> `filt_mvc_counts` ->
+    `get_suff_stats` are expressed as lazy DuckDB views over the MVC parquet file, so
+    only the columns that are needed are read, the "ALL" road type copy is never
+    materialized, and the group-bys stream and spill to `path_spill` when they exceed
+    `memory_limit`. Only the county sufficient statistics are returned as a pandas
+    dataframe; `agg_mvc_counts` and `get_mvc_sample_size` roll them up like
+    `MVCVmtMix`. The output matches `MVCVmtMix`, except that `mvs_rdtype` is a string
+    ("2", ..., "ALL").
     """
-    Create `spatial_rdtyp_lng` dataframe of all combinations of districts or district
-    groups and road types. Call `get_mvc_sample_size` to get the sample size. Check
-    if there are at least 5 counters available for each analysis group: `spatial_level_`,
-    road type, and hour.
 
+    filt_keys = [
+        "sta_code",
+        "txdot_dist",
+        "mvs_rdtype_nm",
+        "mvs_rdtype",
+        "mnth_nm",
+        "date_",
+        "year",
+        "dow_nm",
+        "hour",
+    ]
+
+    def __init__(
+        self,
+        path_inp=path_inp,
+        path_interm=path_interm,
+        min_yr_=2013,
+        max_yr_=2019,
+        memory_limit="8GB",
+        threads=None,
+    ):
+        if duckdb is None:
+            raise ImportError("duckdb is needed for the duckdb backend of MVCVmtMix.")
+        self.path_spill = Path.joinpath(path_interm, "duckdb_spill")
+        self.path_spill.mkdir(exist_ok=True)
+        self.con = duckdb.connect()
+        self.con.execute(f"SET temp_directory='{self.path_spill.as_posix()}'")
+        self.con.execute(f"SET memory_limit='{memory_limit}'")
+        self.con.execute("SET preserve_insertion_order=false")
+        if threads is not None:
+            self.con.execute(f"SET threads={int(threads)}")
+        super().__init__(
+            path_inp=path_inp, path_interm=path_interm, min_yr_=min_yr_, max_yr_=max_yr_
+        )
+
+    @timing
+    def set_mvc(self):
+        """
+        Create the lazy `mvc` view: the same processing as `MVCVmtMix.set_mvc`, but only
+        the columns used in the aggregations are kept. Returns the view as a DuckDB
+        relation.
+        """
+        hpms_cols = ",\n".join(
+            [
+                "{} AS {}".format(
+                    " + ".join(
+                        f"COALESCE({cls_col}, 0)"
+                        for cls_col, vtype in self.vehclscntcols.items()
+                        if vtype == agg_col
+                    ),
+                    agg_col,
+                )
+                for agg_col in self.agg_vtype_cols
+            ]
+        )
+        map_ra_case = " ".join(
+            f"WHEN '{rdtype}' THEN '{rdtype_nm}'"
+            for rdtype, rdtype_nm in self.map_ra.items()
+        )
+        pq_cols = pq.read_schema(self.path_mvc_pq).names
+        if "sta_code" in pq_cols:
+            sta_code_col = "NULLIF(sta_code, -1) AS sta_code"
+        else:
+            # MVC parquet files created before the station codes were added.
+            sta_code_col = (
+                "CASE WHEN sta_pre_id_suf_fr IS NOT NULL THEN "
+                "CAST(dense_rank() OVER (ORDER BY sta_pre_id_suf_fr) - 1 AS INTEGER) "
+                "END AS sta_code"
+            )
+        if set(calendar_cols).issubset(pq_cols):
+            mnth_nm_list = ", ".join(f"'{mnth_nm}'" for mnth_nm in mnth_nms)
+            dow_nm_list = ", ".join(f"'{dow_nm}'" for dow_nm in dow_nms)
+            cal_cols = (
+                "CAST(year AS INTEGER) AS year, CAST(hour AS INTEGER) AS hour, "
+                f"[{mnth_nm_list}][month] AS mnth_nm, "
+                f"[{dow_nm_list}][dow + 1] AS dow_nm, date_id AS date_"
+            )
+            year_col = "year"
+        else:
+            # MVC parquet files created before the calendar columns were added.
+            cal_cols = (
+                "year(start_datetime) AS year, hour(start_datetime) AS hour, "
+                "strftime(start_datetime, '%b') AS mnth_nm, "
+                "strftime(start_datetime, '%a') AS dow_nm, "
+                "CAST(start_datetime AS DATE) AS date_"
+            )
+            year_col = "year(start_datetime)"
+        self.con.execute(
+            f"""
+            CREATE OR REPLACE VIEW mvc_nona AS
+            SELECT
+                {sta_code_col},
+                txdot_dist,
+                county,
+                CAST(CAST(mvs_rdtype AS INTEGER) AS VARCHAR) AS mvs_rdtype,
+                {cal_cols},
+                {hpms_cols}
+            FROM read_parquet('{self.path_mvc_pq.as_posix()}')
+            WHERE {year_col} BETWEEN {self.min_yr_} AND {self.max_yr_}
+                AND mvs_rdtype IS NOT NULL
+                AND NOT isnan(mvs_rdtype)
+            """
+        )
+        self.con.execute(
+            f"""
+            CREATE OR REPLACE VIEW mvc AS
+            SELECT *, CASE mvs_rdtype {map_ra_case} END AS mvs_rdtype_nm
+            FROM (
+                SELECT * FROM mvc_nona
+                UNION ALL
+                SELECT * REPLACE ('ALL' AS mvs_rdtype) FROM mvc_nona
+            )
+            """
+        )
+        self.mvc = self.con.view("mvc")
+        self.sta_county = get_sta_county(
+            self.con.sql(
+                """
+                SELECT sta_code, county, count(*) AS n_row
+                FROM mvc_nona
+                WHERE sta_code IS NOT NULL AND county IS NOT NULL
+                GROUP BY sta_code, county
+                """
+            ).df()
+        )
+        self._suff_stats = None
+        self._suff_stats_rollups = {}
+        return self.mvc
+
+    @timing
+    def filt_mvc_counts(self):
+        """Create the lazy `mvc_filt` view (station-hour averages with the ADT to AADT
+        factor and the district groups). Returns the view as a DuckDB relation."""
+        self.con.register("conv_aadt_adt_mnth", self.conv_aadt_adt_mnth)
+        self.con.register("dgcodes", self.dgcodes)
+        self.con.register("sta_county", self.sta_county[["sta_code", "county"]])
+        keys = ", ".join(self.filt_keys)
+        avg_cols = ", ".join(f"avg({col}) AS {col}" for col in self.agg_vtype_cols)
+        not_null = " AND ".join(f"{key} IS NOT NULL" for key in self.filt_keys)
+        self.con.execute(
+            f"""
+            CREATE OR REPLACE VIEW mvc_filt AS
+            SELECT
+                mvc_sta.*,
+                sc.county,
+                conv.district,
+                conv.inv_f_m_d,
+                dg.dgcode
+            FROM (
+                SELECT {keys}, {avg_cols}
+                FROM mvc
+                WHERE {not_null}
+                GROUP BY {keys}
+            ) AS mvc_sta
+            LEFT JOIN sta_county AS sc
+                USING (sta_code)
+            LEFT JOIN conv_aadt_adt_mnth AS conv
+                USING (txdot_dist, mnth_nm, dow_nm)
+            LEFT JOIN dgcodes AS dg
+                USING (district)
+            """
+        )
+        dgcodes_mvc = self.con.sql("SELECT DISTINCT dgcode FROM mvc_filt").df()
+        assert set(dgcodes_mvc.dgcode) == set(
+            self.dgcodes.dgcode
+        ), "Need all DGCODES for aggregation."
+        return self.con.view("mvc_filt")
+
+    @timing
+    def get_suff_stats(self):
+        """Get the county sufficient statistics (`MVCVmtMix.get_suff_stats`) with one
+        DuckDB group-by over the `mvc_filt` view. Computed once and cached; the
+        rollups to the other spatial levels are done in pandas
+        (`MVCVmtMix.rollup_suff_stats`)."""
+        if self._suff_stats is not None:
+            return self._suff_stats
+        self.filt_mvc_counts()
+        keys = "district, county, mvs_rdtype_nm, mvs_rdtype, hour, year"
+        stat_cols = ",\n".join(
+            f"sum({col} * inv_f_m_d) AS sum_{col}_adt, "
+            f"count({col} * inv_f_m_d) AS n_{col}_adt"
+            for col in self.agg_vtype_cols
+        )
+        self._suff_stats = self.con.sql(
+            f"""
+            SELECT {keys}, {stat_cols}, count(DISTINCT sta_code) AS n_sta
+            FROM mvc_filt
+            WHERE district IS NOT NULL
+            GROUP BY {keys}
+            ORDER BY {keys}
+            """
+        ).df()
+        return self._suff_stats
+
+
+# Backends for stage iv. "pandas" holds the MVC data in memory, "duckdb" runs the
+# aggregations out-of-core over the MVC parquet file.
+mvc_backends = {"pandas": MVCVmtMix, "duckdb": MVCVmtMixDuckDB}
+
+
+def get_spatial_units(mvcvmtmix_, spatial_level_):
+    """
+    Get all the units of `spatial_level_` with the units of the coarser levels they are
+    in: counties (county, fips_st_cn, txdot_dist, district, dgcode), districts
+    (txdot_dist, district, dgcode), district groups (dgcode), or the state (state).
     """
-    txdist_rdtyp_ = mvcvmtmix_.txdist
-    dgcodes_rdtyp_ = mvcvmtmix_.dgcodes.drop_duplicates("dgcode")[["dgcode"]]
-    if spatial_level_ == "district":
-        spatial_rdtyp_ = txdist_rdtyp_
+    dist_dg = mvcvmtmix_.txdist.merge(
+        mvcvmtmix_.dgcodes[["district", "dgcode"]], on="district", how="left"
+    ).filter(items=["txdot_dist", "district", "dgcode"])
+    if spatial_level_ == "county":
+        spatial_units_ = (
+            get_county()
+            .rename(columns={"cnty_nm": "county"})
+            .merge(dist_dg, on="txdot_dist", how="left")
+            .filter(items=["county", "fips_st_cn", "txdot_dist", "district", "dgcode"])
+        )
+    elif spatial_level_ == "district":
+        spatial_units_ = dist_dg
     elif spatial_level_ == "dgcode":
-        spatial_rdtyp_ = dgcodes_rdtyp_
+        spatial_units_ = mvcvmtmix_.dgcodes.drop_duplicates("dgcode")[["dgcode"]]
+    elif spatial_level_ == "state":
+        spatial_units_ = pd.DataFrame({"state": [STATE]})
     else:
-        raise ValueError("spatial_level_ can either be 'district' or 'dgcode'")
-    spatial_rdtyp_["mvs_rdtype_nm"] = [["ALL", "r_ra", "r_ura", "u_ra", "u_ura"]] * len(
-        spatial_rdtyp_
+        raise ValueError(f"spatial_level_ can be one of {spatial_levels}.")
+    assert spatial_units_[spatial_level_].is_unique
+    return spatial_units_.reset_index(drop=True)
+
+
+def get_good_ss_grps(mvcvmtmix_, spatial_level_):
+    """`spatial_level_` + road type groups with at least MIN_SS stations in every
+    hour."""
+    mvc_ss = mvcvmtmix_.get_mvc_sample_size(spatial_level=spatial_level_)
+    return (
+        mvc_ss.groupby([spatial_level_, "mvs_rdtype_nm"], as_index=False)
+        .sta_pre_id_suf_fr.min()
+        .loc[lambda df: df.sta_pre_id_suf_fr >= MIN_SS]
+        .filter(items=[spatial_level_, "mvs_rdtype_nm"])
+    )
+
+
+def get_min_ss_per_loc(mvcvmtmix_, spatial_level_):
+    """
+    Create `spatial_rdtyp_lng` dataframe of all combinations of the `spatial_level_`
+    units (`get_spatial_units`) and road types. Call `get_mvc_sample_size` to get the
+    sample size. Check if there are at least MIN_SS counters available for each analysis
+    group: `spatial_level_`, road type, and hour. min_avg_sta_count is missing for the
+    groups with fewer counters.
+
+    """
+    spatial_rdtyp_lng = get_spatial_units(mvcvmtmix_, spatial_level_).merge(
+        pd.DataFrame({"mvs_rdtype_nm": ["ALL", "r_ra", "r_ura", "u_ra", "u_ura"]}),
+        how="cross",
     )
-    spatial_rdtyp_lng = spatial_rdtyp_.explode("mvs_rdtype_nm")
     mvc_ss = mvcvmtmix_.get_mvc_sample_size(spatial_level=spatial_level_)
     mvc_ss_min_ss = mvc_ss.groupby(
         [spatial_level_, "mvs_rdtype_nm", "mvs_rdtype"], as_index=False
     ).agg(min_avg_sta_count=("sta_pre_id_suf_fr", "min"))
-    mvc_ss_min_ss_5 = mvc_ss_min_ss.loc[mvc_ss_min_ss.min_avg_sta_count >= 5]
+    mvc_ss_min_ss_5 = mvc_ss_min_ss.loc[mvc_ss_min_ss.min_avg_sta_count >= MIN_SS]
     mvc_all_and_mvc_min_ss_5 = spatial_rdtyp_lng.merge(
         mvc_ss_min_ss_5, on=[spatial_level_, "mvs_rdtype_nm"], how="left"
     )
     if spatial_level_ == "dgcode":
         assert all(
-            mvc_all_and_mvc_min_ss_5.min_avg_sta_count >= 5
+            mvc_all_and_mvc_min_ss_5.min_avg_sta_count >= MIN_SS
         ), "Some dgcode and road types do not have sufficient samples."
     return mvc_all_and_mvc_min_ss_5
 
 
-def handle_low_district_ss(all_district_sta_counts_, mvcvmtmix_):
+@timing
+def handle_low_ss(spatial_sta_counts_, mvcvmtmix_, spatial_level_="district"):
     """
-    Impute missing counts for district + road type groups that have less than 5 stations
-    by aggregating the counts of district groups + road types that have at least 5 stations.
+    Impute the counts of the `spatial_level_` + road type groups that have less than
+    MIN_SS stations with the counts of the first level in
+    `spatial_fallbacks[spatial_level_]` (e.g., county -> district -> district group)
+    whose unit + road type has at least MIN_SS stations. The last level (district
+    group) is used without the MIN_SS check, so the low sample size districts get the
+    district group counts as before. The counts of all the levels are rolled up from
+    the same county sufficient statistics.
 
     Parameters
     ----------
-    all_district_sta_counts_ : pandas.DataFrame
-        A DataFrame containing station count information at the district and road type level.
-        Must contain the columns 'district', 'mvs_rdtype_nm', and 'min_avg_sta_count'.
+    spatial_sta_counts_ : pandas.DataFrame
+        Station count information at the `spatial_level_` and road type level
+        (`get_min_ss_per_loc`). Must contain the columns `spatial_level_`,
+        'mvs_rdtype_nm', and 'min_avg_sta_count'.
     mvcvmtmix_ : MVCVmtMix
         A `MVCVmtMix` object containing data and function to compute MVC counts at the
-        district and/or district group level.
+        different spatial levels.
+    spatial_level_ : str
+        "district" or "county".
 
     Returns
     -------
     pandas.DataFrame
-        A DataFrame containing imputed  counts at the district and road type level.
-        The DataFrame has the columns 'district', 'mvs_rdtype_nm', 'hour', 'based_on_dg',
-        'MC_adt', 'PC_adt', 'PT_LCT_adt', 'Bus_adt', 'SU_MH_RT_HDV_adt', and
-        'CT_HDV_adt', representing the district identifier, the road type group, the
-        hour of the day, a Boolean flag indicating whether the imputation is based on
-        district groups, and the MVC counts for the district and road type group.
+        A DataFrame containing imputed counts at the `spatial_level_` and road type
+        level. The DataFrame has the columns `spatial_level_`, 'district', 'dgcode',
+        'mvs_rdtype_nm', 'mvs_rdtype', 'hour', 'MC_adt', 'PC_adt', 'PT_LCT_adt',
+        'Bus_adt', 'SU_MH_RT_HDV_adt', 'CT_HDV_adt', 'based_on' (level the counts are
+        from), and 'based_on_dg' (Boolean flag indicating whether the imputation is
+        based on district groups).
 
     Raises
     ------
     AssertionError
-        If the resulting DataFrame does not have the expected number of rows or if there is
-        more than one count for the "district", "mvs_rdtype_nm", "hour" group.
+        If the resulting DataFrame does not have one row per unit, road type, and hour
+        (e.g., the district group + road type has no counts), or if there is more than
+        one count for a unit, road type, and hour.
     """
-    all_district_sta_counts_1 = all_district_sta_counts_.merge(
-        mvcvmtmix_.dgcodes, on="district"
+    if spatial_level_ not in spatial_fallbacks:
+        raise ValueError(f"spatial_level_ can be one of {list(spatial_fallbacks)}.")
+    fallback_levels = spatial_fallbacks[spatial_level_]
+    unit_cols = list(
+        dict.fromkeys([spatial_level_] + fallback_levels + ["district", "dgcode"])
     )
-    good_sta_ss = all_district_sta_counts_1.loc[lambda df: df.min_avg_sta_count >= 5]
-    low_sta_ss = all_district_sta_counts_1.loc[lambda df: df.min_avg_sta_count.isna()]
-    mvc_agg_dist = mvcvmtmix_.agg_mvc_counts(spatial_level="district")
-
-    good_ss_grps = set(good_sta_ss[["district", "mvs_rdtype_nm"]].apply(tuple, axis=1))
-    low_ss_grps = set(low_sta_ss[["district", "mvs_rdtype_nm"]].apply(tuple, axis=1))
-    mvc_agg_dist_good_sta_ss = mvc_agg_dist.groupby(
-        ["district", "mvs_rdtype_nm"]
-    ).filter(lambda grp: grp.name in good_ss_grps)
-    mvc_agg_dist_good_sta_ss["based_on_dg"] = False
-    mvc_agg_dist_good_sta_ss = mvc_agg_dist_good_sta_ss.merge(
-        mvcvmtmix_.dgcodes, on="district", how="left"
+    low_ss_grps = spatial_sta_counts_.assign(state=STATE).filter(
+        items=unit_cols + ["mvs_rdtype_nm"]
     )
-
-    mvc_agg_dg = mvcvmtmix_.agg_mvc_counts(spatial_level="dgcode")
-    mvc_agg_dg_with_dup_dist = mvc_agg_dg.merge(mvcvmtmix_.dgcodes, on="dgcode")
-    mvc_agg_dist_low_sta_ss = mvc_agg_dg_with_dup_dist.groupby(
-        ["district", "mvs_rdtype_nm"]
-    ).filter(lambda grp: grp.name in low_ss_grps)
-    mvc_agg_dist_low_sta_ss["based_on_dg"] = True
-
-    mvc_agg_dist_imputed_ = pd.concat(
-        [mvc_agg_dist_good_sta_ss, mvc_agg_dist_low_sta_ss]
+    low_ss_grps = low_ss_grps.assign(
+        based_on=np.where(
+            spatial_sta_counts_.min_avg_sta_count >= MIN_SS, spatial_level_, None
+        )
+    )
+    for fallback_level in fallback_levels[:-1]:
+        good_level_grps = get_good_ss_grps(mvcvmtmix_, fallback_level).assign(
+            level_good=True
+        )
+        low_ss_grps = low_ss_grps.merge(
+            good_level_grps, on=[fallback_level, "mvs_rdtype_nm"], how="left"
+        )
+        low_ss_grps["based_on"] = low_ss_grps.based_on.where(
+            low_ss_grps.based_on.notna() | low_ss_grps.level_good.isna(), fallback_level
+        )
+        low_ss_grps = low_ss_grps.drop(columns="level_good")
+    low_ss_grps["based_on"] = low_ss_grps.based_on.fillna(fallback_levels[-1])
+    mvc_agg_imputed_ = pd.concat(
+        [
+            mvcvmtmix_.agg_mvc_counts(spatial_level=level).merge(
+                low_ss_grps.loc[lambda df: df.based_on == level],
+                on=[level, "mvs_rdtype_nm"],
+                how="inner",
+            )
+            for level in [spatial_level_] + fallback_levels
+        ],
+        ignore_index=True,
     )
-    assert len(mvc_agg_dist_imputed_) == 25 * 5 * 24
+    mvc_agg_imputed_["based_on_dg"] = mvc_agg_imputed_.based_on == "dgcode"
+    n_hours = mvc_agg_imputed_.hour.nunique()
+    no_cnt_grps = low_ss_grps.merge(
+        mvc_agg_imputed_[[spatial_level_, "mvs_rdtype_nm"]].drop_duplicates(),
+        how="left",
+        indicator=True,
+    ).loc[lambda df: df._merge == "left_only", [spatial_level_, "mvs_rdtype_nm"]]
+    assert no_cnt_grps.empty, (
+        f"No counts for the {spatial_level_} and road types "
+        f"{list(no_cnt_grps.itertuples(index=False, name=None))}."
+    )
+    assert len(mvc_agg_imputed_) == len(low_ss_grps) * n_hours
     assert all(
-        mvc_agg_dist_imputed_.groupby(
-            ["district", "mvs_rdtype_nm", "hour"]
+        mvc_agg_imputed_.groupby(
+            [spatial_level_, "mvs_rdtype_nm", "hour"]
         ).PT_LCT_adt.count()
         == 1
-    ), "Expect  1 unique count for the 2400 rows."
-    return mvc_agg_dist_imputed_
+    ), f"Expect 1 unique count for each {spatial_level_}, road type, and hour."
+    return mvc_agg_imputed_
+
+
+def agg_to_tod(mvc_dow_, tod_map_):
+    """
+    Sum the hourly counts (`*_dow` columns) to the TOD periods in `tod_map_` and to the
+    whole day ("day"). Returns the counts with a 'tod' column instead of 'hour'.
+    """
+    tod_lng_map = get_tod_lng_map(tod_map_)
+    assert set(mvc_dow_.hour.unique()) <= set(tod_lng_map.keys()), (
+        "Some hours are not mapped to a TOD period."
+    )
+    keys_ = [col for col in mvc_dow_.columns if not col.endswith("_dow")]
+    keys_.remove("hour")
+    cnt_cols = [col for col in mvc_dow_.columns if col.endswith("_dow")]
+    mvc_tod = mvc_dow_.assign(tod=lambda df: df.hour.map(tod_lng_map))
+    mvc_tod_agg = mvc_tod.groupby(keys_ + ["tod"], as_index=False, dropna=False)[
+        cnt_cols
+    ].sum()
+    mvc_day_agg = mvc_dow_.groupby(keys_, as_index=False, dropna=False)[
+        cnt_cols
+    ].sum().assign(tod="day")
+    return pd.concat([mvc_tod_agg, mvc_day_agg], ignore_index=True).filter(
+        items=keys_ + ["tod"] + cnt_cols
+    )
 
 
-def compute_vmtmix_dow(mvc_agg_dist_imputed_, mvcvmtmix_):
+@timing
+def compute_vmtmix_dow(mvc_agg_dist_imputed_, mvcvmtmix_, tod_map_=None):
     """
     Computes the vehicle miles traveled (VMT) surrogate (counts-based) distribution by
     day of week and vehicle category for each district + road type group using the MVC
@@ -345,6 +838,11 @@ def compute_vmtmix_dow(mvc_agg_dist_imputed_, mvcvmtmix_):
     mvcvmtmix_ : MVCVmtMix
         A `MVCVmtMix` object containing data and functions to compute counts by
         day of week and vehicle category.
+    tod_map_ : dict, optional
+        TOD periods and the hours in each period, e.g. `utils.tod_map`. If given, the
+        hourly counts are summed to the TOD periods and to the whole day ("day"), and
+        the 'hour' column is replaced by a 'tod' column. The counts are only summed
+        downstream, so this gives the same VMT-Mix with smaller frames.
 
     Returns
     -------
@@ -358,7 +856,9 @@ def compute_vmtmix_dow(mvc_agg_dist_imputed_, mvcvmtmix_):
         whether the imputation is based on district groups, road type group, road type code,
         day of week, hour of the day, counts  by day of week and vehicle category, total
         VMT by day of week, and count (VMT) fraction by day of week and vehicle category.
-
+        Has 'tod' instead of 'hour' if `tod_map_` is given. Also has the level the
+        counts are from ('based_on'), and for counties the 'county' column; the DOW
+        factors are by district.
     """
     fac_dow_by_vehcat = mvcvmtmix_.conv_aadt2dow_by_vehcat
     fac_dow_by_vehcat_filt = fac_dow_by_vehcat.filter(
@@ -398,7 +898,9 @@ def compute_vmtmix_dow(mvc_agg_dist_imputed_, mvcvmtmix_):
         items=[
             "dgcode",
             "district",
+            "county",
             "based_on_dg",
+            "based_on",
             "mvs_rdtype_nm",
             "mvs_rdtype",
             "dowagg",
@@ -411,7 +913,12 @@ def compute_vmtmix_dow(mvc_agg_dist_imputed_, mvcvmtmix_):
             "CT_HDV_dow",
             "Total_dow",
         ]
-    ).assign(
+    )
+    if tod_map_ is not None:
+        mvc_agg_dist_imputed_dow_filt = agg_to_tod(
+            mvc_agg_dist_imputed_dow_filt, tod_map_
+        )
+    mvc_agg_dist_imputed_dow_filt = mvc_agg_dist_imputed_dow_filt.assign(
         MC_frac=lambda df: df.MC_dow / df.Total_dow,
         PC_frac=lambda df: df.PC_dow / df.Total_dow,
         PT_LCT_frac=lambda df: df.PT_LCT_dow / df.Total_dow,
@@ -424,26 +931,48 @@ def compute_vmtmix_dow(mvc_agg_dist_imputed_, mvcvmtmix_):
 
 
 @timing
-def mvc_hpms_cnt(out_fi, min_yr, max_yr):
+def mvc_hpms_cnt(
+    out_fi,
+    min_yr,
+    max_yr,
+    backend="pandas",
+    n_jobs=1,
+    early_tod=False,
+    spatial_level="district",
+):
     """
     Compute the HPMS category counts from the MVC data and apply the above conversion
-    factors.
+    factors. `backend` is "pandas" (in memory) or "duckdb" (out-of-core). `n_jobs` is
+    the number of processes used by the pandas backend. Set `early_tod` to True to sum
+    the hourly counts to the `utils.tod_map` TOD periods here instead of in
+    `vii_vmt_mix_disagg`. `spatial_level` is "district" or "county"; the county counts
+    are written to <out_fi>_county_<mmyyyy>.csv.
     """
     now_yr = str(datetime.datetime.now().year)
     now_mnt = str(datetime.datetime.now().month).zfill(2)
     now_mntyr = now_mnt + now_yr
-    path_out_sta_counts = Path.joinpath(path_interm, "sta_counts_mvc_script_iv.csv")
-    path_out_mvc_vmtmix = Path.joinpath(path_output, f"{out_fi}_{now_mntyr}.csv")
+    sfx = "" if spatial_level == "district" else f"_{spatial_level}"
+    path_out_sta_counts = Path.joinpath(
+        path_interm, f"sta_counts_mvc_script_iv{sfx}.csv"
+    )
+    path_out_mvc_vmtmix = Path.joinpath(path_output, f"{out_fi}{sfx}_{now_mntyr}.csv")
     # path_out_mvc_raw = Path.joinpath(path_output, f"raw_{out_fi}_{now_mntyr}.csv")
 
-    mvcvmtmix = MVCVmtMix(min_yr_=min_yr, max_yr_=max_yr)
+    if backend == "pandas":
+        mvcvmtmix = MVCVmtMix(min_yr_=min_yr, max_yr_=max_yr, n_jobs=n_jobs)
+    else:
+        mvcvmtmix = mvc_backends[backend](min_yr_=min_yr, max_yr_=max_yr)
     all_district_sta_counts = get_min_ss_per_loc(
-        mvcvmtmix_=mvcvmtmix, spatial_level_="district"
+        mvcvmtmix_=mvcvmtmix, spatial_level_=spatial_level
+    )
+    mvc_agg_dist_imputed = handle_low_ss(
+        spatial_sta_counts_=all_district_sta_counts,
+        mvcvmtmix_=mvcvmtmix,
+        spatial_level_=spatial_level,
     )
-    mvc_agg_dist_imputed = handle_low_district_ss(
-        all_district_sta_counts_=all_district_sta_counts, mvcvmtmix_=mvcvmtmix
+    vmtmix_dow, mvc_raw = compute_vmtmix_dow(
+        mvc_agg_dist_imputed, mvcvmtmix, tod_map_=tod_map if early_tod else None
     )
-    vmtmix_dow, mvc_raw = compute_vmtmix_dow(mvc_agg_dist_imputed, mvcvmtmix)
     # TODO: Investigate the minimum sample size needed based on standard deviation.
     all_district_sta_counts.to_csv(path_out_sta_counts, index=False)
 
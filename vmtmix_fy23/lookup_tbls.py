@@ -0,0 +1,140 @@
+"""
+Cached lookup tables for the TxDOT districts, counties, and district groups (dgcodes).
+The stages only need a few attribute columns from the district and county shapefiles
+and the district to dgcode Excel map. These are extracted once to small parquet files
+in the intermediate folder (lookup_tbls), so the stages don't need geopandas or
+openpyxl to run. Each parquet file stores the modified time and size of its source
+files in the file metadata, and is rebuilt when a source file changes.
+Created by: Apoorb
+Created on: 03/09/2023
+"""
+import json
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
+from vmtmix_fy23.utils import (
+    get_snake_case_dict,
+    path_inp,
+    path_interm,
+    path_county_shp,
+    path_txdot_districts_shp,
+)
+
+path_lookup_tbls = Path.joinpath(path_interm, "lookup_tbls")
+path_dgcode_map = Path.joinpath(path_inp, "district_dgcode_map.xlsx")
+SRC_SIGNATURE_KEY = b"vmtmix_src_signature"
+
+
+def get_src_signature(src_paths):
+    """Get the name, modified time, and size of the source files. The attribute table
+    of a shapefile is in the .dbf file, so it is included with the .shp file."""
+    src_sig = []
+    for src_path in src_paths:
+        src_path = Path(src_path)
+        src_files = [src_path]
+        if src_path.suffix.lower() == ".shp":
+            src_files.append(src_path.with_suffix(".dbf"))
+        for src_file in src_files:
+            if src_file.exists():
+                src_stat = src_file.stat()
+                src_sig.append([src_file.name, src_stat.st_mtime_ns, src_stat.st_size])
+            else:
+                src_sig.append([src_file.name, None, None])
+    return json.dumps(src_sig)
+
+
+def read_lookup_tbl(tbl_nm, src_paths, build_fn):
+    """
+    Read the cached lookup table `tbl_nm`. The table is (re)built with `build_fn` and
+    written to the cache if it is missing or if the source files have changed.
+
+    Parameters
+    ----------
+    tbl_nm: str
+        Name of the cached parquet file (without the extension).
+    src_paths: list
+        Source files the table is built from.
+    build_fn: callable
+        Function that returns the lookup table from the source files.
+    Returns
+    -------
+    pd.DataFrame
+    """
+    path_tbl = Path.joinpath(path_lookup_tbls, f"{tbl_nm}.parquet")
+    src_sig = get_src_signature(src_paths).encode()
+    if path_tbl.exists():
+        tbl_meta = pq.read_schema(path_tbl).metadata or {}
+        if tbl_meta.get(SRC_SIGNATURE_KEY) == src_sig:
+            return pq.read_table(path_tbl).to_pandas()
+    lookup_tbl = build_fn().reset_index(drop=True)
+    tbl = pa.Table.from_pandas(lookup_tbl, preserve_index=False)
+    tbl = tbl.replace_schema_metadata(
+        {**(tbl.schema.metadata or {}), SRC_SIGNATURE_KEY: src_sig}
+    )
+    path_lookup_tbls.mkdir(parents=True, exist_ok=True)
+    pq.write_table(tbl, path_tbl)
+    return lookup_tbl
+
+
+def read_shp_attributes(path_shp):
+    """Read the attribute table of a shapefile without the geometries. geopandas is
+    only needed when a lookup table is rebuilt."""
+    import geopandas as gpd
+
+    return pd.DataFrame(gpd.read_file(path_shp, ignore_geometry=True))
+
+
+def build_txdist():
+    txdist_tmp = read_shp_attributes(path_txdot_districts_shp)
+    return txdist_tmp[["DIST_NBR", "DIST_NM"]].rename(
+        columns={"DIST_NBR": "txdot_dist", "DIST_NM": "district"}
+    )
+
+
+def build_county():
+    gdf_county = read_shp_attributes(path_county_shp)
+    gdf_county = gdf_county.rename(columns=get_snake_case_dict(gdf_county))
+    return gdf_county.filter(items=["txdot_dist", "cnty_nm", "fips_st_cn"])
+
+
+def build_dgcodes():
+    # pd.read_excel needs openpyxl; only called when the lookup table is rebuilt.
+    return pd.read_excel(path_dgcode_map)
+
+
+def get_txdist():
+    """TxDOT district number (txdot_dist) to district name (district)."""
+    return read_lookup_tbl(
+        tbl_nm="txdist", src_paths=[path_txdot_districts_shp], build_fn=build_txdist
+    )
+
+
+def get_county():
+    """County name (cnty_nm) and state + county FIPS (fips_st_cn) to TxDOT district
+    number (txdot_dist)."""
+    return read_lookup_tbl(
+        tbl_nm="county", src_paths=[path_county_shp], build_fn=build_county
+    )
+
+
+def get_dgcodes():
+    """District to district group (dgcode) map."""
+    return read_lookup_tbl(
+        tbl_nm="dgcodes", src_paths=[path_dgcode_map], build_fn=build_dgcodes
+    )
+
+
+if __name__ == "__main__":
+    get_txdist()
+    get_county()
+    get_dgcodes()
+    print(
+        "----------------------------------------------------------------------------\n"
+        "Finished Processing lookup_tbls.py\n"
+        "----------------------------------------------------------------------------\n"
+    )
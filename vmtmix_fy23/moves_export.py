@@ -0,0 +1,309 @@
+"""
+Load the final VMT-Mix into the MOVES county input databases. Each county gets the
+VMT-Mix of its TxDOT district (or its own VMT-Mix for the county level VMT-Mix),
+mapped to MOVES table layouts (`moves_tbl_builders`), and optionally the MOVES
+hourVMTFraction and dayVMTFraction tables (`moves_frac_tbl_builders`).
+There is one database per county and analysis year (`db_nm_fmt`), loaded in one
+transaction: the tables are created if missing, the rows are deleted, and the new rows
+are bulk-loaded with LOAD DATA LOCAL INFILE (MariaDB/MySQL) or batched executemany
+(other databases, e.g., SQLite for testing). The tables are built once per district
+and year and reused for the counties in the district.
+Created by: Apoorb
+Created on: 03/20/2023
+"""
+import csv
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sqlalchemy import (
+    Column,
+    Float,
+    MetaData,
+    SmallInteger,
+    String,
+    Table,
+    create_engine,
+    text,
+)
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
+from vmtmix_fy23.utils import (
+    ALL_RDTYPE_ID,
+    get_engine_to_output_to_db,
+    get_roadtype_id,
+    timing,
+)
+from vmtmix_fy23.lookup_tbls import get_county, get_txdist
+
+moves_metadata = MetaData()
+# MOVES does not have a table for the SUT + fuel type split of the VMT by road type,
+# day type, and TOD, so the VMT-Mix is stored in a vmtmix table with MOVES key names.
+Table(
+    "vmtmix",
+    moves_metadata,
+    Column("yearID", SmallInteger, primary_key=True),
+    Column("roadTypeID", SmallInteger, primary_key=True),
+    Column("dowagg", String(3), primary_key=True),
+    Column("tod", String(3), primary_key=True),
+    Column("sourceTypeID", SmallInteger, primary_key=True),
+    Column("fuelTypeID", SmallInteger, primary_key=True),
+    Column("vmtMixFraction", Float),
+)
+# MOVES hourVMTFraction and dayVMTFraction from
+# `vii_vmt_mix_disagg.get_moves_vmt_fracs`.
+Table(
+    "hourvmtfraction",
+    moves_metadata,
+    Column("sourceTypeID", SmallInteger, primary_key=True),
+    Column("roadTypeID", SmallInteger, primary_key=True),
+    Column("dayID", SmallInteger, primary_key=True),
+    Column("hourID", SmallInteger, primary_key=True),
+    Column("hourVMTFraction", Float),
+)
+Table(
+    "dayvmtfraction",
+    moves_metadata,
+    Column("sourceTypeID", SmallInteger, primary_key=True),
+    Column("monthID", SmallInteger, primary_key=True),
+    Column("roadTypeID", SmallInteger, primary_key=True),
+    Column("dayID", SmallInteger, primary_key=True),
+    Column("dayVMTFraction", Float),
+)
+EXECUTEMANY_BATCH = 10000
+
+
+def build_vmtmix_tbl(vmt_mix_):
+    """VMT-Mix of a district and year in the vmtmix table layout. The all road types
+    ("ALL") rows are not a MOVES road type and are dropped."""
+    return (
+        vmt_mix_.assign(roadTypeID=lambda df: get_roadtype_id(df.mvs_rdtype))
+        .loc[lambda df: df.roadTypeID != ALL_RDTYPE_ID]
+        .rename(columns={"vmt_mix": "vmtMixFraction"})
+        .filter(items=[col.name for col in moves_metadata.tables["vmtmix"].columns])
+        .sort_values(["roadTypeID", "dowagg", "tod", "sourceTypeID", "fuelTypeID"])
+        .reset_index(drop=True)
+    )
+
+
+def build_vmt_frac_tbl(tbl_nm):
+    """Function that selects the `tbl_nm` table columns of a district and year of the
+    `vii_vmt_mix_disagg.get_moves_vmt_fracs` tables."""
+    cols = [col.name for col in moves_metadata.tables[tbl_nm].columns]
+
+    def build_fn(vmt_frac_):
+        return vmt_frac_[cols].sort_values(cols[:-1]).reset_index(drop=True)
+
+    return build_fn
+
+
+# Table name to function that maps the VMT-Mix of a district and year to the table.
+moves_tbl_builders = {"vmtmix": build_vmtmix_tbl}
+# Tables loaded from the `vii_vmt_mix_disagg.get_moves_vmt_fracs` output instead of
+# the VMT-Mix.
+moves_frac_tbl_builders = {
+    tbl_nm: build_vmt_frac_tbl(tbl_nm)
+    for tbl_nm in ["hourvmtfraction", "dayvmtfraction"]
+}
+
+
+def get_county_district_map():
+    """County FIPS (fips_st_cn), county name (cnty_nm), and TxDOT district name."""
+    return (
+        get_county()
+        .merge(get_txdist(), on="txdot_dist", how="left")
+        .filter(items=["fips_st_cn", "cnty_nm", "district"])
+    )
+
+
+def get_moves_db_engine(db_nm):
+    """Engine to the `db_nm` MariaDB database; the database is created if missing.
+    LOAD DATA LOCAL INFILE needs the local_infile client option."""
+    server_engine = get_engine_to_output_to_db("")
+    with server_engine.begin() as conn:
+        conn.execute(text(f"CREATE DATABASE IF NOT EXISTS `{db_nm}`"))
+    server_engine.dispose()
+    return create_engine(
+        get_engine_to_output_to_db(db_nm).url, connect_args={"local_infile": True}
+    )
+
+
+def load_data_infile(conn, tbl, data_):
+    """Bulk-load `data_` into `tbl` with LOAD DATA LOCAL INFILE from a temporary
+    tab-delimited file. The lines end with "\\n" on all platforms and the missing
+    values are written as "\\N" (NULL); LOAD DATA would load an empty field as 0."""
+    cols = [col.name for col in tbl.columns]
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".tab", delete=False, newline=""
+    ) as tmp_fi:
+        data_[cols].to_csv(
+            tmp_fi,
+            sep="\t",
+            index=False,
+            header=False,
+            quoting=csv.QUOTE_NONE,
+            lineterminator="\n",
+            na_rep="\\N",
+        )
+    try:
+        path_tmp = Path(tmp_fi.name).as_posix()
+        conn.execute(
+            text(
+                f"LOAD DATA LOCAL INFILE '{path_tmp}' INTO TABLE `{tbl.name}` "
+                f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                f"({', '.join(f'`{col}`' for col in cols)})"
+            )
+        )
+    finally:
+        os.remove(tmp_fi.name)
+
+
+def executemany(conn, tbl, data_, batch_size=EXECUTEMANY_BATCH):
+    """Insert `data_` into `tbl` with executemany in batches of `batch_size` rows."""
+    cols = [col.name for col in tbl.columns]
+    records = data_[cols].to_dict("records")
+    for start in range(0, len(records), batch_size):
+        conn.execute(tbl.insert(), records[start : start + batch_size])
+
+
+def load_county_db(engine, moves_tbls_, method="auto"):
+    """
+    Load the tables into one county database in one transaction: create the tables if
+    missing, delete their rows, and insert the new rows.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Engine
+    moves_tbls_: dict
+        Table name to the rows (pd.DataFrame) in the table layout.
+    method: str
+        "load_data" (LOAD DATA LOCAL INFILE), "executemany", or "auto" (load_data for
+        MariaDB/MySQL and executemany otherwise).
+    """
+    if method == "auto":
+        is_mysql = engine.dialect.name in ("mysql", "mariadb")
+        method = "load_data" if is_mysql else "executemany"
+    load_fn = {"load_data": load_data_infile, "executemany": executemany}[method]
+    with engine.begin() as conn:
+        for tbl_nm, data in moves_tbls_.items():
+            tbl = moves_metadata.tables[tbl_nm]
+            tbl.create(conn, checkfirst=True)
+            conn.execute(tbl.delete())
+            load_fn(conn, tbl, data)
+
+
+@timing
+def export_vmt_mix_to_moves(
+    vmt_mix_,
+    engine_factory=None,
+    db_nm_fmt="c{fips_st_cn}y{yearID}_in",
+    vmt_fracs_=None,
+    tbl_nms=None,
+    county_dist_=None,
+    method="auto",
+    n_jobs=1,
+):
+    """
+    Load the VMT-Mix into the MOVES county input databases.
+
+    Parameters
+    ----------
+    vmt_mix_: pd.DataFrame
+        Final VMT-Mix (`vii_vmt_mix_disagg.fin_vmt_mix` output). A county VMT-Mix (with
+        the county column) is loaded to each county; otherwise each county gets the
+        VMT-Mix of its district.
+    engine_factory: callable, optional
+        Function of the database name that returns a sqlalchemy engine. Defaults to
+        `get_moves_db_engine` (MariaDB).
+    db_nm_fmt: str
+        Database name format; formatted with fips_st_cn, cnty_nm, district, yearID.
+    vmt_fracs_: dict, optional
+        hourvmtfraction and dayvmtfraction tables by district (county) and yearID
+        (`vii_vmt_mix_disagg.get_moves_vmt_fracs` output).
+    tbl_nms: list, optional
+        Tables in `moves_tbl_builders` and `vmt_fracs_` to load. Defaults to all.
+    county_dist_: pd.DataFrame, optional
+        County (fips_st_cn, cnty_nm) to district map. Defaults to
+        `get_county_district_map`.
+    method: str
+        See `load_county_db`.
+    n_jobs: int
+        Number of databases loaded at the same time (threads).
+    Returns
+    -------
+    list
+        Names of the loaded databases.
+    """
+    engine_factory = get_moves_db_engine if engine_factory is None else engine_factory
+    vmt_fracs_ = {} if vmt_fracs_ is None else vmt_fracs_
+    unknown_tbls = set(vmt_fracs_) - set(moves_frac_tbl_builders)
+    assert not unknown_tbls, f"Unknown VMT fraction tables {sorted(unknown_tbls)}."
+    if tbl_nms is None:
+        tbl_nms = list(moves_tbl_builders) + list(vmt_fracs_)
+    miss_tbls = set(tbl_nms) - set(moves_tbl_builders) - set(vmt_fracs_)
+    assert not miss_tbls, f"No data for the tables {sorted(miss_tbls)}."
+    county_dist_ = get_county_district_map() if county_dist_ is None else county_dist_
+    # County VMT-Mix (county names) or district VMT-Mix.
+    if "county" in vmt_mix_.columns:
+        spatial_col, county_col = "county", "cnty_nm"
+    else:
+        spatial_col, county_col = "district", "district"
+    miss_units = set(county_dist_[county_col]) - set(vmt_mix_[spatial_col])
+    assert not miss_units, f"No VMT-Mix for the {spatial_col} {sorted(miss_units)}."
+    # Tables by district (county) and year; the counties in a district share them.
+    moves_tbls = {
+        (unit, year_id): {
+            tbl_nm: moves_tbl_builders[tbl_nm](vmt_mix_unit_yr)
+            for tbl_nm in tbl_nms
+            if tbl_nm in moves_tbl_builders
+        }
+        for (unit, year_id), vmt_mix_unit_yr in vmt_mix_.groupby(
+            [spatial_col, "yearID"], sort=True
+        )
+    }
+    for tbl_nm in [tbl_nm for tbl_nm in tbl_nms if tbl_nm in vmt_fracs_]:
+        for (unit, year_id), vmt_frac_unit_yr in vmt_fracs_[tbl_nm].groupby(
+            [spatial_col, "yearID"], sort=True
+        ):
+            if (unit, year_id) in moves_tbls:
+                build_fn = moves_frac_tbl_builders[tbl_nm]
+                moves_tbls[(unit, year_id)][tbl_nm] = build_fn(vmt_frac_unit_yr)
+    tasks = [
+        (
+            db_nm_fmt.format(
+                fips_st_cn=county.fips_st_cn,
+                cnty_nm=county.cnty_nm,
+                district=county.district,
+                yearID=year_id,
+            ),
+            moves_tbls[(getattr(county, county_col), year_id)],
+        )
+        for county in county_dist_.itertuples(index=False)
+        for year_id in sorted(vmt_mix_.yearID.unique())
+    ]
+
+    def load_task(task):
+        db_nm, moves_tbls_ = task
+        engine = engine_factory(db_nm)
+        try:
+            load_county_db(engine, moves_tbls_, method=method)
+        finally:
+            engine.dispose()
+        return db_nm
+
+    if n_jobs == 1:
+        return [load_task(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(load_task, tasks))
+
+
+if __name__ == "__main__":
+    from vmtmix_fy23.vmt_mix_store import get_vmt_mix
+
+    export_vmt_mix_to_moves(vmt_mix_=get_vmt_mix(), n_jobs=4)
+    print(
+        "----------------------------------------------------------------------------\n"
+        "Finished Processing moves_export.py\n"
+        "----------------------------------------------------------------------------\n"
+    )
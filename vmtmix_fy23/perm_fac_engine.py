@@ -0,0 +1,368 @@
+"""
+Factor engine for the permanent counter factors. Reads each permanent counter source
+once, derives the calendar fields, filters the years, and rolls the counts up to
+station-days once. All the factor families of a source are computed from this shared
+daily rollup:
+    PERM_CLASS_BY_HR (counts by vehicle class):
+        dow_agg_by_cls: DOW (Wkd, Fri, Sat, Sun) factors by vehicle category.
+        mnth_by_cls: Month factors by vehicle category.
+    TxDOT_PERM_HOURLY_DATA (ATR total volumes):
+        mnth_dow: Month x DOW factors.
+Created by: Apoorb
+Created on: 03/08/2023
+"""
+from pathlib import Path
+import pandas as pd
+import pyarrow.parquet as pq
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
+from vmtmix_fy23.utils import (
+    ChainedAssignent,
+    add_calendar_cols,
+    agg_veh_cls,
+    calendar_cols,
+    get_dow_nm,
+    get_holiday_mask,
+    get_mnth_nm,
+    get_veh_cls_cnt_block,
+    path_interm,
+    path_txdot_fy22,
+    timing,
+    veh_cls_cols,
+    veh_cls_schemes,
+)
+
+switchoff_chainedass_warn = ChainedAssignent()
+
+
+def fun_region_episode(atr_data, episode_index, region_cat_name, value_cols=None):
+    """
+    Function to calculate the adt of a given region (region_cat_name, e.g. district,
+    MPO) and episode (episode_index, e.g., weekend, summer) the region_cat_name should
+    a field in the df atr_data, episode_index is a column of logical variable whose
+    length is the same as df atr_data
+    Parameters
+    ----------
+    atr_data
+    episode_index
+    region_cat_name
+    value_cols: columns to average. All the columns if None.
+
+    Returns
+    -------
+
+    """
+    episode_atr_data = atr_data[episode_index]
+    with switchoff_chainedass_warn:
+        if value_cols is None:
+            region_episode_atr_data = (
+                episode_atr_data.groupby([region_cat_name]).mean().reset_index()
+            )
+        else:
+            region_episode_atr_data = (
+                episode_atr_data.groupby([region_cat_name])[value_cols]
+                .mean()
+                .reset_index()
+            )
+    return region_episode_atr_data
+
+
+class PermFacEngine:
+    """
+    Compute the permanent counter factor families from one scan of each source.
+
+    Parameters
+    ----------
+    min_yr: int
+        First year of the counter data used for the factors.
+    max_yr: int
+        Last year of the counter data used for the factors.
+    perm_file: str
+        Permanent counter class data parquet file (from `i_raw_dt_prc`).
+    atr_dir: str
+        ATR hourly parquet dataset (from `i_raw_dt_prc`).
+    excl_holidays: bool
+        Exclude the federal holidays from the factor computations.
+    """
+
+    veh_cls_scheme = "perm_hpms"
+    vehclscntcols = veh_cls_schemes[veh_cls_scheme]["vehclscntcols"]
+    agg_vtype_cols = veh_cls_schemes[veh_cls_scheme]["agg_vtype_cols"]
+    map_dow = {
+        "Mon": "Wkd",
+        "Tue": "Wkd",
+        "Wed": "Wkd",
+        "Thu": "Wkd",
+        "Fri": "Fri",
+        "Sat": "Sat",
+        "Sun": "Sun",
+    }
+
+    def __init__(
+        self,
+        min_yr=2013,
+        max_yr=2019,
+        perm_file="PERM_CLASS_BY_HR_2013_2021.parquet",
+        atr_dir="TxDOT_PERM_HOURLY_DATA_2013_092021",
+        excl_holidays=False,
+    ):
+        self.min_yr = min_yr
+        self.max_yr = max_yr
+        self.excl_holidays = excl_holidays
+        self.path_perm_countr_pq = Path.joinpath(path_txdot_fy22, perm_file)
+        self.path_atr_hourly_pq = Path.joinpath(path_txdot_fy22, atr_dir)
+        # The region needs to be the same as the field name in the counter data.
+        self.region = "district"
+        self.atr_region = "DISTRICT"
+        self._perm_daily = None
+        self._atr_daily = None
+        self.fac_families = {
+            "dow_agg_by_cls": self.dow_agg_by_cls,
+            "mnth_by_cls": self.mnth_by_cls,
+            "mnth_dow": self.mnth_dow,
+        }
+
+    @property
+    def perm_daily(self):
+        """Daily HPMS category counts by station from the PERM class data. Read and
+        rolled up on first use."""
+        if self._perm_daily is None:
+            self._perm_daily = self.read_perm_daily()
+        return self._perm_daily
+
+    @property
+    def atr_daily(self):
+        """Daily total volumes by station from the ATR hourly data. Read on first
+        use."""
+        if self._atr_daily is None:
+            self._atr_daily = self.read_atr_daily()
+        return self._atr_daily
+
+    @timing
+    def read_perm_daily(self):
+        """
+        Read the columns of the PERM class data used for the factors for [min_yr,
+        max_yr], sum the classes to the HPMS categories, and roll the counts up to
+        station-days. Uses the calendar columns added in `i_raw_dt_prc`, and derives
+        them if the parquet file predates them. Flags the days with zero PC, PT_LCT, or
+        HDV counts.
+        """
+        pq_cols = pq.read_schema(self.path_perm_countr_pq).names
+        has_cal_cols = set(calendar_cols).issubset(pq_cols)
+        read_cols = ["sta_pre_id_suf_fr", self.region, "mvs_rdtype"] + veh_cls_cols
+        read_cols += calendar_cols if has_cal_cols else ["start_datetime"]
+        perm_countr = pq.read_table(
+            self.path_perm_countr_pq, columns=read_cols
+        ).to_pandas()
+        if not has_cal_cols:
+            perm_countr = add_calendar_cols(perm_countr)
+        perm_countr = perm_countr.loc[
+            (perm_countr.year <= self.max_yr) & (perm_countr.year >= self.min_yr)
+        ].reset_index(drop=True)
+        if self.excl_holidays:
+            perm_countr = perm_countr.loc[~perm_countr.is_holiday].reset_index(
+                drop=True
+            )
+        # Sum the FHWA classes to the HPMS categories with one matrix multiply.
+        cnt_block = get_veh_cls_cnt_block(perm_countr)
+        perm_countr = pd.concat(
+            [
+                perm_countr.drop(columns=veh_cls_cols),
+                agg_veh_cls(
+                    cnt_block, scheme=self.veh_cls_scheme, index=perm_countr.index
+                ),
+            ],
+            axis=1,
+        )
+        perm_daily = perm_countr.groupby(
+            ["sta_pre_id_suf_fr", self.region, "mvs_rdtype", "date_id", "month", "dow"],
+            as_index=False,
+        )[self.agg_vtype_cols].sum()
+        perm_daily["mnth_nm"] = get_mnth_nm(perm_daily.month)
+        perm_daily["dow_nm"] = get_dow_nm(perm_daily.dow)
+        perm_daily["Total"] = perm_daily[self.agg_vtype_cols].sum(axis=1)
+        perm_daily["dowagg"] = perm_daily.dow_nm.map(self.map_dow)
+        # XXX: Zero MC and Buses in a day seems reasonable. Need more investigation if we
+        # need more thorough anawer.
+        perm_daily["nonzero"] = ~(perm_daily[["PC", "PT_LCT", "HDV"]] == 0).any(axis=1)
+        assert all(
+            perm_daily[
+                [self.region, "mnth_nm", "dow_nm"] + self.agg_vtype_cols + ["Total"]
+            ]
+            .isna()
+            .sum(axis=0)
+            .values
+            == 0
+        )
+        return perm_daily
+
+    @timing
+    def read_atr_daily(self):
+        """
+        Read the DISTRICT, LOCAL_ID, ST_DATE, and TOTAL columns of the ATR hourly
+        dataset for [min_yr, max_yr] (each row is a station-day), derive the month and
+        DOW, and drop the days with zero volume (and the federal holidays if
+        `excl_holidays`).
+        """
+        assert self.path_atr_hourly_pq.exists(), (
+            f"{self.path_atr_hourly_pq} does not exist. Run i_raw_dt_prc.raw_dt_prc to "
+            f"create the ATR hourly parquet dataset."
+        )
+        atr_daily = pq.read_table(
+            self.path_atr_hourly_pq,
+            columns=[self.atr_region, "LOCAL_ID", "ST_DATE", "TOTAL"],
+            filters=[("Year", ">=", self.min_yr), ("Year", "<=", self.max_yr)],
+        ).to_pandas()
+        atr_daily["Month"] = atr_daily.ST_DATE.dt.month
+        # Extract the day of the week
+        atr_daily["day"] = atr_daily["ST_DATE"].dt.dayofweek
+        atr_daily = atr_daily[atr_daily["TOTAL"] != 0]
+        if self.excl_holidays:
+            date_ids = (
+                atr_daily.ST_DATE.dt.normalize() - pd.Timestamp("1970-01-01")
+            ).dt.days
+            atr_daily = atr_daily[~get_holiday_mask(date_ids)]
+        assert all(
+            atr_daily.groupby([self.atr_region]).LOCAL_ID.nunique().values >= 5
+        ), "At least 5 stations should be present per district."
+        return atr_daily
+
+    def get_aadt_by_cls(self):
+        """AADT by region and vehicle category from the non-zero days."""
+        return fun_region_episode(
+            self.perm_daily,
+            self.perm_daily.nonzero,
+            self.region,
+            value_cols=self.agg_vtype_cols + ["Total"],
+        )
+
+    def dow_agg_by_cls(self):
+        """
+        AERR20_Days: ratios of the DOW (Wkd, Fri, Sat, Sun) ADT to the AADT by vehicle
+        category.
+        """
+        cat_cols = self.agg_vtype_cols + ["Total"]
+        aadt = self.get_aadt_by_cls()
+        dow_adt = (
+            self.perm_daily.groupby([self.region, "dowagg"])[cat_cols]
+            .mean()
+            .reset_index()
+        )
+        df_adt = aadt.merge(
+            dow_adt,
+            how="left",
+            left_on=[self.region],
+            right_on=[self.region],
+            suffixes=("", "_dow"),
+        )
+        for col in cat_cols:
+            df_adt[f"f_m_d_{col}"] = df_adt[f"{col}_dow"] / df_adt[col]
+        return df_adt
+
+    def mnth_by_cls(self):
+        """Ratios of the monthly ADT to the AADT by vehicle category."""
+        cat_cols = self.agg_vtype_cols + ["Total"]
+        aadt = self.get_aadt_by_cls()
+        perm_daily_nonzero = self.perm_daily.loc[self.perm_daily.nonzero]
+        mnth_adt = (
+            perm_daily_nonzero.groupby([self.region, "mnth_nm"])[cat_cols]
+            .mean()
+            .reset_index()
+        )
+        df_adt = aadt.merge(
+            mnth_adt,
+            how="left",
+            on=[self.region],
+            suffixes=("", "_mnth"),
+        )
+        for col in cat_cols:
+            df_adt[f"f_m_{col}"] = df_adt[f"{col}_mnth"] / df_adt[col]
+        return df_adt
+
+    def mnth_dow(self):
+        """Ratios of the month x DOW ADT to the AADT from the ATR total volumes."""
+        region = self.atr_region
+        aadt = fun_region_episode(
+            self.atr_daily, self.atr_daily["Month"] > 0, region, value_cols=["TOTAL"]
+        )
+        aadt = aadt[[region, "TOTAL"]]
+        Index_template = aadt.copy(deep=True)
+        Index_template.sort_values(by=region, ascending=True, inplace=True)
+        Index_template[region + "_alphabet_order"] = list(
+            range(1, Index_template[region].shape[0] + 1)
+        )
+        Index_template.drop(columns={"TOTAL"}, inplace=True)
+        df_adt = aadt.merge(
+            Index_template,
+            how="left",
+            left_on=[region],
+            right_on=[region],
+            suffixes=("", "_r"),
+        )
+        month_adt = (
+            self.atr_daily.groupby([region, "Month", "day"])[["TOTAL"]]
+            .mean()
+            .reset_index()
+        )
+        month_adt["dow_nm"] = get_dow_nm(month_adt["day"])
+        month_adt["mnth_nm"] = get_mnth_nm(month_adt["Month"])
+        df_adt = df_adt.merge(
+            month_adt,
+            how="left",
+            left_on=[region],
+            right_on=[region],
+            suffixes=("", "_mnth_dow"),
+        )
+        df_adt = df_adt.rename(
+            columns={"TOTAL": "AADT", "TOTAL_mnth_dow": "ADT_mnth_dow"}
+        )
+        df_adt["f_m_d"] = df_adt.ADT_mnth_dow / df_adt.AADT
+        return df_adt
+
+    def run(self, out_fis):
+        """
+        Compute the factor families in `out_fis` ({family: out_fi}) and write each to
+        `out_fi` in the intermediate folder. Each source is read and rolled up once,
+        no matter how many of its families are requested.
+        """
+        fac_dfs = {}
+        for fac_family, out_fi in out_fis.items():
+            fac_dfs[fac_family] = self.fac_families[fac_family]()
+            fac_dfs[fac_family].to_csv(
+                Path.joinpath(path_interm, out_fi), sep="\t", index=False
+            )
+        return fac_dfs
+
+
+@timing
+def perm_cntr_facs(out_fis, min_yr, max_yr, excl_holidays=False):
+    """
+    Create the permanent counter factors: DOW by veh class factors that will be applied
+    to the AADT from ATR data by vehicle class, and DOW + Month Factors to convert the
+    ADT data in the MVC to AADT data. `out_fis` maps the factor families
+    ("dow_agg_by_cls", "mnth_by_cls", "mnth_dow") to the output file names. Set
+    `excl_holidays` to True to exclude the federal holidays from the factors.
+    """
+    perm_fac_engine = PermFacEngine(
+        min_yr=min_yr, max_yr=max_yr, excl_holidays=excl_holidays
+    )
+    return perm_fac_engine.run(out_fis=out_fis)
+
+
+if __name__ == "__main__":
+    perm_cntr_facs(
+        out_fis={
+            "dow_agg_by_cls": "conv_aadt2dow_by_vehcat.tab",
+            "mnth_by_cls": "conv_aadt2mnth_by_vehcat.tab",
+            "mnth_dow": "conv_aadt2mnth_dow.tab",
+        },
+        min_yr=2013,
+        max_yr=2019,
+    )
+    print(
+        "----------------------------------------------------------------------------\n"
+        "Finished Processing perm_fac_engine.py\n"
+        "----------------------------------------------------------------------------\n"
+    )
@@ -0,0 +1,157 @@
+"""
+Opt-in per-stage profiling for the VMT-Mix pipeline. Uses the pyinstrument sampling
+profiler when it is installed, and falls back to cProfile otherwise. For each stage it
+writes a flamegraph file and a top-N hot-function table to the run directory:
+    pyinstrument: <stage>.speedscope.json (open in https://www.speedscope.app) and
+    <stage>_top_funcs.tab
+    cProfile: <stage>.prof (open with snakeviz or flameprof) and <stage>_top_funcs.tab
+Created by: Apoorb
+Created on: 03/06/2023
+"""
+import cProfile
+import os
+import pstats
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+import pandas as pd
+
+try:
+    import pyinstrument
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:
+    pyinstrument = None
+
+# Set VMTMIX_PROFILE to 1/true/yes to profile the stages without changing the call.
+ENV_PROFILE = "VMTMIX_PROFILE"
+
+
+def profiling_enabled(profile=None):
+    """Profile if `profile` is True, or if `profile` is None and the VMTMIX_PROFILE
+    environment variable is set to a truthy value."""
+    if profile is not None:
+        return bool(profile)
+    return os.environ.get(ENV_PROFILE, "").strip().lower() in ("1", "true", "yes")
+
+
+class StageProfiler:
+    """
+    Profile pipeline stages and write the per-stage outputs to `path_run_dir`.
+
+    Parameters
+    ----------
+    path_run_dir: Path
+        Directory where the flamegraph files and top-N tables are written.
+    top_n: int
+        Number of functions in the hot-function table.
+    interval: float
+        Sampling interval in seconds for pyinstrument.
+    use_cprofile: bool
+        Use cProfile even if pyinstrument is installed.
+    """
+
+    def __init__(self, path_run_dir, top_n=30, interval=0.005, use_cprofile=False):
+        self.path_run_dir = Path(path_run_dir)
+        self.path_run_dir.mkdir(parents=True, exist_ok=True)
+        self.top_n = top_n
+        self.interval = interval
+        self.use_cprofile = use_cprofile or (pyinstrument is None)
+
+    @contextmanager
+    def stage(self, stage_nm):
+        """Profile the code run within the context as stage `stage_nm`."""
+        if self.use_cprofile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self.write_cprofile(profiler, stage_nm)
+        else:
+            profiler = pyinstrument.Profiler(interval=self.interval)
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                self.write_pyinstrument(profiler, stage_nm)
+
+    def write_cprofile(self, profiler, stage_nm):
+        """Write the cProfile stats and the top-N functions by cumulative time."""
+        profiler.dump_stats(str(Path.joinpath(self.path_run_dir, f"{stage_nm}.prof")))
+        stats = pstats.Stats(profiler)
+        top_funcs = pd.DataFrame(
+            [
+                dict(
+                    function=func_nm,
+                    file=file_nm,
+                    line=line_no,
+                    ncalls=ncalls,
+                    self_time_sec=tottime,
+                    cum_time_sec=cumtime,
+                )
+                for (file_nm, line_no, func_nm), (
+                    _,
+                    ncalls,
+                    tottime,
+                    cumtime,
+                    _,
+                ) in stats.stats.items()
+            ]
+        )
+        self.write_top_funcs(top_funcs, stage_nm)
+
+    def write_pyinstrument(self, profiler, stage_nm):
+        """Write the speedscope flamegraph and the top-N functions by self time."""
+        session = profiler.last_session
+        path_speedscope = Path.joinpath(
+            self.path_run_dir, f"{stage_nm}.speedscope.json"
+        )
+        with open(path_speedscope, "w") as fi:
+            fi.write(SpeedscopeRenderer().render(session))
+        # Walk the call tree and sum the self time by function.
+        records = []
+        frames = [session.root_frame()]
+        while frames:
+            frame = frames.pop()
+            if frame is None:
+                continue
+            records.append(
+                dict(
+                    function=frame.function,
+                    file=frame.file_path,
+                    line=frame.line_no,
+                    self_time_sec=frame.total_self_time,
+                    cum_time_sec=frame.time,
+                )
+            )
+            frames.extend(frame.children)
+        top_funcs = (
+            pd.DataFrame(records)
+            .groupby(["function", "file", "line"], as_index=False, dropna=False)
+            .agg(
+                nframes=("self_time_sec", "size"),
+                self_time_sec=("self_time_sec", "sum"),
+                cum_time_sec=("cum_time_sec", "max"),
+            )
+        )
+        self.write_top_funcs(top_funcs, stage_nm)
+
+    def write_top_funcs(self, top_funcs, stage_nm):
+        """Write the `top_n` functions with the most self time."""
+        top_funcs = top_funcs.sort_values("self_time_sec", ascending=False).head(
+            self.top_n
+        )
+        top_funcs.to_csv(
+            Path.joinpath(self.path_run_dir, f"{stage_nm}_top_funcs.tab"),
+            sep="\t",
+            index=False,
+        )
+
+
+def profile_stage(profiler, stage_nm):
+    """Return the profiling context for `stage_nm`; a no-op context if `profiler` is
+    None, so that the stages cost nothing when profiling is off."""
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(stage_nm)
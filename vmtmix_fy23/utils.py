@@ -8,11 +8,24 @@ import pandas as pd
 import re
 import inflection
 from functools import wraps
-from time import time
+from concurrent.futures import ProcessPoolExecutor
+from time import time, process_time
 from sqlalchemy import create_engine
 import mysql.connector as mariadb
+import os
 import sys
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
 # Set path to the code and datasets.
 path_prj_code = Path(r"C:\Users\a-bibeka\PycharmProjects\FY23_VMT_Mix")
@@ -101,25 +114,432 @@ def get_snake_case_dict(columns):
     return {col: re.sub(r"\W+", "_", inflection.underscore(col)) for col in columns}
 
 
+# Time of day (TOD) periods of the final VMT-Mix and the hours in each period.
+tod_map = {
+    "AM": (6, 7, 8),
+    "MD": (9, 10, 11, 12, 13, 14, 15),
+    "PM": (16, 17, 18),
+    "ON": (19, 20, 21, 22, 23, 0, 1, 2, 3, 4, 5),
+}
+
+
+def get_tod_lng_map(tod_map_):
+    """Map each hour in `tod_map_` to its TOD period."""
+    tod_lng_map = {}
+    for key, vals in tod_map_.items():
+        for val in vals:
+            tod_lng_map[val] = key
+    return tod_lng_map
+
+
+# FHWA vehicle class count columns in the MVC and permanent counter data.
+veh_cls_cols = [f"class{i}" for i in range(1, 16)]
+# Vehicle class registry: maps the FHWA classes to the vehicle categories of each
+# aggregation scheme. Classes mapped to a category not in the scheme's category list
+# (e.g. "Unk") are dropped.
+veh_cls_schemes = {
+    # MVC counts to the HPMS categories with SU and CT HDVs separated.
+    "mvc_hpms": {
+        "vehclscntcols": {
+            "class1": "MC",
+            "class2": "PC",
+            "class3": "PT_LCT",
+            "class4": "Bus",
+            "class5": "SU_MH_RT_HDV",
+            "class6": "SU_MH_RT_HDV",
+            "class7": "SU_MH_RT_HDV",
+            "class8": "CT_HDV",
+            "class9": "CT_HDV",
+            "class10": "CT_HDV",
+            "class11": "CT_HDV",
+            "class12": "CT_HDV",
+            "class13": "CT_HDV",
+            "class14": "Unk",
+            "class15": "Unk",
+        },
+        "agg_vtype_cols": ["MC", "PC", "PT_LCT", "Bus", "SU_MH_RT_HDV", "CT_HDV"],
+    },
+    # Permanent counter counts to the HPMS categories. Couldn't separate SU vs. CT in
+    # the permanent counter data; a lot of bad readings.
+    "perm_hpms": {
+        "vehclscntcols": {
+            "class1": "MC",
+            "class2": "PC",
+            "class3": "PT_LCT",
+            "class4": "Bus",
+            "class5": "HDV",
+            "class6": "HDV",
+            "class7": "HDV",
+            "class8": "HDV",
+            "class9": "HDV",
+            "class10": "HDV",
+            "class11": "HDV",
+            "class12": "HDV",
+            "class13": "HDV",
+            "class14": "HDV",
+            "class15": "HDV",
+        },
+        "agg_vtype_cols": ["MC", "PC", "PT_LCT", "Bus", "HDV"],
+    },
+}
+
+
+def get_veh_cls_agg_mat(vehclscntcols_, agg_vtype_cols_):
+    """
+    Get the (15 x k) aggregation matrix of a vehicle class scheme. Entry (i, j) is 1
+    if FHWA class i + 1 is in the vehicle category `agg_vtype_cols_[j]`. The matrix is
+    small, so it is kept dense.
+    """
+    agg_mat = np.zeros((len(veh_cls_cols), len(agg_vtype_cols_)), dtype=np.int32)
+    vtype_idx = {vtype: idx for idx, vtype in enumerate(agg_vtype_cols_)}
+    for cls_idx, cls_col in enumerate(veh_cls_cols):
+        vtype = vehclscntcols_.get(cls_col)
+        if vtype in vtype_idx:
+            agg_mat[cls_idx, vtype_idx[vtype]] = 1
+    return agg_mat
+
+
+def get_veh_cls_cnt_block(data_):
+    """
+    Get the class1-class15 counts in `data_` as one contiguous (n x 15) array. Missing
+    counts are 0, as in `sum(axis=1)`. The block is int32 when the counts are whole
+    numbers, and float64 otherwise.
+    """
+    cnt_block = data_[veh_cls_cols].to_numpy(dtype=np.float64, na_value=0)
+    if np.array_equal(cnt_block, np.round(cnt_block)) and (
+        np.abs(cnt_block).max(initial=0) <= np.iinfo(np.int32).max
+    ):
+        cnt_block = cnt_block.astype(np.int32)
+    return np.ascontiguousarray(cnt_block)
+
+
+def agg_veh_cls(cnt_block_, scheme, index=None):
+    """
+    Sum the FHWA class counts (from `get_veh_cls_cnt_block`) to the vehicle categories
+    of the `veh_cls_schemes` `scheme` with one matrix multiply. Returns a float64
+    dataframe with one column per vehicle category.
+    """
+    agg_vtype_cols_ = veh_cls_schemes[scheme]["agg_vtype_cols"]
+    agg_mat = get_veh_cls_agg_mat(
+        veh_cls_schemes[scheme]["vehclscntcols"], agg_vtype_cols_
+    )
+    # Integer counts are summed exactly in int64 before the conversion to float64.
+    acc_dtype = np.int64 if cnt_block_.dtype.kind == "i" else np.float64
+    vtype_cnts = np.matmul(cnt_block_, agg_mat.astype(acc_dtype), dtype=acc_dtype)
+    return pd.DataFrame(
+        vtype_cnts.astype(np.float64), columns=agg_vtype_cols_, index=index
+    )
+
+
+# Calendar columns added to the counter data at ingestion (`add_calendar_cols`).
+calendar_cols = ["year", "month", "dow", "hour", "date_id", "is_holiday"]
+mnth_nms = np.array(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"],
+    dtype=object,
+)
+dow_nms = np.array(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"], dtype=object)
+
+
+def get_holiday_mask(date_ids_):
+    """
+    Flag the federal holidays (USFederalHolidayCalendar, observed dates) in
+    `date_ids_` (days since 1970-01-01). Vectorized: the holidays of the covered years
+    are computed once and matched with np.isin.
+    """
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+
+    date_ids_ = np.asarray(date_ids_)
+    if len(date_ids_) == 0:
+        return np.zeros(0, dtype=bool)
+    start = pd.Timestamp(int(date_ids_.min()), unit="D")
+    end = pd.Timestamp(int(date_ids_.max()), unit="D")
+    holidays = USFederalHolidayCalendar().holidays(start=start, end=end)
+    holiday_ids = (holidays - pd.Timestamp("1970-01-01")).days.to_numpy()
+    return np.isin(date_ids_, holiday_ids)
+
+
+def add_calendar_cols(data_, dt_col="start_datetime"):
+    """
+    Add the small-int calendar columns of the `dt_col` timestamps: year (int16), month
+    (int8, 1-12), dow (int8, Mon=0), hour (int8), date_id (int32, days since
+    1970-01-01), and the federal holiday flag is_holiday.
+    """
+    dt_ = data_[dt_col].dt
+    date_id = (
+        (data_[dt_col].dt.normalize() - pd.Timestamp("1970-01-01")).dt.days
+    ).to_numpy(dtype=np.int32)
+    return data_.assign(
+        year=dt_.year.astype(np.int16),
+        month=dt_.month.astype(np.int8),
+        dow=dt_.dayofweek.astype(np.int8),
+        hour=dt_.hour.astype(np.int8),
+        date_id=date_id,
+        is_holiday=get_holiday_mask(date_id),
+    )
+
+
+def get_mnth_nm(month_):
+    """Map the month numbers (1-12) to the short month names (Jan, ..., Dec)."""
+    return mnth_nms[np.asarray(month_, dtype=np.int64) - 1]
+
+
+def get_dow_nm(dow_):
+    """Map the day of week numbers (Mon=0) to the short day names (Mon, ..., Sun)."""
+    return dow_nms[np.asarray(dow_, dtype=np.int64)]
+
+
+def add_sta_code(data_, sta_col="sta_pre_id_suf_fr"):
+    """
+    Add the dense int32 station code `sta_code` (0, ..., n_stations - 1, in the sorted
+    order of the `sta_col` station ids; -1 for a missing id) to `data_`. Returns the
+    data and the station dictionary (sta_code, `sta_col`).
+    """
+    sta_code, sta_ids = pd.factorize(data_[sta_col], sort=True)
+    data_ = data_.assign(sta_code=sta_code.astype(np.int32))
+    sta_dict_ = pd.DataFrame(
+        {"sta_code": np.arange(len(sta_ids), dtype=np.int32), sta_col: sta_ids}
+    )
+    return data_, sta_dict_
+
+
+def count_distinct_codes(grp_ids_, codes_, n_grp):
+    """
+    Count the distinct non-negative integer `codes_` (e.g. station codes) in each of
+    the `n_grp` groups given by the group ids `grp_ids_` (0, ..., n_grp - 1). Uses
+    integer sorting and bincount instead of hashing the ids.
+    """
+    grp_ids_ = np.asarray(grp_ids_, dtype=np.int64)
+    codes_ = np.asarray(codes_, dtype=np.int64)
+    n_codes = codes_.max(initial=-1) + 1
+    grp_code_pairs = np.unique(grp_ids_ * n_codes + codes_)
+    return np.bincount(grp_code_pairs // max(n_codes, 1), minlength=n_grp)
+
+
+def get_grp_ids(data_, cols):
+    """
+    Get integer group ids (0, ..., n_grp - 1) for the unique combinations of `cols`
+    in `data_`, and the number of groups. Each column is factorized and the codes are
+    combined into one int64 key, so the group ids come from integer operations only.
+    """
+    grp_key = np.zeros(len(data_), dtype=np.int64)
+    for col in cols:
+        codes, uniques = pd.factorize(data_[col])
+        grp_key = grp_key * (len(uniques) + 1) + (codes + 1)
+    grp_ids, grp_keys = pd.factorize(grp_key)
+    return grp_ids, len(grp_keys)
+
+
+# Validation levels for the data checks in the pipeline:
+#   "off": skip the data checks.
+#   "fast": check the same invariants with vectorized count/sum comparisons on
+#       integer keys.
+#   "full": run the original (slower) checks.
+validation_levels = ("off", "fast", "full")
+# Set VMTMIX_VALIDATION to off/fast/full to change the level without changing the call.
+ENV_VALIDATION = "VMTMIX_VALIDATION"
+_validation_level = None
+
+
+def set_validation_level(level=None):
+    """Set the validation level. None resets it to the VMTMIX_VALIDATION environment
+    variable (default "full")."""
+    global _validation_level
+    assert level in validation_levels + (None,), (
+        f"validation level must be in {validation_levels}"
+    )
+    _validation_level = level
+
+
+def get_validation_level():
+    """Get the validation level set with `set_validation_level`, or from the
+    VMTMIX_VALIDATION environment variable (default "full")."""
+    if _validation_level is not None:
+        return _validation_level
+    level = os.environ.get(ENV_VALIDATION, "full").strip().lower()
+    assert level in validation_levels, (
+        f"{ENV_VALIDATION} must be in {validation_levels}"
+    )
+    return level
+
+
+# Per-stage metrics recorded by `timing`. `_metrics_stack` holds the names of the
+# decorated functions that are currently running, so nested calls (e.g. set_mvc inside
+# mvc_hpms_cnt) are recorded as sub-steps of the outermost stage.
+_metrics_records = []
+_metrics_stack = []
+
+
+def get_peak_rss_mb():
+    """Get the peak resident set size of the current process in MB (NaN if the
+    platform does not expose it)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+    if psutil is not None:
+        mem_info = psutil.Process().memory_info()
+        return getattr(mem_info, "peak_wset", mem_info.rss) / 2**20
+    return np.nan
+
+
+def get_frame_stats(objs):
+    """
+    Get the total number of rows and the (shallow) memory footprint in MB of the
+    dataframes in `objs`. `objs` can be a dataframe, or a list/tuple/dict containing
+    dataframes; other objects are ignored. Returns NaNs if no dataframe is found.
+    """
+    if isinstance(objs, dict):
+        objs = list(objs.values())
+    elif not isinstance(objs, (list, tuple)):
+        objs = [objs]
+    frames = [obj for obj in objs if isinstance(obj, pd.DataFrame)]
+    if not frames:
+        return np.nan, np.nan
+    rows = sum(len(df) for df in frames)
+    mem_mb = sum(df.memory_usage(index=True, deep=False).sum() for df in frames) / 2**20
+    return rows, mem_mb
+
+
+def fmt_kwargs(kw):
+    """Format keyword arguments for logging; dataframes (also in dicts) are shown by
+    their shape."""
+    return {
+        key: f"<DataFrame {val.shape}>"
+        if isinstance(val, pd.DataFrame)
+        else fmt_kwargs(val)
+        if isinstance(val, dict)
+        else val
+        for key, val in kw.items()
+    }
+
+
 def timing(f):
     """
     timing(f) is a decorator that measures and prints execution time of a function `f`.
     It takes a function as an argument and returns a wrapped version with timing
     functionality.
+
+    Besides printing, each call is recorded as a metrics row with the wall time, CPU
+    time, process peak RSS, the rows and memory footprint of the input and output
+    dataframes, and the stage (outermost decorated function) it ran in. Use
+    `get_metrics_report` and `write_metrics_report` to get the records of a run.
     """
 
     @wraps(f)
     def wrap(*args, **kw):
+        stage = _metrics_stack[0] if _metrics_stack else f.__name__
+        depth = len(_metrics_stack)
+        _metrics_stack.append(f.__name__)
         ts = time()
-        result = f(*args, **kw)
+        cs = process_time()
+        try:
+            result = f(*args, **kw)
+        finally:
+            _metrics_stack.pop()
         te = time()
-        print("func:{} with argumets {} took: {} sec".format(f.__name__, kw, te - ts))
+        ce = process_time()
+        in_rows, in_mem_mb = get_frame_stats(list(args) + list(kw.values()))
+        out_rows, out_mem_mb = get_frame_stats(result)
+        fmt_kw = fmt_kwargs(kw)
+        _metrics_records.append(
+            dict(
+                stage=stage,
+                step=f.__name__,
+                depth=depth,
+                start_time=ts,
+                wall_time_sec=te - ts,
+                cpu_time_sec=ce - cs,
+                peak_rss_mb=get_peak_rss_mb(),
+                in_rows=in_rows,
+                out_rows=out_rows,
+                in_mem_mb=in_mem_mb,
+                out_mem_mb=out_mem_mb,
+                kwargs=repr(fmt_kw),
+            )
+        )
+        print(
+            "func:{} with argumets {} took: {} sec".format(f.__name__, fmt_kw, te - ts)
+        )
 
         return result
 
     return wrap
 
 
+def reset_metrics():
+    """Clear the metrics recorded by `timing`. Call at the start of a run."""
+    _metrics_records.clear()
+
+
+def get_metrics_report():
+    """Get the metrics recorded by `timing` as a dataframe, one row per call in the
+    order the calls finished."""
+    return pd.DataFrame(
+        _metrics_records,
+        columns=[
+            "stage",
+            "step",
+            "depth",
+            "start_time",
+            "wall_time_sec",
+            "cpu_time_sec",
+            "peak_rss_mb",
+            "in_rows",
+            "out_rows",
+            "in_mem_mb",
+            "out_mem_mb",
+            "kwargs",
+        ],
+    )
+
+
+def write_metrics_report(path_out_dir, out_fi):
+    """
+    Write the metrics recorded by `timing` to `out_fi`.json and `out_fi`.parquet in
+    `path_out_dir`. Returns the report dataframe.
+    """
+    metrics = get_metrics_report()
+    path_json = Path.joinpath(Path(path_out_dir), f"{out_fi}.json")
+    metrics.to_json(path_json, orient="records", indent=2)
+    table_metrics = pa.Table.from_pandas(metrics, preserve_index=False)
+    pq.write_table(table_metrics, Path.joinpath(Path(path_out_dir), f"{out_fi}.parquet"))
+    return metrics
+
+
+def partition_map_reduce(
+    data_, partition_col, map_fn, reduce_fn=None, n_jobs=1, n_parts=None, **map_kw
+):
+    """
+    Split `data_` into `n_parts` partitions on `partition_col`, run `map_fn(part,
+    **map_kw)` on each partition in a pool of `n_jobs` processes, and combine the
+    results with `reduce_fn` (default: concatenate the dataframes in partition order).
+
+    The partitions are contiguous ranges of the sorted `partition_col` values, and the
+    rows keep their original order within a partition. So, if `map_fn` is a group-by
+    whose first key is `partition_col`, every group falls in one partition and is
+    computed over the same rows in the same order as the serial group-by; the
+    concatenated result is identical to the serial result, including the row order.
+    Rows with a missing `partition_col` are dropped (a group-by would drop them too).
+    `map_fn` has to be a module-level function so that it can be pickled. With
+    n_jobs=1, `map_fn` runs on the whole of `data_` without partitioning.
+    """
+    if reduce_fn is None:
+        reduce_fn = lambda results: pd.concat(results, ignore_index=True)
+    if n_jobs == 1:
+        return reduce_fn([map_fn(data_, **map_kw)])
+    codes, uniques = pd.factorize(data_[partition_col], sort=True)
+    n_parts = n_parts if n_parts is not None else n_jobs
+    n_parts = max(1, min(n_parts, len(uniques)))
+    part_ids = np.where(codes >= 0, codes * n_parts // max(len(uniques), 1), -1)
+    order = np.argsort(part_ids, kind="stable")
+    bounds = np.searchsorted(part_ids[order], np.arange(n_parts + 1))
+    parts = [data_.take(order[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(map_fn, part, **map_kw) for part in parts]
+        results = [future.result() for future in futures]
+    return reduce_fn(results)
+
+
 def get_engine_to_output_to_db(db):
     """
     Get engine to output data to out_database using pd.to_sql().
@@ -151,6 +571,19 @@ def connect_to_server_db(database_nm, user_nm="moves", port_=3308):
     return conn_
 
 
+# roadTypeID of the all road types ("ALL") rows; the MOVES road types are 1 to 5.
+ALL_RDTYPE_ID = 0
+
+
+def get_roadtype_id(mvs_rdtype_):
+    """Integer roadTypeID of the mvs_rdtype road types (2, "2", "2.0", ..., or "ALL");
+    "ALL" is ALL_RDTYPE_ID."""
+    mvs_rdtype_ = pd.Series(mvs_rdtype_).astype(str)
+    return pd.to_numeric(
+        mvs_rdtype_.mask(mvs_rdtype_ == "ALL", str(ALL_RDTYPE_ID))
+    ).astype(int)
+
+
 def create_sut_fueltype_map():
     """
     Create Mapping for SUT type and Fuel type. 23 combination.
@@ -17,8 +17,8 @@ from vmtmix_fy23.utils import (
     path_inp,
     path_interm,
     path_faf,
-    path_county_shp,
 )
+from vmtmix_fy23.lookup_tbls import get_county
 
 
 switchoff_chainedass_warn = ChainedAssignent()
@@ -89,10 +89,8 @@ class TrucksDist:
         meta_faf4 = meta_faf4.rename(columns=get_snake_case_dict(meta_faf4))
         self.meta_faf4_tx = meta_faf4.loc[meta_faf4.state == "TX"]
         # self.meta_faf4_tx.info()
-        ## Read County Shapefile
-        gdf_county = gpd.read_file(path_county_shp)
-        gdf_county = gdf_county.rename(columns=get_snake_case_dict(gdf_county))
-        self.gdf_county_1 = gdf_county.filter(items=["txdot_dist", "fips_st_cn"])
+        ## Read County Lookup Table
+        self.gdf_county_1 = get_county().filter(items=["txdot_dist", "fips_st_cn"])
         self.txdot_urbanized = gpd.read_file(self.path_urbanized_shp)
 
     def prc_meta_faf4(self):
@@ -208,7 +206,9 @@ class TrucksDist:
         # Statewide data. Use for getting default values.
         self.meta_faf4_tx_default = meta_faf4_tx_3.copy()
 
-    def get_vmt_dist(self) -> dict[pd.DataFrame, pd.DataFrame]:
+    def get_vmt_dist(
+        self, erg_crc_a88_vius2002_SULhT_pct=0.103
+    ) -> dict[pd.DataFrame, pd.DataFrame]:
         """
         Get the distribution of the CLhT, CShT, SULhT, and SUShT by district and at
         statewide level. There are missing values at district level, so we
@@ -225,6 +225,8 @@ class TrucksDist:
         ----------
         self: object
             Instance of `TrucksDist` class.
+        erg_crc_a88_vius2002_SULhT_pct: Single Unit Long Haul (SULhT) vs. Long Haul (Lh)
+        trucks fraction based on the VIUS 2002 survey. Passed to `compute_vmt_dist`.
 
         Returns
         -------
@@ -243,8 +245,14 @@ class TrucksDist:
             how="right",
         )
         ass_faf4_tx_state["txdot_dist"] = 0
-        vmt_dist_tx_distr = self.compute_vmt_dist(ass_faf4_=ass_faf4_tx_distr)
-        self.vmt_dist_tx = self.compute_vmt_dist(ass_faf4_=ass_faf4_tx_state)
+        vmt_dist_tx_distr = self.compute_vmt_dist(
+            ass_faf4_=ass_faf4_tx_distr,
+            erg_crc_a88_vius2002_SULhT_pct=erg_crc_a88_vius2002_SULhT_pct,
+        )
+        self.vmt_dist_tx = self.compute_vmt_dist(
+            ass_faf4_=ass_faf4_tx_state,
+            erg_crc_a88_vius2002_SULhT_pct=erg_crc_a88_vius2002_SULhT_pct,
+        )
 
         txdot_dist = self.gdf_county_1.txdot_dist.unique()
         mvs_rdtype_dist = [[2, 3, 4, 5]] * len(txdot_dist)
@@ -384,17 +392,19 @@ class TrucksDist:
 
 
 @timing
-def faf4_su_ct_lh_sh_pct(out_fi):
+def faf4_su_ct_lh_sh_pct(out_fi, erg_crc_a88_vius2002_SULhT_pct=0.103):
     """
     Get the SU and CT, Sh and Lh splits from FAF4 assignment and metadata using
-    ERG methodology and VIUS 2002 factor.
+    ERG methodology and VIUS 2002 factor (`erg_crc_a88_vius2002_SULhT_pct`).
     """
     truckdist = TrucksDist(
         path_faf_=path_faf, path_inp_=path_inp
     )
     truckdist.read_data()
     truckdist.prc_meta_faf4()
-    vmt_dist_dict = truckdist.get_vmt_dist()
+    vmt_dist_dict = truckdist.get_vmt_dist(
+        erg_crc_a88_vius2002_SULhT_pct=erg_crc_a88_vius2002_SULhT_pct
+    )
     path_out = Path.joinpath(path_interm, out_fi)
     vmt_dist_dict["vmt_dist_tx"].to_csv(path_out, index=False, sep="\t")
 
@@ -3,6 +3,9 @@ Use the following data to impute missing data
     MVS303 default runs
     MVS 3 samplevehiclepopulation and sourcetypeagedistribution distribution data
     2018 vehicle registration data.
+The MOVES runs are for 1990 and 2000 to 2060 in 5-year steps; the SUT distributions of
+the other years are interpolated (`interp_yearIDs`). The fuel type distribution is
+computed for every year with an age distribution and interpolated for the others.
 
 Created by: Apoorb
 Created on: 02/14/2022
@@ -255,11 +258,86 @@ def get_mvs303defaultsutdist() -> pd.DataFrame:
     return mvs303defact_relvnt
 
 
+@timing
+def get_age_weighted_fueldist(mvs303souagedis_, mvs303samvehpop_):
+    """
+    Get the age weighted fuel type distribution by source type and analysis year: the
+    sum over the ages of ageFraction[sourceType, year, age] x
+    stmyFraction[sourceType, year - age, fuel]. The age distribution and the model year
+    fuel type distribution are put in dense arrays (missing rows are 0); shifting the
+    model year axis by the age lines the two up, and np.einsum contracts over the age.
+
+    Parameters
+    ----------
+    mvs303souagedis_: pd.DataFrame
+        Age distribution (sourceTypeID, yearID, ageID, ageFraction) from
+        `get_mvs303souagedist`.
+    mvs303samvehpop_: pd.DataFrame
+        Fuel type distribution by model year (sourceTypeID, modelYearID, fuelTypeID,
+        stmyFraction) from `get_mvs303samvehpop`.
+    Returns
+    -------
+    pd.DataFrame
+        sourceTypeID, fuelTypeID, yearID, weighted_stmyFraction sorted by the first
+        three columns. Has the source type, fuel type, and year combinations with an
+        age whose model year has the fuel type.
+    """
+    assert not mvs303souagedis_.duplicated(["sourceTypeID", "yearID", "ageID"]).any()
+    st_ids = np.unique(mvs303souagedis_.sourceTypeID)
+    yr_ids = np.unique(mvs303souagedis_.yearID)
+    n_age = mvs303souagedis_.ageID.max() + 1
+    samvehpop = mvs303samvehpop_.loc[lambda df: df.sourceTypeID.isin(st_ids)]
+    ftype_ids = np.unique(samvehpop.fuelTypeID)
+    min_my = samvehpop.modelYearID.min()
+    n_my = samvehpop.modelYearID.max() - min_my + 1
+    # Age fraction [sourceType, year, age] and model year fuel fraction
+    # [sourceType, modelYear, fuel] arrays.
+    age_idx = (
+        np.searchsorted(st_ids, mvs303souagedis_.sourceTypeID),
+        np.searchsorted(yr_ids, mvs303souagedis_.yearID),
+        mvs303souagedis_.ageID.to_numpy(),
+    )
+    age_frac = np.zeros((len(st_ids), len(yr_ids), n_age))
+    age_frac[age_idx] = mvs303souagedis_.ageFraction.to_numpy()
+    has_age = np.zeros(age_frac.shape, dtype=bool)
+    has_age[age_idx] = True
+    my_idx = (
+        np.searchsorted(st_ids, samvehpop.sourceTypeID),
+        samvehpop.modelYearID.to_numpy() - min_my,
+        np.searchsorted(ftype_ids, samvehpop.fuelTypeID),
+    )
+    my_frac = np.zeros((len(st_ids), n_my, len(ftype_ids)))
+    my_frac[my_idx] = samvehpop.stmyFraction.to_numpy()
+    has_my = np.zeros(my_frac.shape, dtype=bool)
+    has_my[my_idx] = True
+    # Model year of each year and age [year, age].
+    yr_age_my = yr_ids[:, None] - np.arange(n_age)[None, :] - min_my
+    in_my_rng = (yr_age_my >= 0) & (yr_age_my < n_my)
+    yr_age_my = np.clip(yr_age_my, 0, n_my - 1)
+    # [sourceType, year, age, fuel]
+    my_frac_shift = my_frac[:, yr_age_my, :] * in_my_rng[None, :, :, None]
+    has_my_shift = has_my[:, yr_age_my, :] & in_my_rng[None, :, :, None]
+    wt_frac = np.einsum("sya,syaf->sfy", age_frac, my_frac_shift)
+    has_wt_frac = (has_age[..., None] & has_my_shift).any(axis=2).transpose(0, 2, 1)
+    st_grid, ftype_grid, yr_grid = np.meshgrid(
+        st_ids, ftype_ids, yr_ids, indexing="ij"
+    )
+    return pd.DataFrame(
+        {
+            "sourceTypeID": st_grid[has_wt_frac],
+            "fuelTypeID": ftype_grid[has_wt_frac],
+            "yearID": yr_grid[has_wt_frac],
+            "weighted_stmyFraction": wt_frac[has_wt_frac],
+        }
+    )
+
+
 def get_mvs303fueldist(anlyr = [1990] + list(range(2000, 2065, 5))):
     """
     Read default MOVES fuel type distribution by model year from 1960 to 2060.
     Read default MOVES age distribution for the analysis years.
-    Merge the two and get a age weighted distribution of fuel type for the analysis year.
+    Contract the two over the age (`get_age_weighted_fueldist`) to get the age weighted
+    distribution of fuel type for the analysis years.
     Re-normalized the age weighed fuel type distribution to just two fuel types: gasoline and diesel.
     """
     mvs303samvehpop = get_mvs303samvehpop()
@@ -271,20 +349,11 @@ def get_mvs303fueldist(anlyr = [1990] + list(range(2000, 2065, 5))):
         sql = "SELECT * FROM fueltype"
         fueltype = pd.read_sql(sql, con=conn)
 
-    mvs303souagedis["modelYearID"] = (
-        mvs303souagedis["yearID"] - mvs303souagedis["ageID"]
-    )
-    mvs303souagedis_fueldist = mvs303souagedis.merge(
-        mvs303samvehpop, on=["sourceTypeID", "modelYearID"], how="left"
+    mvs303souagedis_fueldist_agg = get_age_weighted_fueldist(
+        mvs303souagedis_=mvs303souagedis, mvs303samvehpop_=mvs303samvehpop
     )
-    mvs303souagedis_fueldist["weighted_stmyFraction"] = (
-        mvs303souagedis_fueldist.ageFraction * mvs303souagedis_fueldist.stmyFraction
-    )
-    mvs303souagedis_fueldist_agg = mvs303souagedis_fueldist.groupby(
-        ["sourceTypeID", "fuelTypeID", "yearID"], as_index=False
-    ).weighted_stmyFraction.sum()
 
-    mvs303souagedis_fueldist_agg_debug = mvs303souagedis_fueldist.groupby(
+    mvs303souagedis_fueldist_agg_debug = mvs303souagedis_fueldist_agg.groupby(
         ["sourceTypeID", "yearID"], as_index=False
     ).weighted_stmyFraction.sum()
     assert np.allclose(mvs303souagedis_fueldist_agg_debug.weighted_stmyFraction, 1)
@@ -323,19 +392,98 @@ def get_mvs303fueldist(anlyr = [1990] + list(range(2000, 2065, 5))):
 
 
 @timing
-def mvs_sut_nd_fuel_mx(fueldist_outfi, sut_hpms_dist_outfi):
-    """Get the SUT dist within HPMS and the fuel dist from MOVES default database."""
-    mvs303fueldist = get_mvs303fueldist()
+def interp_yearIDs(data_, frac_col_, sum_grp_cols_, yearIDs_=None):
+    """
+    Linearly interpolate the `frac_col_` distribution to the `yearIDs_` years. The
+    years before (after) the first (last) year of `data_` get the first (last) year's
+    distribution. All the years are done at once: `data_` is pivoted to one row per key
+    (all the columns except yearID and `frac_col_`) and one column per year, and each
+    target year is a weighted sum of its two neighboring year columns. Keys missing in
+    a year have a 0 fraction.
+
+    Parameters
+    ----------
+    data_: pd.DataFrame
+        Distribution with one row per key and yearID.
+    frac_col_: str
+        Fraction column; sums to 1 by `sum_grp_cols_` and yearID.
+    sum_grp_cols_: list
+        Columns of the groups that the fractions sum to 1 within.
+    yearIDs_: list, optional
+        Output years. Defaults to every year from the first to the last year of `data_`.
+    Returns
+    -------
+    pd.DataFrame
+        `data_` columns with one row per key and `yearIDs_` year. The interpolated
+        years are re-normalized so that each group sums to 1; the years of `data_` are
+        kept as is.
+    """
+    key_cols = [col for col in data_.columns if col not in ("yearID", frac_col_)]
+    data_wide = data_.set_index(key_cols + ["yearID"])[frac_col_].unstack(
+        "yearID", fill_value=0
+    )
+    known_yrs = data_wide.columns.to_numpy()
+    if yearIDs_ is None:
+        yearIDs_ = range(known_yrs.min(), known_yrs.max() + 1)
+    yrs = np.asarray(yearIDs_)
+    n_known = len(known_yrs)
+    lo = np.clip(np.searchsorted(known_yrs, yrs, side="right") - 1, 0, n_known - 1)
+    hi = np.minimum(lo + 1, n_known - 1)
+    span = np.where(hi > lo, known_yrs[hi] - known_yrs[lo], 1)
+    wt = np.clip((yrs - known_yrs[lo]) / span, 0, 1)
+    vals = data_wide.to_numpy()
+    vals_interp = vals[:, lo] * (1 - wt) + vals[:, hi] * wt
+    data_interp_ = (
+        pd.DataFrame(
+            vals_interp,
+            index=data_wide.index,
+            columns=pd.Index(yrs, name="yearID"),
+        )
+        .stack()
+        .rename(frac_col_)
+        .reset_index()
+    )
+    is_interp = ~data_interp_.yearID.isin(known_yrs)
+    grp_sum = data_interp_.groupby(sum_grp_cols_ + ["yearID"])[frac_col_].transform(
+        "sum"
+    )
+    data_interp_.loc[is_interp, frac_col_] = (
+        data_interp_.loc[is_interp, frac_col_] / grp_sum[is_interp]
+    )
+    assert np.allclose(
+        data_interp_.groupby(sum_grp_cols_ + ["yearID"])[frac_col_].sum(), 1
+    )
+    return data_interp_.filter(items=list(data_.columns))
+
+
+@timing
+def mvs_sut_nd_fuel_mx(fueldist_outfi, sut_hpms_dist_outfi, yearIDs=None):
+    """Get the SUT dist within HPMS and the fuel dist from MOVES default database for
+    the `yearIDs` analysis years (default: every year from 1990 to 2060). The years
+    without MOVES data are interpolated with `interp_yearIDs`."""
+    yearIDs = list(range(1990, 2061)) if yearIDs is None else list(yearIDs)
+    mvs303fueldist = interp_yearIDs(
+        get_mvs303fueldist(anlyr=yearIDs),
+        frac_col_="weighted_stmyFraction_1",
+        sum_grp_cols_=["sourceTypeID"],
+        yearIDs_=yearIDs,
+    )
     path_mvs303fueldist = Path.joinpath(path_interm, fueldist_outfi)
     mvs303fueldist.to_csv(path_mvs303fueldist, index=False)
     mvs303defaultsutdist = get_mvs303defaultsutdist()
-    path_mvs303defaultsutdist = Path.joinpath(path_interm, sut_hpms_dist_outfi)
     assert all(
         mvs303defaultsutdist.groupby(
             ["yearID", "roadTypeID", "modhpms_vtype_name"]
         ).activity_frac_modhpms.sum()
         == 1
     )
+    mvs303defaultsutdist = interp_yearIDs(
+        mvs303defaultsutdist,
+        frac_col_="activity_frac_modhpms",
+        sum_grp_cols_=["roadTypeID", "modhpms_vtype_name"],
+        yearIDs_=yearIDs,
+    )
+    path_mvs303defaultsutdist = Path.joinpath(path_interm, sut_hpms_dist_outfi)
     mvs303defaultsutdist.to_csv(path_mvs303defaultsutdist, index=False)
 
 
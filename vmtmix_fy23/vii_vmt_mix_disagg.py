@@ -6,7 +6,6 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from itertools import chain
-import geopandas as gpd
 import os
 import sys
 
@@ -14,97 +13,113 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), ".."))
 from vmtmix_fy23.utils import (
     path_interm,
     path_output,
-    path_txdot_districts_shp,
+    ALL_RDTYPE_ID,
     ChainedAssignent,
-    timing
+    count_distinct_codes,
+    create_sut_fueltype_map,
+    get_grp_ids,
+    get_roadtype_id,
+    get_tod_lng_map,
+    get_validation_level,
+    timing,
+    tod_map,
+)
+from vmtmix_fy23.lookup_tbls import get_txdist
+from vmtmix_fy23.vmt_mix_service import publish_vmt_mix
+from vmtmix_fy23.vmt_mix_store import (
+    set_latest_vmt_mix_dataset,
+    write_vmt_mix_dataset,
 )
 
 switchoff_chainedass_warn = ChainedAssignent()
 
 
+def get_spatial_cols(data_):
+    """Spatial unit columns of the counts: the district, and the county for the county
+    counts (`iv_mvc_hpms_counts.mvc_hpms_cnt` with spatial_level="county")."""
+    return ["district", "county"] if "county" in data_.columns else ["district"]
+
+
+# MVC vehicle categories; the mvc_vtype_cat keys of stage vii are categoricals with
+# these categories.
+mvc_vtype_cat_dtype = pd.CategoricalDtype(
+    ["MC", "PC", "PT_LCT", "Bus", "SU_MH_RT_HDV", "CT_HDV"]
+)
+
+
 def prc_mvc(mvc_vmtmix_):
     """
-    Transform MVC data into long format.
+    Transform MVC data into long format. The time column is 'tod' if the counts were
+    summed to TOD periods in `iv_mvc_hpms_counts` and 'hour' otherwise. The road types
+    are keyed by the integer roadTypeID (`utils.get_roadtype_id`); the road type labels
+    are attached to the VMT-Mix from the `get_rdtype_labs` table.
     """
-    mvc_vmtmix_long_ = mvc_vmtmix_.melt(
+    time_col = "tod" if "tod" in mvc_vmtmix_.columns else "hour"
+    value_vars = [f"{cat}_dow" for cat in mvc_vtype_cat_dtype.categories]
+    mvc_vmtmix_long_ = mvc_vmtmix_.assign(
+        roadTypeID=lambda df: get_roadtype_id(df.mvs_rdtype)
+    ).melt(
         id_vars=[
             "dgcode",
-            "district",
+            *get_spatial_cols(mvc_vmtmix_),
             "based_on_dg",
-            "mvs_rdtype_nm",
-            "mvs_rdtype",
+            "roadTypeID",
             "dowagg",
-            "hour",
-        ],
-        value_vars=[
-            "MC_dow",
-            "PC_dow",
-            "PT_LCT_dow",
-            "Bus_dow",
-            "SU_MH_RT_HDV_dow",
-            "CT_HDV_dow",
+            time_col,
         ],
+        value_vars=value_vars,
         var_name="mvc_vtype_cat",
         value_name="mvc_vtype_cat_dow_adt",
     )
 
-    mvc_vmtmix_long_["mvc_vtype_cat"] = mvc_vmtmix_long_.mvc_vtype_cat.str.split(
-        "_dow", expand=True
-    )[0]
+    mvc_vmtmix_long_["mvc_vtype_cat"] = mvc_vmtmix_long_.mvc_vtype_cat.map(
+        dict(zip(value_vars, mvc_vtype_cat_dtype.categories))
+    ).astype(mvc_vtype_cat_dtype)
     return mvc_vmtmix_long_
 
 
-def add_yr_mod_cols_mvc(mvc_vmtmix_long_filt_, mvs303defaultsutdist_):
-    """Add analysis year column to the MVC data that does not have year column for
-     the vehicle types that were not merged with national default data."""
-    yearIDs = [
-        1990,
-        2000,
-        2005,
-        2010,
-        2015,
-        2020,
-        2025,
-        2030,
-        2035,
-        2040,
-        2045,
-        2050,
-        2055,
-        2060,
-    ]
-    assert set(mvs303defaultsutdist_.yearID.unique()) == set(yearIDs)
-    with switchoff_chainedass_warn:
-        mvc_vmtmix_long_filt_["yearID"] = [yearIDs] * len(mvc_vmtmix_long_filt_)
-        mvc_vmtmix_long_filt_1_ = mvc_vmtmix_long_filt_.explode("yearID")
-    mvc_vmtmix_long_filt_1_ = mvc_vmtmix_long_filt_1_.rename(
-        columns={
-            "mvc_vtype_cat": "modsutname",
-            "mvc_vtype_cat_dow_adt": "modsut_vmt_est",
-        }
-    )
-    mvc_vmtmix_long_filt_2_ = mvc_vmtmix_long_filt_1_.filter(
-        items=[
-            "dgcode",
-            "district",
-            "based_on_dg",
-            "mvs_rdtype_nm",
-            "mvs_rdtype",
-            "dowagg",
-            "hour",
-            "yearID",
-            "modsutname",
-            "modsut_vmt_est",
-        ]
+def get_rdtype_labs(mvc_vmtmix_):
+    """Road type labels (mvs_rdtype and mvs_rdtype_nm) of the roadTypeID keys of the
+    MVC counts (`prc_mvc`)."""
+    rdtype_labs_ = (
+        mvc_vmtmix_[["mvs_rdtype", "mvs_rdtype_nm"]]
+        .drop_duplicates()
+        .assign(roadTypeID=lambda df: get_roadtype_id(df.mvs_rdtype))
+        .filter(items=["roadTypeID", "mvs_rdtype", "mvs_rdtype_nm"])
+        .reset_index(drop=True)
     )
-    return mvc_vmtmix_long_filt_2_
+    assert rdtype_labs_.roadTypeID.is_unique
+    return rdtype_labs_
+
+
+def get_sut_fueltype_codes(mvs303fueldist_):
+    """
+    Code table of the SUT + fuel type combinations (`utils.create_sut_fueltype_map`) of
+    the fuel distribution with their MOVES SUT and fuel type names (sourceTypeName and
+    fuelTypeDesc). Stage vii merges and groups by the integer sourceTypeID and
+    fuelTypeID; the names are only attached to the VMT-Mix (`add_labels`).
+    """
+    sut_fueltype_labs = mvs303fueldist_[
+        ["sourceTypeID", "fuelTypeID", "sourceTypeName", "fuelTypeDesc"]
+    ].drop_duplicates()
+    sut_fueltype_codes_ = (
+        create_sut_fueltype_map()
+        .astype({"sourceTypeID": int, "fuelTypeID": int})
+        .merge(sut_fueltype_labs, on=["sourceTypeID", "fuelTypeID"], how="inner")
+    )
+    assert len(sut_fueltype_codes_) == len(sut_fueltype_labs), (
+        "The fuel distribution has SUT + fuel type combinations (or names) that are "
+        "not in utils.create_sut_fueltype_map."
+    )
+    return sut_fueltype_codes_
 
 
 def prc_faf4_fac(faf4_su_ct_lh_sh_pct_: pd.DataFrame) -> pd.DataFrame:
     """
     Process FAF4 data-based factors by SU (Single Unit) and CT (Combination Truck).
     Connect FAF4 data-based factors with the MVC (Manual vehicle count) data columns and
-    fields. Change the mapping to allow for merging.
+    fields. Change the mapping to allow for merging. The road types are keyed by the
+    integer roadTypeID (`utils.get_roadtype_id`).
 
     Parameters
     ----------
@@ -122,7 +137,7 @@ def prc_faf4_fac(faf4_su_ct_lh_sh_pct_: pd.DataFrame) -> pd.DataFrame:
     pd.DataFrame
         A pandas DataFrame containing the filtered and mapped factors.
         It has the following columns:
-        - mvs_rdtype: str
+        - roadTypeID: int
         - modsutname: str
         - sourceTypeName: str
         - su_ct_sh_lh_pcts: float
@@ -168,272 +183,287 @@ def prc_faf4_fac(faf4_su_ct_lh_sh_pct_: pd.DataFrame) -> pd.DataFrame:
         "modsutname"
     ] = faf4_su_ct_lh_sh_pct_long_.mvc_vtype_cat_abb.map(map_modhpms)
 
+    faf4_su_ct_lh_sh_pct_long_["roadTypeID"] = get_roadtype_id(
+        faf4_su_ct_lh_sh_pct_long_.mvs_rdtype
+    )
     faf4_filt = faf4_su_ct_lh_sh_pct_long_.filter(
-        items=["mvs_rdtype", "modsutname", "sourceTypeName", "su_ct_sh_lh_pcts"]
+        items=["roadTypeID", "modsutname", "sourceTypeName", "su_ct_sh_lh_pcts"]
     )
     return faf4_filt
 
 
-def fac_sutdist_natdef(mvc_: pd.DataFrame, mvc_vtype_cat: dict,
-                       mvs303defaultsutdist_: dict, modhpmsvehcat: dict):
+# MVC vehicle category to the modified HPMS vehicle category of the MOVES default SUT
+# distribution that splits it to the modified SUTs. The other categories (MC, PC, and
+# CT_HDV) are one modified SUT each.
+mvc_vtype_cat_modhpms_map = {
+    "PT_LCT": "PT_LCT",
+    "Bus": "Buses",
+    "SU_MH_RT_HDV": "SU_MH_RT_HDV",
+}
+# Modified SUT to MOVES SUT name for the modified SUTs that are not split to short-haul
+# and long-haul with the FAF4 factors.
+sut_nm_map = {
+    "MC": "Motorcycle",
+    "PC": "Passenger Car",
+    "Passenger Truck": "Passenger Truck",
+    "Light Commercial Truck": "Light Commercial Truck",
+    "Other Buses": "Other Buses",
+    "Transit Bus": "Transit Bus",
+    "School Bus": "School Bus",
+    "Refuse Truck": "Refuse Truck",
+    "Motor Home": "Motor Home",
+}
+
+
+def get_sut_split_map(mvs303defaultsutdist_, faf4_fac_, sut_fueltype_codes_):
     """
-    The initial part of the code filters out the MVC data to just keep the HPMS vehicle
-    categories specified in the `mvc_vtype_cat` dict. We filter `mvs303defaultsutdist_` to
-    the corresponding modified vehicle category to the HPMS vehicle category specified in
-    `mvc_vtype_cat` dict and create a mapping between the two, that is used for merging.
-    We merge the two dataframe and apply the default MOVES SUT splits to the MVC data.
+    Get the table that splits each MVC vehicle category (mvc_vtype_cat) to the MOVES
+    SUTs by road type and analysis year. The MOVES default SUT distribution
+    (activity_frac_modhpms) splits PT_LCT, Bus, and SU_MH_RT_HDV to the modified SUTs;
+    MC, PC, and CT_HDV are not split (fraction 1). The FAF4 factors
+    (su_ct_sh_lh_pcts) split the Single Unit Truck and CT_HDV modified SUTs to
+    short-haul and long-haul; su_ct_sh_lh_pcts is missing for the other modified SUTs.
 
     Parameters
     ----------
-    mvc_
-    mvc_vtype_cat: dict
-        MVC vehicle type column name and the value of interest.
-        {'mvc_vtype_cat': 'PT_LCT'}
-        {'mvc_vtype_cat': 'Bus'}
-        {'mvc_vtype_cat': 'SU_MH_RT_HDV'}
     mvs303defaultsutdist_: pd.DataFrame
-        Distribution of SUTs within the modified HPMS parent category. This dataframe
-        is filterd to `modhpmsvehcat` value. For instance for
-        {'modhpms_vtype_name': 'PT_LCT'}, we are filter this dataframe to 'PT_LCT'
-    modhpmsvehcat: dict
-        MOVES modified HPMS vehicle type column name and the value of interest. We map
-        the mvc_vtype_cat names to the values specified in this dict. So, "PT_LCT" maps
-        to "PT_LCT".
-        {'modhpms_vtype_name': 'PT_LCT'}
-        {'modhpms_vtype_name': 'Buses'}
-        {'modhpms_vtype_name': 'SU_MH_RT_HDV'}
-
+        Distribution of SUTs within the modified HPMS parent category from stage vi.
+    faf4_fac_: pd.DataFrame
+        FAF4 factors from `prc_faf4_fac`. Not modified.
+    sut_fueltype_codes_: pd.DataFrame
+        SUT + fuel type code table from `get_sut_fueltype_codes`.
     Returns
     -------
-        pd.DataFrame
+    pd.DataFrame
+        mvc_vtype_cat, roadTypeID, yearID, sourceTypeID, activity_frac_modhpms, and
+        su_ct_sh_lh_pcts.
     """
-    filt_mvc = (
-        lambda df: df[list(mvc_vtype_cat.keys())[0]] == list(mvc_vtype_cat.values())[0]
-    )
-    filt_mvsdef = (
-        lambda df: df[list(modhpmsvehcat.keys())[0]] == list(modhpmsvehcat.values())[0]
-    )
-
-    map_mvc_mvsdef_cat = {
-        list(modhpmsvehcat.values())[0]: list(mvc_vtype_cat.values())[0]
+    modhpms_mvc_vtype_cat_map = {
+        modhpms: mvc_vtype_cat
+        for mvc_vtype_cat, modhpms in mvc_vtype_cat_modhpms_map.items()
     }
-    mvs303defaultsutdist_filt = mvs303defaultsutdist_[filt_mvsdef]
-    with switchoff_chainedass_warn:
-        mvs303defaultsutdist_filt.loc[
-            filt_mvsdef, list(mvc_vtype_cat.keys())[0]
-        ] = mvs303defaultsutdist_filt.loc[
-            filt_mvsdef, list(modhpmsvehcat.keys())[0]
-        ].map(
-            map_mvc_mvsdef_cat
+    modsut_dist = (
+        mvs303defaultsutdist_.assign(
+            mvc_vtype_cat=lambda df: df.modhpms_vtype_name.map(
+                modhpms_mvc_vtype_cat_map
+            ),
+            roadTypeID=lambda df: get_roadtype_id(df.roadTypeID),
+        )
+        .loc[lambda df: df.mvc_vtype_cat.notna()]
+        .filter(
+            items=[
+                "mvc_vtype_cat",
+                "roadTypeID",
+                "yearID",
+                "modsutname",
+                "activity_frac_modhpms",
+            ]
         )
-    assert set(mvs303defaultsutdist_filt.roadTypeID.unique()) == set(
-        mvc_.mvs_rdtype.unique()
-    )
-    mvs303defaultsutdist_filt = mvs303defaultsutdist_filt.rename(
-        columns={"roadTypeID": "mvs_rdtype"}
     )
-
-    mvc_mvssut_filt_ = mvc_[filt_mvc].merge(
-        mvs303defaultsutdist_filt,
-        on=[list(mvc_vtype_cat.keys())[0], "mvs_rdtype"],
+    modsut_ident = (
+        modsut_dist[["roadTypeID", "yearID"]]
+        .drop_duplicates()
+        .merge(
+            pd.DataFrame(
+                {
+                    "mvc_vtype_cat": ["MC", "PC", "CT_HDV"],
+                    "modsutname": ["MC", "PC", "CT_HDV"],
+                }
+            ),
+            how="cross",
+        )
+        .assign(activity_frac_modhpms=1.0)
+    )
+    assert set(faf4_fac_.roadTypeID) == set(modsut_dist.roadTypeID)
+    sut_split_map_ = pd.concat([modsut_dist, modsut_ident], ignore_index=True).merge(
+        faf4_fac_, on=["roadTypeID", "modsutname"], how="left"
+    )
+    no_haul_split = ~sut_split_map_.modsutname.isin(faf4_fac_.modsutname)
+    sut_split_map_.loc[no_haul_split, "sourceTypeName"] = sut_split_map_.loc[
+        no_haul_split, "modsutname"
+    ].map(sut_nm_map)
+    sut_split_map_ = sut_split_map_.merge(
+        sut_fueltype_codes_[["sourceTypeName", "sourceTypeID"]].drop_duplicates(),
+        on="sourceTypeName",
         how="left",
     )
-    assert ~all(mvc_mvssut_filt_["activity_frac_modhpms"].isna())
-    mvc_mvssut_filt_["modsut_vmt_est"] = (
-        mvc_mvssut_filt_.mvc_vtype_cat_dow_adt * mvc_mvssut_filt_.activity_frac_modhpms
-    )
-    mvc_mvssut_filt_1_ = mvc_mvssut_filt_.filter(
+    assert sut_split_map_.sourceTypeID.notna().all()
+    return sut_split_map_.astype({"mvc_vtype_cat": mvc_vtype_cat_dtype}).filter(
         items=[
-            "dgcode",
-            "district",
-            "based_on_dg",
-            "mvs_rdtype_nm",
-            "mvs_rdtype",
-            "dowagg",
-            "hour",
+            "mvc_vtype_cat",
+            "roadTypeID",
             "yearID",
-            "modsutname",
-            "modsut_vmt_est",
+            "sourceTypeID",
+            "activity_frac_modhpms",
+            "su_ct_sh_lh_pcts",
         ]
     )
-    return mvc_mvssut_filt_1_
 
 
-def apply_faf4_fac(mvc_su_ct_, faf4_fac_):
+@timing
+def split_mvc_to_suts(mvc_vmtmix_long_, sut_split_map_):
     """
-    Merge the MVC data for SU and CT with the FAF4-based factors to split the SU and CT
-    MVC counts to SUShT, SULhT, CShT, and CLhT.
+    Split the MVC counts by vehicle category (`prc_mvc`) to the MOVES SUTs and analysis
+    years with one merge with the `get_sut_split_map` table. modsut_vmt_est is the
+    count of the modified SUT and sut_vmt_est the count of the SUT (the modified SUT
+    count split to short-haul and long-haul for SU and CT).
     """
-    fix_dtype = {
-        float_: int_
-        for float_, int_ in zip(
-            ["2.0", "3.0", "4.0", "5.0", "ALL"], ["2", "3", "4", "5", "ALL"]
-        )
-    }
-    faf4_fac_["mvs_rdtype"] = faf4_fac_.mvs_rdtype.map(fix_dtype)
-    assert set(mvc_su_ct_.mvs_rdtype.unique()) == set(faf4_fac_.mvs_rdtype.unique())
-    mvc_su_ct_haul = mvc_su_ct_.merge(
-        faf4_fac_, on=["mvs_rdtype", "modsutname"], how="left"
+    assert set(sut_split_map_.roadTypeID) == set(mvc_vmtmix_long_.roadTypeID)
+    assert set(sut_split_map_.mvc_vtype_cat) == set(mvc_vmtmix_long_.mvc_vtype_cat)
+    mvc_suts_ = mvc_vmtmix_long_.merge(
+        sut_split_map_, on=["mvc_vtype_cat", "roadTypeID"], how="left"
+    )
+    mvc_suts_["modsut_vmt_est"] = (
+        mvc_suts_.mvc_vtype_cat_dow_adt * mvc_suts_.activity_frac_modhpms
     )
-    mvc_su_ct_haul["sut_vmt_est"] = (
-        mvc_su_ct_haul.modsut_vmt_est * mvc_su_ct_haul.su_ct_sh_lh_pcts
+    mvc_suts_["sut_vmt_est"] = mvc_suts_.modsut_vmt_est * (
+        mvc_suts_.su_ct_sh_lh_pcts.fillna(1)
     )
-    mvc_su_ct_haul.filter(
+    return mvc_suts_.filter(
         items=[
             "dgcode",
             "district",
+            "county",
             "based_on_dg",
-            "mvs_rdtype_nm",
-            "mvs_rdtype",
+            "roadTypeID",
             "dowagg",
             "hour",
+            "tod",
             "yearID",
-            "modsutname",
             "modsut_vmt_est",
-            "sourceTypeName",
+            "sourceTypeID",
             "su_ct_sh_lh_pcts",
             "sut_vmt_est",
         ]
     )
-    return mvc_su_ct_haul
-
-
-def concat_suts(
-    mvc_mc_pc, mvc_sut_pt_lct, mvc_sut_ob_sb_tb, mvc_modsut_rt_mh, mvc_su_ct_sut
-):
-    """
-    Concat the split-out SUT counts from different groups of SUTs to obtain a unified
-    dataframe. Add some descriptive columns to this dataframe.
-
-    """
-    mvc_mc_pc_pt_lct_ob_sb_tb_rt_mh = pd.concat(
-        [mvc_mc_pc, mvc_sut_pt_lct, mvc_sut_ob_sb_tb, mvc_modsut_rt_mh]
-    )
-
-    sut_nm_map = dict(
-        zip(
-            [
-                "MC",
-                "PC",
-                "Passenger Truck",
-                "Light Commercial Truck",
-                "Other Buses",
-                "Transit Bus",
-                "School Bus",
-                "Refuse Truck",
-                "Motor Home",
-            ],
-            [
-                "Motorcycle",
-                "Passenger Car",
-                "Passenger Truck",
-                "Light Commercial Truck",
-                "Other Buses",
-                "Transit Bus",
-                "School Bus",
-                "Refuse Truck",
-                "Motor Home",
-            ],
-        )
-    )
-    mvc_mc_pc_pt_lct_ob_sb_tb_rt_mh = mvc_mc_pc_pt_lct_ob_sb_tb_rt_mh.assign(
-        sourceTypeName=lambda df: df.modsutname.map(sut_nm_map),
-        su_ct_sh_lh_pcts=np.nan,
-        sut_vmt_est=lambda df: df.modsut_vmt_est,
-    )
-
-    mvc_mc_pc_pt_lct_ob_sb_tb_rt_mh_su_ct_shlh = pd.concat(
-        [mvc_mc_pc_pt_lct_ob_sb_tb_rt_mh, mvc_su_ct_sut]
-    )
-    mvc_suts_ = mvc_mc_pc_pt_lct_ob_sb_tb_rt_mh_su_ct_shlh.copy(deep=True)
-    return mvc_suts_
 
 
+@timing
 def apply_fuel_dist(mvc_suts_, mvs303fueldist_):
     """
     Apply the `mvs303fueldist_` fuel type distribution from default MOVES run to the
-    MVC counts by SUT dataframe obtained from the `concat_suts` function.
+    MVC counts by SUT dataframe obtained from the `split_mvc_to_suts` function.
     """
-    assert set(mvc_suts_.sourceTypeName) == set(mvs303fueldist_.sourceTypeName)
+    assert set(mvc_suts_.sourceTypeID) == set(mvs303fueldist_.sourceTypeID)
     mvc_suts_ftype = mvc_suts_.merge(
-        mvs303fueldist_, on=["yearID", "sourceTypeName"], how="left"
+        mvs303fueldist_[
+            ["yearID", "sourceTypeID", "fuelTypeID", "weighted_stmyFraction_1"]
+        ],
+        on=["yearID", "sourceTypeID"],
+        how="left",
     )
-    mvc_suts_ftype.columns
     mvc_suts_ftype["sut_ftype_vmt_est"] = (
         mvc_suts_ftype.sut_vmt_est * mvc_suts_ftype.weighted_stmyFraction_1
     )
     assert ~all(mvc_suts_ftype.sut_ftype_vmt_est.isna())
-    mvc_suts_ftype_debug = mvc_suts_ftype.groupby(
-        ["district", "mvs_rdtype_nm", "dowagg", "sourceTypeName", "fuelTypeDesc"],
-        as_index=False,
-    ).agg(hour_set=("hour", set), yearID_set=("yearID", set))
-    mvc_suts_ftype_debug[["sourceTypeName", "fuelTypeDesc"]].drop_duplicates()
-    assert all(mvc_suts_ftype_debug.hour_set == set(range(0, 24)))
-    assert all(
-        mvc_suts_ftype_debug.yearID_set
-        == set((1990, 2000, 2005)) | set(range(2010, 2065, 5))
-    )
-    assert (
-        len(mvc_suts_ftype_debug) == 25 * 5 * 4 * 24
-    )  # 25 districts # 5 road types (ALL
-    # included) # 4 dow # 24 SUT+Ftype
+    time_col = "tod" if "tod" in mvc_suts_ftype.columns else "hour"
+    if time_col == "hour":
+        exp_time_set = set(range(0, 24))
+    else:
+        exp_time_set = set(tod_map.keys()) | {"day"}
+    exp_yearID_set = set(mvs303fueldist_.yearID)
+    grp_cols = get_spatial_cols(mvc_suts_ftype) + [
+        "roadTypeID",
+        "dowagg",
+        "sourceTypeID",
+        "fuelTypeID",
+    ]
+    validation = get_validation_level()
+    if validation != "off":
+        # Every district (county) + road type + dowagg group of the MVC counts has all
+        # the SUT + fuel type combinations of the fuel distribution.
+        _, n_dist_rd_dow = get_grp_ids(
+            mvc_suts_, get_spatial_cols(mvc_suts_) + ["roadTypeID", "dowagg"]
+        )
+        n_sut_ftype = len(
+            mvs303fueldist_[["sourceTypeID", "fuelTypeID"]].drop_duplicates()
+        )
+        exp_n_grp = n_dist_rd_dow * n_sut_ftype
+    if validation == "full":
+        mvc_suts_ftype_debug = mvc_suts_ftype.groupby(grp_cols, as_index=False).agg(
+            time_set=(time_col, set), yearID_set=("yearID", set)
+        )
+        assert all(mvc_suts_ftype_debug.time_set == exp_time_set)
+        assert all(mvc_suts_ftype_debug.yearID_set == exp_yearID_set)
+        assert len(mvc_suts_ftype_debug) == exp_n_grp
+    elif validation == "fast":
+        # Same checks with integer codes: every group has all the expected hours (or
+        # TODs) and years if the overall sets match and each group has as many distinct
+        # values as the expected sets.
+        grp_ids, n_grp = get_grp_ids(mvc_suts_ftype, grp_cols)
+        for col, exp_set in [(time_col, exp_time_set), ("yearID", exp_yearID_set)]:
+            codes, uniques = pd.factorize(mvc_suts_ftype[col])
+            assert np.all(codes >= 0) and (set(uniques) == exp_set)
+            assert np.all(
+                count_distinct_codes(grp_ids, codes, n_grp=n_grp) == len(exp_set)
+            )
+        assert n_grp == exp_n_grp
     return mvc_suts_ftype
 
 
+@timing
 def filt_to_tod(mvc_suts_ftype_, tod_map_, txdist_):
     """
     Filter the values from `apply_fuel_dist` to different TOD hours and normalize the
-    counts to get the Count distribution or the "VMT-Mix".
+    counts to get the Count distribution or the "VMT-Mix". If the counts were already
+    summed to TOD periods (and "day") in `iv_mvc_hpms_counts`, they are used as is. The
+    VMT-Mix is keyed by roadTypeID, sourceTypeID, and fuelTypeID (see `add_labels`).
     """
-    tod_lng_map = {}
-    for key, vals in tod_map_.items():
-        for val in vals:
-            tod_lng_map[val] = key
-    mvc_suts_ftype_["tod"] = mvc_suts_ftype_.hour.map(tod_lng_map)
+    if "tod" in mvc_suts_ftype_.columns:
+        mvc_suts_ftype_tod_ = mvc_suts_ftype_
+    else:
+        tod_lng_map = get_tod_lng_map(tod_map_)
+        mvc_suts_ftype_["tod"] = mvc_suts_ftype_.hour.map(tod_lng_map)
 
-    mvc_suts_ftype_day = mvc_suts_ftype_.copy(deep=True)
-    mvc_suts_ftype_day["tod"] = "day"
-    mvc_suts_ftype_tod_ = pd.concat([mvc_suts_ftype_, mvc_suts_ftype_day])
+        mvc_suts_ftype_day = mvc_suts_ftype_.copy(deep=True)
+        mvc_suts_ftype_day["tod"] = "day"
+        mvc_suts_ftype_tod_ = pd.concat([mvc_suts_ftype_, mvc_suts_ftype_day])
 
+    spatial_cols = get_spatial_cols(mvc_suts_ftype_tod_)
     mvc_suts_ftype_tod_agg_ = mvc_suts_ftype_tod_.groupby(
         [
             "dgcode",
-            "district",
-            "mvs_rdtype_nm",
-            "mvs_rdtype",
+            *spatial_cols,
+            "roadTypeID",
             "dowagg",
             "yearID",
-            "sourceTypeName",
             "sourceTypeID",
             "fuelTypeID",
-            "fuelTypeDesc",
             "tod",
         ],
         as_index=False,
     ).agg(sut_ftype_tod_vmt_est=("sut_ftype_vmt_est", "sum"))
 
+    tod_grp_cols = [
+        "dgcode",
+        *spatial_cols,
+        "roadTypeID",
+        "dowagg",
+        "yearID",
+        "tod",
+    ]
     mvc_suts_ftype_tod_agg_["tod_vmt_est"] = mvc_suts_ftype_tod_agg_.groupby(
-        ["dgcode", "district", "mvs_rdtype_nm", "mvs_rdtype", "dowagg", "yearID", "tod"]
+        tod_grp_cols
     ).sut_ftype_tod_vmt_est.transform(sum)
 
     mvc_suts_ftype_tod_agg_["vmt_mix"] = (
         mvc_suts_ftype_tod_agg_.sut_ftype_tod_vmt_est
         / mvc_suts_ftype_tod_agg_.tod_vmt_est
     )
-    assert np.allclose(
-        mvc_suts_ftype_tod_agg_.groupby(
-            [
-                "dgcode",
-                "district",
-                "mvs_rdtype_nm",
-                "mvs_rdtype",
-                "dowagg",
-                "yearID",
-                "tod",
-            ]
-        ).vmt_mix.sum(),
-        1,
-    )
+    validation = get_validation_level()
+    if validation == "full":
+        assert np.allclose(
+            mvc_suts_ftype_tod_agg_.groupby(tod_grp_cols).vmt_mix.sum(), 1
+        )
+    elif validation == "fast":
+        # Same check with the sums of the mix by integer group code; the mix has no
+        # missing or negative values.
+        tod_vmt_est = mvc_suts_ftype_tod_agg_.tod_vmt_est.to_numpy()
+        vmt_mix = mvc_suts_ftype_tod_agg_.vmt_mix.to_numpy()
+        assert np.all(np.isfinite(tod_vmt_est) & (tod_vmt_est > 0))
+        assert np.all(np.isfinite(vmt_mix) & (vmt_mix >= 0))
+        grp_ids, n_grp = get_grp_ids(mvc_suts_ftype_tod_agg_, tod_grp_cols)
+        assert np.allclose(np.bincount(grp_ids, weights=vmt_mix, minlength=n_grp), 1)
 
     mvc_suts_ftype_tod_agg_ = mvc_suts_ftype_tod_agg_.merge(
         txdist_, on="district", how="left"
@@ -442,124 +472,278 @@ def filt_to_tod(mvc_suts_ftype_, tod_map_, txdist_):
             "dgcode",
             "txdot_dist",
             "district",
-            "mvs_rdtype_nm",
-            "mvs_rdtype",
+            "county",
+            "roadTypeID",
             "dowagg",
             "yearID",
             "tod",
-            "sourceTypeName",
             "sourceTypeID",
             "fuelTypeID",
-            "fuelTypeDesc",
             "vmt_mix",
         ]
     )
     return mvc_suts_ftype_tod_agg_
 
 
+def add_labels(vmt_mix_, rdtype_labs_, sut_fueltype_codes_):
+    """Attach the road type (`get_rdtype_labs`) and the SUT + fuel type
+    (`get_sut_fueltype_codes`) labels to the integer keys of the VMT-Mix."""
+    return (
+        vmt_mix_.merge(rdtype_labs_, on="roadTypeID", how="left")
+        .merge(
+            sut_fueltype_codes_[
+                ["sourceTypeID", "fuelTypeID", "sourceTypeName", "fuelTypeDesc"]
+            ],
+            on=["sourceTypeID", "fuelTypeID"],
+            how="left",
+        )
+        .filter(
+            items=[
+                "dgcode",
+                "txdot_dist",
+                "district",
+                "county",
+                "mvs_rdtype_nm",
+                "mvs_rdtype",
+                "dowagg",
+                "yearID",
+                "tod",
+                "sourceTypeName",
+                "sourceTypeID",
+                "fuelTypeID",
+                "fuelTypeDesc",
+                "vmt_mix",
+            ]
+        )
+    )
+
+
+# MOVES day type (dayID 5: weekdays, 2: weekend) and number of days in a week of each
+# aggregated day of week; Wkd is the average Monday-Thursday.
+moves_day_map = {"Wkd": (5, 4), "Fri": (5, 1), "Sat": (2, 1), "Sun": (2, 1)}
+
+
 @timing
-def fin_vmt_mix(out_file_nm="fin_vmtmix"):
+def get_moves_vmt_fracs(mvc_suts_ftype_):
     """
-    Apply the FAF4, and MOVES dist to the HPMS counts, filter data to different TODs,
-    and normalize the final counts to get the SUT-FT dist.
+    Get the MOVES hourVMTFraction and dayVMTFraction tables by district (and county)
+    and analysis year from the hourly SUT + fuel type counts of `apply_fuel_dist`. The
+    counts are summed over the fuel types and weighted by the number of days in a week
+    of each dowagg, the hours are normalized within the SUT + road type + day type, and
+    the day types within the SUT + road type. The all road types ("ALL") counts are not
+    used. MOVES has a dayVMTFraction by month; the counts do not vary by month, so each
+    month gets the same fractions.
+
+    Returns
+    -------
+    dict
+        hourvmtfraction (district, [county,] yearID, sourceTypeID, roadTypeID, dayID,
+        hourID, hourVMTFraction) and dayvmtfraction (district, [county,] yearID,
+        sourceTypeID, monthID, roadTypeID, dayID, dayVMTFraction).
     """
-    now_yr = str(datetime.datetime.now().year)
-    now_mnt = str(datetime.datetime.now().month).zfill(2)
-    now_mntyr = now_mnt + now_yr
-    # Set path
-    #-----------------------------------------------------------------------------------
-    path_mvc_vmtmix = list(path_output.glob("mvc_vmtmix_*.csv"))[0]
+    if "hour" not in mvc_suts_ftype_.columns:
+        raise ValueError(
+            "The MOVES VMT fractions need the hourly counts; run stage iv with "
+            "early_tod=False."
+        )
+    assert set(mvc_suts_ftype_.dowagg) == set(moves_day_map.keys())
+    unit_keys = get_spatial_cols(mvc_suts_ftype_) + ["yearID", "sourceTypeID"]
+    mvc_hr = mvc_suts_ftype_.loc[
+        lambda df: df.roadTypeID != ALL_RDTYPE_ID,
+        [
+            *unit_keys,
+            "roadTypeID",
+            "dowagg",
+            "hour",
+            "sut_ftype_vmt_est",
+        ],
+    ]
+    day_ids = {dowagg: day_id for dowagg, (day_id, _) in moves_day_map.items()}
+    n_days = {dowagg: n_day for dowagg, (_, n_day) in moves_day_map.items()}
+    vmt_hr = (
+        mvc_hr.assign(
+            dayID=lambda df: df.dowagg.map(day_ids),
+            hourID=lambda df: df.hour + 1,
+            vmt=lambda df: df.sut_ftype_vmt_est * df.dowagg.map(n_days),
+        )
+        .groupby(unit_keys + ["roadTypeID", "dayID", "hourID"], as_index=False)
+        .vmt.sum()
+    )
+    day_keys = unit_keys + ["roadTypeID", "dayID"]
+    vmt_day = vmt_hr.groupby(day_keys, as_index=False).vmt.sum()
+    hourvmtfraction = vmt_hr.assign(
+        hourVMTFraction=lambda df: df.vmt / df.groupby(day_keys).vmt.transform("sum")
+    ).drop(columns="vmt")
+    dayvmtfraction = (
+        vmt_day.assign(
+            dayVMTFraction=lambda df: df.vmt
+            / df.groupby(day_keys[:-1]).vmt.transform("sum")
+        )
+        .merge(pd.DataFrame({"monthID": range(1, 13)}), how="cross")
+        .filter(items=unit_keys + ["monthID", "roadTypeID", "dayID", "dayVMTFraction"])
+        .sort_values(unit_keys + ["monthID", "roadTypeID", "dayID"])
+        .reset_index(drop=True)
+    )
+    if get_validation_level() != "off":
+        assert np.allclose(
+            hourvmtfraction.groupby(day_keys).hourVMTFraction.sum(), 1
+        )
+        assert np.allclose(
+            dayvmtfraction.groupby(
+                unit_keys + ["monthID", "roadTypeID"]
+            ).dayVMTFraction.sum(),
+            1,
+        )
+    return dict(hourvmtfraction=hourvmtfraction, dayvmtfraction=dayvmtfraction)
+
+
+def read_vmt_mix_inputs(spatial_level="district"):
+    """
+    Read the outputs of stages iv, v, and vi that are used to disaggregate the MVC
+    counts: the MVC counts by HPMS category (mvc_vmtmix), the FAF4-based SU and CT
+    short-haul vs. long-haul splits, the MOVES SUT distribution within the modified HPMS
+    categories, the MOVES fuel distribution, and the district lookup table. The MVC
+    counts are by district or, with `spatial_level` "county", by county.
+    """
+    path_mvc_vmtmix = [
+        path
+        for path in path_output.glob("mvc_vmtmix_*.csv")
+        if ("_county_" in path.name) == (spatial_level == "county")
+    ][0]
     path_faf4_su_ct_lh_sh_pct = Path.joinpath(path_interm, "faf4_su_ct_lh_sh_pct.tab")
     path_mvs303defaultsutdist = Path.joinpath(path_interm, "mvs303defaultsutdist.csv")
     path_mvs303fueldist = Path.joinpath(path_interm, "mvs303fueldist.csv")
-    path_fin_vmtmix = Path.joinpath(path_output, f"{out_file_nm}_{now_mntyr}.csv")
-    # Read Data
-    mvc_vmtmix = pd.read_csv(path_mvc_vmtmix)
-    faf4_su_ct_lh_sh_pct = pd.read_csv(path_faf4_su_ct_lh_sh_pct, sep="\t")
-    mvs303defaultsutdist = pd.read_csv(path_mvs303defaultsutdist)
-    mvs303fueldist = pd.read_csv(path_mvs303fueldist)
-    txdist_tmp = gpd.read_file(path_txdot_districts_shp)
-    txdist = txdist_tmp[["DIST_NBR", "DIST_NM"]].rename(
-        columns={"DIST_NBR": "txdot_dist", "DIST_NM": "district"}
-    )
-    # Process Data
-    # ----------------------------------------------------------------------------------
-    mvc_vmtest_long = prc_mvc(mvc_vmtmix_=mvc_vmtmix)
-    mvc_sut_pt_lct = fac_sutdist_natdef(
-        mvc_=mvc_vmtest_long,
-        mvc_vtype_cat={"mvc_vtype_cat": "PT_LCT"},
-        mvs303defaultsutdist_=mvs303defaultsutdist,
-        modhpmsvehcat={"modhpms_vtype_name": "PT_LCT"},
-    )
-    mvc_sut_ob_sb_tb = fac_sutdist_natdef(
-        mvc_=mvc_vmtest_long,
-        mvc_vtype_cat={"mvc_vtype_cat": "Bus"},
-        mvs303defaultsutdist_=mvs303defaultsutdist,
-        modhpmsvehcat={"modhpms_vtype_name": "Buses"},
-    )
-    mvc_modsut_su_rt_mh = fac_sutdist_natdef(
-        mvc_=mvc_vmtest_long,
-        mvc_vtype_cat={"mvc_vtype_cat": "SU_MH_RT_HDV"},
-        mvs303defaultsutdist_=mvs303defaultsutdist,
-        modhpmsvehcat={"modhpms_vtype_name": "SU_MH_RT_HDV"},
-    )
-    # Process remaining mvc vehicle categories.
-    # -----------------------------------------
-    mvc_vmtmix_long_filt = mvc_vmtest_long.loc[
-        lambda df: df.mvc_vtype_cat.isin(["MC", "PC", "CT_HDV"])
-    ]
-    mvc_mc_pc_ct = add_yr_mod_cols_mvc(
-        mvc_vmtmix_long_filt_=mvc_vmtmix_long_filt,
-        mvs303defaultsutdist_=mvs303defaultsutdist,
-    )
-
-    # Long haul vs. Short haul using FAF4
-    # -----------------------------------
-    mvc_su = mvc_modsut_su_rt_mh.loc[lambda df: df.modsutname == "Single Unit Truck"]
-    mvc_ct = mvc_mc_pc_ct[lambda df: df.modsutname == "CT_HDV"]
-    mvc_su_ct = pd.concat([mvc_su, mvc_ct])
-    faf4_fac = prc_faf4_fac(faf4_su_ct_lh_sh_pct_=faf4_su_ct_lh_sh_pct)
-    mvc_su_ct_sut = apply_faf4_fac(mvc_su_ct_=mvc_su_ct, faf4_fac_=faf4_fac)
-
-    # Concat data
-    # ------------
-    mvc_modsut_rt_mh = mvc_modsut_su_rt_mh.loc[
-        lambda df: df.modsutname.isin(["Motor Home", "Refuse Truck"])
-    ]
-    mvc_mc_pc = mvc_mc_pc_ct[lambda df: df.modsutname.isin(["MC", "PC"])]
-    mvc_suts = concat_suts(
-        mvc_mc_pc=mvc_mc_pc,
-        mvc_sut_pt_lct=mvc_sut_pt_lct,
-        mvc_sut_ob_sb_tb=mvc_sut_ob_sb_tb,
-        mvc_modsut_rt_mh=mvc_modsut_rt_mh,
-        mvc_su_ct_sut=mvc_su_ct_sut,
+    return dict(
+        mvc_vmtmix=pd.read_csv(path_mvc_vmtmix),
+        faf4_su_ct_lh_sh_pct=pd.read_csv(path_faf4_su_ct_lh_sh_pct, sep="\t"),
+        mvs303defaultsutdist=pd.read_csv(path_mvs303defaultsutdist),
+        mvs303fueldist=pd.read_csv(path_mvs303fueldist),
+        txdist=get_txdist(),
+    )
+
+
+def get_fueldist_for_yr(mvs303fueldist_, fuel_yr):
+    """Use the fuel distribution of the `fuel_yr` analysis year for all the analysis
+    years."""
+    yearIDs = mvs303fueldist_.yearID.unique()
+    if fuel_yr not in set(yearIDs):
+        raise ValueError(f"No fuel distribution for {fuel_yr}.")
+    return (
+        mvs303fueldist_.loc[lambda df: df.yearID == fuel_yr]
+        .drop(columns="yearID")
+        .merge(pd.DataFrame({"yearID": yearIDs}), how="cross")
+    )
+
+
+@timing
+def vmt_mix_core(
+    mvc_vmtmix_long_,
+    rdtype_labs_,
+    mvs303defaultsutdist_,
+    faf4_su_ct_lh_sh_pct_,
+    mvs303fueldist_,
+    txdist_,
+    tod_map_=None,
+    excl_dg_imputed=False,
+    fuel_yr=None,
+    moves_vmt_fracs=False,
+):
+    """
+    Split the MVC counts by vehicle category to the SUTs with the MOVES default SUT
+    distribution and the FAF4 short-haul vs. long-haul splits (`split_mvc_to_suts`),
+    apply the fuel distribution, filter the data to the TODs, and normalize the counts
+    to get the SUT-FT dist.
+
+    Parameters
+    ----------
+    mvc_vmtmix_long_: pd.DataFrame
+        MVC counts by vehicle category in long format (`prc_mvc`). Not modified.
+    rdtype_labs_: pd.DataFrame
+        Road type labels of the MVC counts (`get_rdtype_labs`).
+    mvs303defaultsutdist_: pd.DataFrame
+        Distribution of SUTs within the modified HPMS parent category from stage vi.
+    faf4_su_ct_lh_sh_pct_: pd.DataFrame
+        SU and CT short-haul vs. long-haul splits from stage v.
+    mvs303fueldist_: pd.DataFrame
+        MOVES fuel distribution by SUT and analysis year from stage vi.
+    txdist_: pd.DataFrame
+        District lookup table.
+    tod_map_: dict, optional
+        TOD periods to hours. Defaults to `utils.tod_map`. Counts that were summed to
+        TOD periods in stage iv (early_tod=True) can only use `utils.tod_map`; other
+        maps raise a ValueError.
+    excl_dg_imputed: bool
+        Drop the district + road type groups whose counts were imputed from the district
+        group (dgcode) counts.
+    fuel_yr: int, optional
+        Use the fuel distribution of this analysis year for all the analysis years.
+    moves_vmt_fracs: bool
+        Also get the MOVES hourVMTFraction and dayVMTFraction tables from the hourly
+        counts (`get_moves_vmt_fracs`). Needs the hourly MVC counts.
+    Returns
+    -------
+    pd.DataFrame or tuple
+        VMT-Mix sorted by district, (county,) year, dowagg, tod, road type, SUT, and
+        fuel type.
+        (VMT-Mix, `get_moves_vmt_fracs` dict) if `moves_vmt_fracs` is True.
+    """
+    tod_map_ = tod_map if tod_map_ is None else tod_map_
+    if excl_dg_imputed:
+        # The SUT split is row-wise, so dropping the rows of the MVC counts is the same
+        # as dropping them from the SUT counts.
+        mvc_vmtmix_long_ = mvc_vmtmix_long_.loc[
+            lambda df: ~df.based_on_dg.astype(bool)
+        ]
+    # SUT split (MOVES default SUT dist and FAF4 long haul vs. short haul)
+    # --------------------------------------------------------------------
+    sut_fueltype_codes = get_sut_fueltype_codes(mvs303fueldist_=mvs303fueldist_)
+    faf4_fac = prc_faf4_fac(faf4_su_ct_lh_sh_pct_=faf4_su_ct_lh_sh_pct_)
+    sut_split_map = get_sut_split_map(
+        mvs303defaultsutdist_=mvs303defaultsutdist_,
+        faf4_fac_=faf4_fac,
+        sut_fueltype_codes_=sut_fueltype_codes,
+    )
+    mvc_suts = split_mvc_to_suts(
+        mvc_vmtmix_long_=mvc_vmtmix_long_, sut_split_map_=sut_split_map
     )
     # Apply Fuel Fractions
     # ---------------------
-    mvc_suts_ftype = apply_fuel_dist(mvc_suts_=mvc_suts, mvs303fueldist_=mvs303fueldist)
-    mvc_suts_ftype.sut_ftype_vmt_est.describe()
+    if fuel_yr is not None:
+        mvs303fueldist_ = get_fueldist_for_yr(mvs303fueldist_, fuel_yr=fuel_yr)
+    mvc_suts_ftype = apply_fuel_dist(
+        mvc_suts_=mvc_suts, mvs303fueldist_=mvs303fueldist_
+    )
 
     # Filter to TOD and Estimate VMT-Mix
     # ----------------------------------------------------------------------------------
-    tod_map = {
-        "AM": (6, 7, 8),
-        "MD": (9, 10, 11, 12, 13, 14, 15),
-        "PM": (16, 17, 18),
-        "ON": (19, 20, 21, 22, 23, 0, 1, 2, 3, 4, 5),
-    }
-    hours_ = list(chain(*tod_map.values()))
-    hours_.sort()
-    assert (set(hours_) == set(mvc_suts_ftype.hour)) & (
-        len(hours_) == len(set(mvc_suts_ftype.hour))
-    )
-    assert len(set(mvc_suts_ftype.district)) == 25
+    if "hour" in mvc_suts_ftype.columns:
+        hours_ = list(chain(*tod_map_.values()))
+        hours_.sort()
+        assert (set(hours_) == set(mvc_suts_ftype.hour)) & (
+            len(hours_) == len(set(mvc_suts_ftype.hour))
+        )
+    else:
+        # Counts summed to TOD periods in iv_mvc_hpms_counts (early_tod=True).
+        if tod_map_ != tod_map:
+            raise ValueError(
+                "Counts were summed to the utils.tod_map TOD periods in stage iv; run "
+                "stage iv with early_tod=False to use a different TOD map."
+            )
+    spatial_cols = get_spatial_cols(mvc_suts)
+    spatial_units = set(mvc_suts[spatial_cols[-1]])
+    if moves_vmt_fracs:
+        vmt_fracs = get_moves_vmt_fracs(mvc_suts_ftype_=mvc_suts_ftype)
     mvc_suts_ftype_tod = filt_to_tod(
-        mvc_suts_ftype_=mvc_suts_ftype, tod_map_=tod_map, txdist_=txdist
-    )
-    assert len(set(mvc_suts_ftype_tod.district)) == 25
-    mvc_suts_ftype_tod = mvc_suts_ftype_tod.sort_values(
+        mvc_suts_ftype_=mvc_suts_ftype, tod_map_=tod_map_, txdist_=txdist_
+    )
+    assert set(mvc_suts_ftype_tod[spatial_cols[-1]]) == spatial_units
+    mvc_suts_ftype_tod = add_labels(
+        vmt_mix_=mvc_suts_ftype_tod,
+        rdtype_labs_=rdtype_labs_,
+        sut_fueltype_codes_=sut_fueltype_codes,
+    ).sort_values(
         [
-            "district",
+            *spatial_cols,
             "yearID",
             "dowagg",
             "tod",
@@ -568,7 +752,62 @@ def fin_vmt_mix(out_file_nm="fin_vmtmix"):
             "fuelTypeID",
         ]
     ).reset_index(drop=True)
+    if moves_vmt_fracs:
+        return mvc_suts_ftype_tod, vmt_fracs
+    return mvc_suts_ftype_tod
+
+
+@timing
+def fin_vmt_mix(
+    out_file_nm="fin_vmtmix", moves_vmt_fracs=False, spatial_level="district"
+):
+    """
+    Apply the FAF4, and MOVES dist to the HPMS counts, filter data to different TODs,
+    and normalize the final counts to get the SUT-FT dist. Set `moves_vmt_fracs` to
+    True to also write the MOVES hourVMTFraction and dayVMTFraction tables
+    (`get_moves_vmt_fracs`) to output/<table name>_<mmyyyy>.csv. With `spatial_level`
+    "county", the VMT-Mix is computed from the county counts of stage iv and written to
+    output/<out_file_nm>_county_<mmyyyy>.csv only (the parquet dataset and the query
+    service are by district).
+    """
+    now_yr = str(datetime.datetime.now().year)
+    now_mnt = str(datetime.datetime.now().month).zfill(2)
+    now_mntyr = now_mnt + now_yr
+    sfx = "" if spatial_level == "district" else f"_{spatial_level}"
+    path_fin_vmtmix = Path.joinpath(path_output, f"{out_file_nm}{sfx}_{now_mntyr}.csv")
+    vmt_mix_inputs = read_vmt_mix_inputs(spatial_level=spatial_level)
+    mvc_suts_ftype_tod = vmt_mix_core(
+        mvc_vmtmix_long_=prc_mvc(mvc_vmtmix_=vmt_mix_inputs["mvc_vmtmix"]),
+        rdtype_labs_=get_rdtype_labs(mvc_vmtmix_=vmt_mix_inputs["mvc_vmtmix"]),
+        mvs303defaultsutdist_=vmt_mix_inputs["mvs303defaultsutdist"],
+        faf4_su_ct_lh_sh_pct_=vmt_mix_inputs["faf4_su_ct_lh_sh_pct"],
+        mvs303fueldist_=vmt_mix_inputs["mvs303fueldist"],
+        txdist_=vmt_mix_inputs["txdist"],
+        moves_vmt_fracs=moves_vmt_fracs,
+    )
+    if moves_vmt_fracs:
+        mvc_suts_ftype_tod, vmt_fracs = mvc_suts_ftype_tod
+        for tbl_nm, vmt_frac in vmt_fracs.items():
+            vmt_frac.to_csv(
+                Path.joinpath(path_output, f"{tbl_nm}{sfx}_{now_mntyr}.csv"),
+                index=False,
+            )
+    assert set(mvc_suts_ftype_tod.district) == set(vmt_mix_inputs["txdist"].district)
+    if spatial_level != "district":
+        assert set(mvc_suts_ftype_tod[spatial_level]) == set(
+            vmt_mix_inputs["mvc_vmtmix"][spatial_level]
+        )
+        mvc_suts_ftype_tod.to_csv(path_fin_vmtmix, index=False)
+        return
     mvc_suts_ftype_tod.to_csv(path_fin_vmtmix, index=False)
+    # Also write a district + yearID partitioned parquet dataset for slice queries
+    # (vmt_mix_store.get_vmt_mix); get_vmt_mix reads this run's dataset by default.
+    write_vmt_mix_dataset(
+        vmt_mix_=mvc_suts_ftype_tod, path_dataset=path_fin_vmtmix.with_suffix(".parquet")
+    )
+    set_latest_vmt_mix_dataset(path_dataset=path_fin_vmtmix.with_suffix(".parquet"))
+    # Publish the run to the query service (vmt_mix_service); running services reload.
+    publish_vmt_mix(vmt_mix_=mvc_suts_ftype_tod, run_nm=out_file_nm)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+"""
+Run variants (scenarios) of the final VMT-Mix without re-running the pipeline. The
+outputs of stages iv-vi are read once and the MVC counts are put in long format once
+(`vii_vmt_mix_disagg.prc_mvc`). Only the steps that depend on the scenario
+(`vii_vmt_mix_disagg.vmt_mix_core`, from the SUT split on) are run for each scenario,
+in a pool of processes.
+
+A scenario is a dict with a "name" and any of the following keys:
+    tod_map: TOD periods to hours (default `utils.tod_map`). Needs the hourly MVC
+        counts (stage iv run with early_tod=False).
+    sulht_pct: Single Unit Long Haul vs. Long Haul trucks fraction used for the FAF4
+        splits (default 0.103 from VIUS 2002, the stage v output).
+    excl_dg_imputed: Drop the district + road type groups imputed from the district
+        group counts (default False).
+    fuel_yr: Use the fuel distribution of this analysis year for all the analysis
+        years (default None, the fuel distribution of each analysis year).
+Created by: Apoorb
+Created on: 03/15/2023
+"""
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import pandas as pd
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
+from vmtmix_fy23.utils import (
+    get_validation_level,
+    path_faf,
+    path_inp,
+    path_interm,
+    path_output,
+    set_validation_level,
+    timing,
+)
+from vmtmix_fy23.vii_vmt_mix_disagg import (
+    get_rdtype_labs,
+    prc_mvc,
+    read_vmt_mix_inputs,
+    vmt_mix_core,
+)
+from vmtmix_fy23.vmt_mix_store import write_vmt_mix_dataset
+
+scenario_defaults = dict(
+    tod_map=None, sulht_pct=None, excl_dg_imputed=False, fuel_yr=None
+)
+
+
+def get_scenario_cfg(scenario, fuel_yrs=None):
+    """Check the scenario keys and fill the missing keys with `scenario_defaults`. The
+    fuel_yr has to be one of the `fuel_yrs` analysis years of the fuel distribution."""
+    if "name" not in scenario:
+        raise ValueError(f"Scenario {scenario} does not have a name.")
+    unknown_keys = set(scenario) - set(scenario_defaults) - {"name"}
+    if unknown_keys:
+        raise ValueError(
+            f"Scenario {scenario['name']} has unknown keys {sorted(unknown_keys)}."
+        )
+    scenario = {**scenario_defaults, **scenario}
+    if (
+        (fuel_yrs is not None)
+        and (scenario["fuel_yr"] is not None)
+        and (scenario["fuel_yr"] not in set(fuel_yrs))
+    ):
+        raise ValueError(
+            f"Scenario {scenario['name']} has fuel_yr {scenario['fuel_yr']}; the fuel "
+            "distribution has no such analysis year."
+        )
+    return scenario
+
+
+@timing
+def get_faf4_su_ct_lh_sh_pcts(sulht_pcts):
+    """
+    Get the SU and CT, Sh and Lh splits (stage v) for each of the `sulht_pcts` Single
+    Unit Long Haul vs. Long Haul trucks fractions. The FAF4 data are read and processed
+    once. The splits are written to the intermediate folder and read back, so that they
+    have the same dtypes as the stage v output (faf4_su_ct_lh_sh_pct.tab).
+    """
+    # geopandas is only needed if a scenario changes the SULhT fraction.
+    from vmtmix_fy23.v_SU_CT_sh_lh_dist import TrucksDist
+
+    truckdist = TrucksDist(path_faf_=path_faf, path_inp_=path_inp)
+    truckdist.read_data()
+    truckdist.prc_meta_faf4()
+    faf4_su_ct_lh_sh_pcts = {}
+    for sulht_pct in sulht_pcts:
+        vmt_dist_dict = truckdist.get_vmt_dist(
+            erg_crc_a88_vius2002_SULhT_pct=sulht_pct
+        )
+        path_out = Path.joinpath(
+            path_interm, f"faf4_su_ct_lh_sh_pct_sulht_{sulht_pct:g}.tab"
+        )
+        vmt_dist_dict["vmt_dist_tx"].to_csv(path_out, index=False, sep="\t")
+        faf4_su_ct_lh_sh_pcts[sulht_pct] = pd.read_csv(path_out, sep="\t")
+    return faf4_su_ct_lh_sh_pcts
+
+
+def run_scenario(
+    scenario,
+    mvc_vmtmix_long_,
+    rdtype_labs_,
+    mvs303defaultsutdist_,
+    faf4_su_ct_lh_sh_pct_,
+    mvs303fueldist_,
+    txdist_,
+    path_out,
+    validation,
+):
+    """Run `vmt_mix_core` for one scenario and write the VMT-Mix to `path_out`. Runs
+    in a worker process, so the validation level is passed on."""
+    set_validation_level(validation)
+    vmt_mix = vmt_mix_core(
+        mvc_vmtmix_long_=mvc_vmtmix_long_,
+        rdtype_labs_=rdtype_labs_,
+        mvs303defaultsutdist_=mvs303defaultsutdist_,
+        faf4_su_ct_lh_sh_pct_=faf4_su_ct_lh_sh_pct_,
+        mvs303fueldist_=mvs303fueldist_,
+        txdist_=txdist_,
+        tod_map_=scenario["tod_map"],
+        excl_dg_imputed=scenario["excl_dg_imputed"],
+        fuel_yr=scenario["fuel_yr"],
+    )
+    vmt_mix.to_csv(path_out, index=False)
+    write_vmt_mix_dataset(
+        vmt_mix_=vmt_mix, path_dataset=path_out.with_suffix(".parquet")
+    )
+    return path_out
+
+
+@timing
+def run_vmt_mix_scenarios(scenarios, out_file_nm="fin_vmtmix", n_jobs=1):
+    """
+    Compute the VMT-Mix for each scenario.
+
+    Parameters
+    ----------
+    scenarios: list
+        Scenario dicts (see the module docstring). The names have to be unique.
+    out_file_nm: str
+        The VMT-Mix of a scenario is written to
+        output/<out_file_nm>_<scenario name>_<mmyyyy>.csv and to a parquet dataset
+        (`vmt_mix_store.write_vmt_mix_dataset`) with the .parquet extension.
+    n_jobs: int
+        Number of processes the scenarios are run in. With n_jobs=1 the scenarios are
+        run one after another in this process. Each process gets a copy of the shared
+        MVC counts, so the number of processes is limited by the memory.
+    Returns
+    -------
+    dict
+        Scenario name to the path of its VMT-Mix.
+    """
+    now_mntyr = datetime.datetime.now().strftime("%m%Y")
+    # Shared inputs
+    # -------------
+    vmt_mix_inputs = read_vmt_mix_inputs()
+    fuel_yrs = set(vmt_mix_inputs["mvs303fueldist"].yearID)
+    scenarios = [
+        get_scenario_cfg(scenario, fuel_yrs=fuel_yrs) for scenario in scenarios
+    ]
+    scenario_nms = [scenario["name"] for scenario in scenarios]
+    if len(set(scenario_nms)) != len(scenario_nms):
+        raise ValueError("Scenario names are not unique.")
+    mvc_vmtmix_long = prc_mvc(mvc_vmtmix_=vmt_mix_inputs["mvc_vmtmix"])
+    rdtype_labs = get_rdtype_labs(mvc_vmtmix_=vmt_mix_inputs["mvc_vmtmix"])
+    sulht_pcts = sorted(
+        {s["sulht_pct"] for s in scenarios if s["sulht_pct"] is not None}
+    )
+    faf4_su_ct_lh_sh_pcts = {None: vmt_mix_inputs["faf4_su_ct_lh_sh_pct"]}
+    if sulht_pcts:
+        faf4_su_ct_lh_sh_pcts.update(get_faf4_su_ct_lh_sh_pcts(sulht_pcts))
+    # Scenarios
+    # ---------
+    tasks = {
+        scenario["name"]: dict(
+            scenario=scenario,
+            mvc_vmtmix_long_=mvc_vmtmix_long,
+            rdtype_labs_=rdtype_labs,
+            mvs303defaultsutdist_=vmt_mix_inputs["mvs303defaultsutdist"],
+            faf4_su_ct_lh_sh_pct_=faf4_su_ct_lh_sh_pcts[scenario["sulht_pct"]],
+            mvs303fueldist_=vmt_mix_inputs["mvs303fueldist"],
+            txdist_=vmt_mix_inputs["txdist"],
+            path_out=Path.joinpath(
+                path_output, f"{out_file_nm}_{scenario['name']}_{now_mntyr}.csv"
+            ),
+            validation=get_validation_level(),
+        )
+        for scenario in scenarios
+    }
+    if n_jobs == 1:
+        return {nm: run_scenario(**task) for nm, task in tasks.items()}
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {
+            nm: executor.submit(run_scenario, **task) for nm, task in tasks.items()
+        }
+        return {nm: future.result() for nm, future in futures.items()}
+
+
+if __name__ == "__main__":
+    run_vmt_mix_scenarios(
+        scenarios=[
+            dict(name="base"),
+            dict(name="sulht_15pct", sulht_pct=0.15),
+            dict(name="excl_dg_imputed", excl_dg_imputed=True),
+            dict(name="fuel_2020", fuel_yr=2020),
+        ],
+        n_jobs=4,
+    )
+    print(
+        "----------------------------------------------------------------------------\n"
+        "Finished Processing vmt_mix_scenarios.py\n"
+        "----------------------------------------------------------------------------\n"
+    )
@@ -0,0 +1,377 @@
+"""
+Local query service for the final VMT-Mix. A run is published as an Arrow IPC file
+sorted by district, yearID, dowagg, tod, and road type, and a latest.json pointer to it
+(`publish_vmt_mix`; fin_vmt_mix publishes each run). The service memory-maps the latest
+file, keeps an index of the (start, stop) rows of every key prefix, and answers slice
+and aggregate queries from zero-copy slices of the mapped file. It reloads when a new
+run is published.
+    python -m vmtmix_fy23.vmt_mix_service serve --port 8050
+    curl "localhost:8050/slice?district=Austin&year=2025&dowagg=Wkd&tod=AM"
+    curl "localhost:8050/agg?district=Austin&year=2025&by=sourceTypeName&fn=mean"
+    python -m vmtmix_fy23.vmt_mix_service query --district Austin --year 2025
+Created by: Apoorb
+Created on: 03/17/2023
+"""
+import argparse
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
+from vmtmix_fy23.utils import path_output
+
+path_vmt_mix_service = Path.joinpath(path_output, "vmt_mix_service")
+LATEST_FI = "latest.json"
+# Query parameter to column. The published file is sorted by these columns, in order.
+vmt_mix_key_params = {
+    "district": "district",
+    "year": "yearID",
+    "dowagg": "dowagg",
+    "tod": "tod",
+    "mvs_rdtype_nm": "mvs_rdtype_nm",
+}
+vmt_mix_key_cols = list(vmt_mix_key_params.values())
+agg_fns = ("sum", "mean", "min", "max", "count")
+# Number of published runs kept in the service folder (`prune_runs`).
+N_KEEP_RUNS = 3
+
+
+def prune_runs(path_service_dir, n_keep=N_KEEP_RUNS):
+    """Delete all but the `n_keep` most recently published runs. A run that a service
+    still has mapped cannot be deleted on Windows; it is skipped and deleted by a later
+    publish."""
+    path_ipcs = sorted(
+        Path(path_service_dir).glob("*.arrow"), key=lambda path: path.stat().st_mtime_ns
+    )
+    for path_ipc in path_ipcs[: max(len(path_ipcs) - n_keep, 0)]:
+        try:
+            path_ipc.unlink()
+        except OSError:
+            pass
+
+
+def publish_vmt_mix(
+    vmt_mix_, run_nm, path_service_dir=path_vmt_mix_service, n_keep=N_KEEP_RUNS
+):
+    """
+    Publish a VMT-Mix run to the query service: write it as an uncompressed Arrow IPC
+    file (so it can be memory-mapped) sorted by the key columns, and point latest.json
+    to it. The pointer is replaced atomically, so a service never sees a partial run.
+    The `n_keep` most recent runs are kept (`prune_runs`); a service may still have
+    the previous runs mapped.
+
+    Parameters
+    ----------
+    vmt_mix_: pd.DataFrame
+        Final VMT-Mix.
+    run_nm: str
+        Name of the run, used in the file name.
+    path_service_dir: Path
+        Folder with the published runs and latest.json.
+    n_keep: int
+        Number of published runs to keep, including this one.
+    Returns
+    -------
+    Path
+        Path of the Arrow IPC file.
+    """
+    path_service_dir = Path(path_service_dir)
+    path_service_dir.mkdir(parents=True, exist_ok=True)
+    now = datetime.datetime.now()
+    path_ipc = Path.joinpath(
+        path_service_dir, f"{run_nm}_{now.strftime('%Y%m%d_%H%M%S_%f')}.arrow"
+    )
+    vmt_mix_ = vmt_mix_.sort_values(vmt_mix_key_cols, kind="stable").reset_index(
+        drop=True
+    )
+    # Dictionary-encode the labels; the file is ~10x smaller than with plain strings.
+    str_cols = [
+        col
+        for col in vmt_mix_.columns
+        if not pd.api.types.is_numeric_dtype(vmt_mix_[col])
+    ]
+    vmt_mix_ = vmt_mix_.astype({col: "category" for col in str_cols})
+    tbl = pa.Table.from_pandas(vmt_mix_, preserve_index=False)
+    with pa.OSFile(str(path_ipc), "wb") as sink:
+        with pa.ipc.new_file(sink, tbl.schema) as writer:
+            writer.write_table(tbl)
+    path_latest = Path.joinpath(path_service_dir, LATEST_FI)
+    path_latest_tmp = path_latest.with_suffix(".json.tmp")
+    path_latest_tmp.write_text(
+        json.dumps(
+            {"run_nm": run_nm, "ipc_fi": path_ipc.name, "published": now.isoformat()}
+        )
+    )
+    os.replace(path_latest_tmp, path_latest)
+    prune_runs(path_service_dir, n_keep=n_keep)
+    return path_ipc
+
+
+class VmtMixIndex:
+    """
+    Memory-mapped VMT-Mix run with an index of the row ranges of every key prefix:
+    (district), (district, yearID), ..., (district, yearID, dowagg, tod, mvs_rdtype_nm).
+
+    Parameters
+    ----------
+    path_ipc: Path
+        Arrow IPC file written by `publish_vmt_mix`.
+    run_info: dict, optional
+        Contents of latest.json for the run.
+    """
+
+    def __init__(self, path_ipc, run_info=None):
+        self.path_ipc = Path(path_ipc)
+        self.run_info = run_info or {}
+        self.tbl = pa.ipc.open_file(pa.memory_map(str(self.path_ipc), "r")).read_all()
+        keys = self.tbl.select(vmt_mix_key_cols).to_pandas()
+        self.prefix_index = [{}]
+        self.prefix_index[0][()] = (0, len(keys))
+        for n_key in range(1, len(vmt_mix_key_cols) + 1):
+            prefix_keys = keys[vmt_mix_key_cols[:n_key]]
+            new_key = (prefix_keys != prefix_keys.shift()).any(axis=1).to_numpy()
+            starts = list(new_key.nonzero()[0]) + [len(keys)]
+            prefix_vals = prefix_keys.iloc[starts[:-1]].itertuples(index=False)
+            self.prefix_index.append(
+                {
+                    tuple(val): (int(start), int(stop))
+                    for val, start, stop in zip(prefix_vals, starts[:-1], starts[1:])
+                }
+            )
+        assert len(self.prefix_index[-1]) == len(
+            keys[vmt_mix_key_cols].drop_duplicates()
+        ), f"{self.path_ipc} is not sorted by {vmt_mix_key_cols}."
+        # Codes of the full keys, for the queries that are not a prefix of the keys.
+        full_keys = pd.DataFrame(
+            list(self.prefix_index[-1].keys()), columns=vmt_mix_key_cols
+        )
+        full_ranges = np.array(list(self.prefix_index[-1].values()), dtype=np.int64)
+        self.full_starts, self.full_stops = full_ranges[:, 0], full_ranges[:, 1]
+        self.key_codes, self.key_code_maps = {}, {}
+        for col in vmt_mix_key_cols:
+            codes, uniques = pd.factorize(full_keys[col])
+            self.key_codes[col] = codes
+            self.key_code_maps[col] = {val: code for code, val in enumerate(uniques)}
+
+    def get_key_vals(self, key_vals):
+        """Key values in the sort order; None for the keys that are not given."""
+        unknown = set(key_vals) - set(vmt_mix_key_params)
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)}.")
+        vals = [key_vals.get(param) for param in vmt_mix_key_params]
+        if vals[1] is not None:
+            vals[1] = int(vals[1])  # year
+        return vals
+
+    def get_slice(self, **key_vals):
+        """
+        Rows matching the key values (query parameter names in `vmt_mix_key_params`;
+        missing or None matches all). If the given keys are a prefix of the sort order,
+        the rows are one lookup and a zero-copy slice; otherwise the matching full keys
+        are found with the key codes and their rows are taken.
+        """
+        vals = self.get_key_vals(key_vals)
+        n_prefix = 0
+        while (n_prefix < len(vals)) and (vals[n_prefix] is not None):
+            n_prefix += 1
+        if all(val is None for val in vals[n_prefix:]):
+            rng = self.prefix_index[n_prefix].get(tuple(vals[:n_prefix]))
+            if rng is None:
+                return self.tbl.slice(0, 0)
+            return self.tbl.slice(rng[0], rng[1] - rng[0])
+        mask = np.ones(len(self.full_starts), dtype=bool)
+        for col, val in zip(vmt_mix_key_cols, vals):
+            if val is not None:
+                mask &= self.key_codes[col] == self.key_code_maps[col].get(val, -2)
+        starts, stops = self.full_starts[mask], self.full_stops[mask]
+        # Merge the adjacent ranges; a few ranges are zero-copy slices.
+        new_run = np.ones(len(starts), dtype=bool)
+        new_run[1:] = starts[1:] != stops[:-1]
+        starts, stops = starts[new_run], stops[np.append(new_run[1:], True)]
+        if len(starts) == 0:
+            return self.tbl.slice(0, 0)
+        if len(starts) <= 64:
+            return pa.concat_tables(
+                [
+                    self.tbl.slice(start, stop - start)
+                    for start, stop in zip(starts, stops)
+                ]
+            )
+        lens = stops - starts
+        offsets = np.repeat(starts - np.cumsum(lens) + lens, lens)
+        return self.tbl.take(offsets + np.arange(lens.sum()))
+
+    def get_agg(self, by, value="vmt_mix", fn="sum", **key_vals):
+        """Aggregate `value` with `fn` by the `by` columns over the matching rows."""
+        if fn not in agg_fns:
+            raise ValueError(f"fn should be one of {agg_fns}.")
+        slice_ = self.get_slice(**key_vals)
+        by = [by] if isinstance(by, str) else list(by)
+        agg = slice_.group_by(by).aggregate([(value, fn)])
+        # Decode the dictionary-encoded labels; arrow cannot sort by them.
+        agg = pa.table(
+            {
+                field.name: col.cast(field.type.value_type)
+                if pa.types.is_dictionary(field.type)
+                else col
+                for field, col in zip(agg.schema, agg.columns)
+            }
+        )
+        return agg.sort_by([(col, "ascending") for col in by])
+
+
+class VmtMixService:
+    """
+    Serve the latest published VMT-Mix run. `get_index` checks latest.json (a stat
+    call) and reloads the index when a new run is published; the queries in flight
+    keep the index they started with.
+    """
+
+    def __init__(self, path_service_dir=path_vmt_mix_service):
+        self.path_service_dir = Path(path_service_dir)
+        self.path_latest = Path.joinpath(self.path_service_dir, LATEST_FI)
+        self.latest_mtime_ns = None
+        self.index = None
+        self.lock = threading.Lock()
+
+    def get_index(self):
+        mtime_ns = self.path_latest.stat().st_mtime_ns
+        if mtime_ns != self.latest_mtime_ns:
+            with self.lock:
+                if mtime_ns != self.latest_mtime_ns:
+                    run_info = json.loads(self.path_latest.read_text())
+                    self.index = VmtMixIndex(
+                        Path.joinpath(self.path_service_dir, run_info["ipc_fi"]),
+                        run_info=run_info,
+                    )
+                    self.latest_mtime_ns = mtime_ns
+        return self.index
+
+    def query(self, params):
+        """
+        Answer a query. `params` has the key values (`vmt_mix_key_params`), and for an
+        aggregate query, "by" (comma separated columns), "value", and "fn".
+        """
+        index = self.get_index()
+        params = dict(params)
+        by = params.pop("by", None)
+        value = params.pop("value", "vmt_mix")
+        fn = params.pop("fn", "sum")
+        if by is None:
+            tbl = index.get_slice(**params)
+        else:
+            tbl = index.get_agg(by=by.split(","), value=value, fn=fn, **params)
+        return index, tbl
+
+
+def make_handler(service):
+    """HTTP handler for `service`: GET /slice, /agg, and /run."""
+
+    class VmtMixHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: vals[-1] for key, vals in parse_qs(url.query).items()}
+            try:
+                if url.path == "/run":
+                    self.send_json(200, service.get_index().run_info)
+                    return
+                if url.path not in ("/slice", "/agg"):
+                    self.send_json(404, {"error": f"Unknown path {url.path}."})
+                    return
+                if (url.path == "/agg") and ("by" not in params):
+                    raise ValueError("/agg needs the by parameter.")
+                if url.path == "/slice":
+                    params.pop("by", None)
+                index, tbl = service.query(params)
+                self.send_json(
+                    200,
+                    {"run_nm": index.run_info.get("run_nm"), "rows": tbl.to_pylist()},
+                )
+            except OSError as err:
+                # No published run yet, or the run file was pruned or cannot be read.
+                self.send_json(503, {"error": str(err)})
+            except (KeyError, ValueError, TypeError, pa.ArrowException) as err:
+                # Arrow errors are queries it cannot run, e.g. summing a label.
+                self.send_json(400, {"error": str(err)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return VmtMixHandler
+
+
+def serve(host="127.0.0.1", port=8050, path_service_dir=path_vmt_mix_service):
+    """Serve the VMT-Mix queries over HTTP until interrupted."""
+    service = VmtMixService(path_service_dir=path_service_dir)
+    service.get_index()
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving {service.index.path_ipc.name} on http://{host}:{port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VMT-Mix query service.")
+    parser.add_argument("--dir", default=str(path_vmt_mix_service))
+    subparsers = parser.add_subparsers(dest="cmd", required=True)
+    parser_serve = subparsers.add_parser("serve", help="Serve queries over HTTP.")
+    parser_serve.add_argument("--host", default="127.0.0.1")
+    parser_serve.add_argument("--port", type=int, default=8050)
+    parser_query = subparsers.add_parser("query", help="Query the latest run.")
+    for param in vmt_mix_key_params:
+        parser_query.add_argument(f"--{param}", default=None)
+    parser_query.add_argument("--by", default=None, help="Comma separated columns.")
+    parser_query.add_argument("--value", default="vmt_mix")
+    parser_query.add_argument("--fn", default="sum", choices=agg_fns)
+    parser_publish = subparsers.add_parser("publish", help="Publish a VMT-Mix csv.")
+    parser_publish.add_argument("path_csv")
+    parser_publish.add_argument("--run-nm", default=None)
+    args = parser.parse_args(argv)
+    if args.cmd == "serve":
+        serve(host=args.host, port=args.port, path_service_dir=args.dir)
+    elif args.cmd == "query":
+        params = {
+            param: getattr(args, param)
+            for param in vmt_mix_key_params
+            if getattr(args, param) is not None
+        }
+        if args.by is not None:
+            params.update(by=args.by, value=args.value, fn=args.fn)
+        _, tbl = VmtMixService(path_service_dir=args.dir).query(params)
+        print(tbl.to_pandas().to_string(index=False))
+    elif args.cmd == "publish":
+        path_csv = Path(args.path_csv)
+        run_nm = args.run_nm if args.run_nm is not None else path_csv.stem
+        path_ipc = publish_vmt_mix(
+            pd.read_csv(path_csv), run_nm=run_nm, path_service_dir=args.dir
+        )
+        print(f"Published {path_ipc}")
+
+
+if __name__ == "__main__":
+    main()
+    print(
+        "----------------------------------------------------------------------------\n"
+        "Finished Processing vmt_mix_service.py\n"
+        "----------------------------------------------------------------------------\n"
+    )
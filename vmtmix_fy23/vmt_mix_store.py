@@ -0,0 +1,172 @@
+"""
+Store the final VMT-Mix as a parquet dataset and read slices of it. The dataset is
+partitioned by district and yearID (hive folders district=<district>/yearID=<year>),
+and each file is sorted by dowagg, tod, and road type with one row group per dowagg +
+tod, so the row group statistics let the reader skip everything but the requested
+slice. Use `get_vmt_mix` to read a slice:
+    get_vmt_mix(district="Austin", year=2020, dowagg="Wkd", tod="AM")
+Created by: Apoorb
+Created on: 03/16/2023
+"""
+import json
+import shutil
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import quote
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname("__file__"), "..")))
+from vmtmix_fy23.utils import path_output, timing
+
+vmt_mix_partitioning = ds.partitioning(
+    pa.schema([("district", pa.string()), ("yearID", pa.int64())]), flavor="hive"
+)
+vmt_mix_sort_cols = [
+    "district",
+    "yearID",
+    "dowagg",
+    "tod",
+    "mvs_rdtype_nm",
+    "sourceTypeID",
+    "fuelTypeID",
+]
+# Column order of the VMT-Mix; the partition columns are not stored in the files.
+COLS_KEY = b"vmtmix_columns"
+# Pointer to the VMT-Mix dataset of the latest base run in the output folder.
+LATEST_FI = "fin_vmtmix_latest.json"
+
+
+@timing
+def write_vmt_mix_dataset(vmt_mix_, path_dataset):
+    """
+    Write the VMT-Mix to a parquet dataset partitioned by district and yearID. An
+    existing dataset at `path_dataset` is replaced.
+
+    Parameters
+    ----------
+    vmt_mix_: pd.DataFrame
+        VMT-Mix from `vii_vmt_mix_disagg.vmt_mix_core`.
+    path_dataset: Path
+        Root folder of the dataset.
+    """
+    path_dataset = Path(path_dataset)
+    if path_dataset.exists():
+        shutil.rmtree(path_dataset)
+    vmt_mix_ = vmt_mix_.sort_values(vmt_mix_sort_cols).reset_index(drop=True)
+    cols = list(vmt_mix_.columns)
+    file_cols = [col for col in cols if col not in ("district", "yearID")]
+    tbl = pa.Table.from_pandas(vmt_mix_[file_cols], preserve_index=False)
+    tbl = tbl.replace_schema_metadata(
+        {**(tbl.schema.metadata or {}), COLS_KEY: json.dumps(cols).encode()}
+    )
+    # Rows are sorted, so each partition and each dowagg + tod row group is a
+    # contiguous slice.
+    part_keys = vmt_mix_[["district", "yearID"]]
+    rg_keys = vmt_mix_[["district", "yearID", "dowagg", "tod"]]
+    new_part = (part_keys != part_keys.shift()).any(axis=1).to_numpy()
+    new_rg = (rg_keys != rg_keys.shift()).any(axis=1).to_numpy()
+    part_starts = list(new_part.nonzero()[0]) + [len(vmt_mix_)]
+    for start, stop in zip(part_starts[:-1], part_starts[1:]):
+        district, year_id = part_keys.district.iat[start], part_keys.yearID.iat[start]
+        path_part = Path.joinpath(
+            path_dataset,
+            f"district={quote(str(district), safe='')}",
+            f"yearID={year_id}",
+        )
+        path_part.mkdir(parents=True, exist_ok=True)
+        rg_starts = list(start + new_rg[start:stop].nonzero()[0]) + [stop]
+        with pq.ParquetWriter(
+            Path.joinpath(path_part, "part-0.parquet"), tbl.schema
+        ) as writer:
+            for rg_start, rg_stop in zip(rg_starts[:-1], rg_starts[1:]):
+                writer.write_table(tbl.slice(rg_start, rg_stop - rg_start))
+
+
+def set_latest_vmt_mix_dataset(path_dataset):
+    """Point `get_latest_vmt_mix_dataset` to `path_dataset`. Only the base run
+    (`vii_vmt_mix_disagg.fin_vmt_mix`) sets the pointer, so the scenario datasets
+    (`vmt_mix_scenarios`) are never read as the VMT-Mix by default."""
+    path_dataset = Path(path_dataset)
+    if path_dataset.parent == path_output:
+        path_dataset = Path(path_dataset.name)
+    with open(Path.joinpath(path_output, LATEST_FI), "w") as fi:
+        json.dump({"path_dataset": path_dataset.as_posix()}, fi)
+
+
+def get_latest_vmt_mix_dataset():
+    """VMT-Mix dataset of the latest base run (`set_latest_vmt_mix_dataset`)."""
+    path_latest = Path.joinpath(path_output, LATEST_FI)
+    if not path_latest.exists():
+        raise FileNotFoundError(
+            f"No {path_latest}; run vii_vmt_mix_disagg.fin_vmt_mix or pass "
+            "path_dataset."
+        )
+    with open(path_latest) as fi:
+        return Path.joinpath(path_output, json.load(fi)["path_dataset"])
+
+
+@lru_cache(maxsize=8)
+def open_vmt_mix_dataset(path_dataset, mtime_ns):
+    """Discover the dataset files once; `mtime_ns` of the root folder changes when the
+    dataset is rewritten."""
+    return ds.dataset(
+        path_dataset, format="parquet", partitioning=vmt_mix_partitioning
+    )
+
+
+def get_vmt_mix(
+    district=None, year=None, dowagg=None, tod=None, columns=None, path_dataset=None
+):
+    """
+    Read a slice of the VMT-Mix. Each of `district`, `year`, `dowagg`, and `tod` can be
+    a value, a list of values, or None (all). Only the matching partitions and row
+    groups are read.
+
+    Parameters
+    ----------
+    district: str or list, optional
+    year: int or list, optional
+        Analysis year (yearID).
+    dowagg: str or list, optional
+        Wkd, Fri, Sat, or Sun.
+    tod: str or list, optional
+        TOD period or "day".
+    columns: list, optional
+        Columns to return. Defaults to all the VMT-Mix columns.
+    path_dataset: Path, optional
+        Dataset written by `write_vmt_mix_dataset`. Defaults to the dataset of the
+        latest base run (`get_latest_vmt_mix_dataset`).
+    Returns
+    -------
+    pd.DataFrame
+        Sorted by district, yearID, dowagg, tod, road type, SUT, and fuel type.
+    """
+    path_dataset = (
+        get_latest_vmt_mix_dataset() if path_dataset is None else Path(path_dataset)
+    )
+    dataset = open_vmt_mix_dataset(str(path_dataset), path_dataset.stat().st_mtime_ns)
+    filt = None
+    for col, val in [
+        ("district", district),
+        ("yearID", year),
+        ("dowagg", dowagg),
+        ("tod", tod),
+    ]:
+        if val is None:
+            continue
+        if isinstance(val, (list, tuple, set)):
+            col_filt = pc.field(col).isin(list(val))
+        else:
+            col_filt = pc.field(col) == val
+        filt = col_filt if filt is None else filt & col_filt
+    all_cols = json.loads(dataset.schema.metadata[COLS_KEY])
+    columns = all_cols if columns is None else list(columns)
+    read_cols = list(dict.fromkeys(columns + vmt_mix_sort_cols))
+    tbl = dataset.to_table(columns=read_cols, filter=filt)
+    tbl = tbl.sort_by([(col, "ascending") for col in vmt_mix_sort_cols])
+    return tbl.select(columns).to_pandas()